@@ -0,0 +1,141 @@
+# frontend-streamlit/app/api_client/async_client.py
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from api_client.transport import DEFAULT_RETRY, IDEMPOTENT_METHODS, UPLOAD_RETRY, RetryPolicy, should_retry_status
+
+logger = logging.getLogger(__name__)
+
+
+def _is_connect_failure(error: Exception) -> bool:
+    """接続の確立 (リクエストの送信前) に失敗したか。証明書の検証エラーは再試行しても成功しない"""
+    return isinstance(error, aiohttp.ClientConnectorError) and not isinstance(error, aiohttp.ClientConnectorCertificateError)
+
+
+class AsyncAPIClient:
+    """
+    asyncio版のAPIクライアント。大量のファイルを並行してアップロードする用途を想定している。
+    接続はベースURLごとにプールして再利用し、同時実行数は max_concurrency に制限する
+    (アップロード先のレーンの同時実行数を超えると、受付制御のキュー待ちや429が増えるだけになる)。
+    ファイル本体はメモリに読み込まず、送信時にディスクから順に読み出す。
+
+        async with AsyncAPIClient(API_PYTHON_RAG_URL, token=token, max_concurrency=2) as client:
+            results = await asyncio.gather(*(client.upload_file(path, f"/api/v1/lectures/{lecture_id}/upload") for path in paths))
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        max_concurrency: int = 4,
+        retry: RetryPolicy = DEFAULT_RETRY,
+        timeout_seconds: float = 300,
+        upload_retry: RetryPolicy = UPLOAD_RETRY,
+    ):
+        self.base_url = base_url
+        self.retry = retry
+        self.upload_retry = upload_retry
+        self._headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._connector_limit = max_concurrency
+        self._timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AsyncAPIClient":
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._connector_limit),
+            headers=self._headers,
+            timeout=self._timeout,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def _send(self, method: str, path: str, body_factory=None, retry: Optional[RetryPolicy] = None, **kwargs) -> aiohttp.ClientResponse:
+        """
+        リクエストを送信し、5xx/429 と接続エラーを指数バックオフで再試行する。
+        ファイル本体は再送のたびに作り直す必要があるため、body_factory から毎回生成する。
+        """
+        retry = retry or self.retry
+        url = f"{self.base_url}{path}"
+        first_started = time.monotonic()
+        for attempt in range(1, retry.max_attempts + 1):
+            if body_factory is not None:
+                kwargs["data"] = body_factory()
+            try:
+                response = await self._session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # 冪等でないリクエストは、接続の確立に失敗した (送信していない) 場合のみ再試行する。
+                # ServerDisconnectedError やタイムアウトは送信後にも起こり、再送すると二重に処理されうる
+                retryable = method.upper() in IDEMPOTENT_METHODS or _is_connect_failure(e)
+                delay = retry.delay(attempt)
+                if not retryable or not retry.should_retry(attempt, time.monotonic() - first_started, delay):
+                    raise
+                logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if not should_retry_status(method, response.status):
+                return response
+            delay = retry.delay(attempt, response.headers.get("Retry-After"))
+            if not retry.should_retry(attempt, time.monotonic() - first_started, delay):
+                return response
+            logger.warning(f"{method} {url} returned {response.status}, retrying in {delay:.1f}s")
+            response.release()
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def request_json(self, method: str, path: str, **kwargs) -> Any:
+        async with self._semaphore:
+            response = await self._send(method, path, **kwargs)
+            async with response:
+                response.raise_for_status()
+                return await response.json()
+
+    async def upload_file(self, file_path: str, path: str, field_name: str = "file") -> Dict[str, Any]:
+        """ファイルをストリーミングでアップロードし、JSON応答を返す"""
+        opened = []
+
+        def build_form() -> aiohttp.FormData:
+            file = open(file_path, "rb")
+            opened.append(file)
+            form = aiohttp.FormData()
+            form.add_field(
+                field_name,
+                file,
+                filename=os.path.basename(file_path),
+                content_type="application/octet-stream",
+            )
+            return form
+
+        async with self._semaphore:
+            try:
+                response = await self._send("POST", path, body_factory=build_form, retry=self.upload_retry)
+            finally:
+                for file in opened:
+                    file.close()
+            async with response:
+                if response.status >= 400:
+                    detail = await response.text()
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status, message=detail
+                    )
+                return await response.json()
+
+    async def stream_ndjson(self, method: str, path: str, **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """改行区切りJSONのストリーミング応答 (チャットの逐次応答など) を1行ずつ返す"""
+        async with self._semaphore:
+            response = await self._send(method, path, **kwargs)
+            async with response:
+                response.raise_for_status()
+                async for line in response.content:
+                    if line.strip():
+                        yield json.loads(line)
@@ -0,0 +1,115 @@
+# frontend-streamlit/app/api_client/cache.py
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# この秒数を過ぎた値は、次の参照時にバックグラウンドで取得し直す
+CACHE_TTL_SECONDS = float(os.getenv("FRONTEND_CACHE_TTL_SECONDS", "30"))
+# この秒数を過ぎた値は使わず、取得が終わるまで待つ
+CACHE_MAX_STALE_SECONDS = float(os.getenv("FRONTEND_CACHE_MAX_STALE_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("FRONTEND_CACHE_MAX_ENTRIES", "10000"))
+
+
+@dataclass
+class _Entry:
+    value: Any
+    fetched_at: float
+
+
+class BackendCache:
+    """
+    バックエンドAPIの応答を、Streamlitの再実行をまたいでプロセス内に保持するキャッシュ。
+    キーは (名前空間, トークンのSHA-256ダイジェスト, 引数) で、利用者ごとに分離される。
+    TTLを過ぎた値はそのまま返しつつバックグラウンドで取得し直し (stale-while-revalidate)、
+    max_stale を過ぎた値や無効化された値は、取得が終わるまで待つ。
+    """
+
+    def __init__(self, ttl_seconds: float, max_stale_seconds: float, max_entries: int):
+        self._ttl_seconds = ttl_seconds
+        self._max_stale_seconds = max_stale_seconds
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._refreshing: set = set()
+        # 無効化のたびに増える世代番号。取得中に無効化された場合は、取得した古い値を保存しない
+        self._generations: Dict[Tuple, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="backend-cache")
+        self._stats: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def _key(namespace: str, token: Optional[str], args: Tuple) -> Tuple:
+        digest = hashlib.sha256(token.encode("utf-8")).digest() if token else b""
+        return (namespace, digest, args)
+
+    def get(self, namespace: str, token: Optional[str], loader: Callable[[], Any], *args: Any) -> Any:
+        key = self._key(namespace, token, args)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.fetched_at
+                if age < self._ttl_seconds:
+                    self._stats["hits"] += 1
+                    return entry.value
+                if age < self._max_stale_seconds:
+                    self._stats["stale_hits"] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(self._refresh, key, loader, self._generations.get(key[:2], 0))
+                    return entry.value
+            self._stats["misses"] += 1
+            generation = self._generations.get(key[:2], 0)
+
+        # キャッシュにない場合は呼び出し元で取得する (例外はそのまま呼び出し元に伝える)
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    def _refresh(self, key: Tuple, loader: Callable[[], Any], generation: int):
+        try:
+            self._store(key, loader(), generation)
+        except Exception as e:
+            # 古い値を使い続け、max_stale を過ぎたら呼び出し元での取得に切り替わる
+            logger.warning(f"Background refresh of {key[0]} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: Tuple, value: Any, generation: int):
+        with self._lock:
+            if self._generations.get(key[:2], 0) != generation:
+                return
+            # 取得した順に並べ、上限を超えたら最も古く取得したエントリから捨てる
+            self._entries[key] = _Entry(value=value, fetched_at=time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace: str, token: Optional[str]):
+        """トークンに紐づく名前空間のエントリをすべて無効化する (作成・アップロードなどの更新後に呼ぶ)"""
+        _, digest, _ = self._key(namespace, token, ())
+        with self._lock:
+            self._generations[(namespace, digest)] += 1
+            for key in [k for k in self._entries if k[0] == namespace and k[1] == digest]:
+                del self._entries[key]
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+
+backend_cache = BackendCache(
+    ttl_seconds=CACHE_TTL_SECONDS,
+    max_stale_seconds=CACHE_MAX_STALE_SECONDS,
+    max_entries=CACHE_MAX_ENTRIES,
+)
@@ -1,52 +1,72 @@
 # frontend-streamlit/app/api_client/python_rag_api.py
 
 import os
-import requests
-import json
-from typing import Dict, Any, IO
+from typing import Dict, Any, IO, Iterator
+
+from api_client.transport import UPLOAD_RETRY, request, iter_ndjson
 
 # 環境変数からPython RAG APIのベースURLを取得
 API_PYTHON_RAG_URL = os.getenv("API_PYTHON_RAG_URL", "http://localhost:8001")
 
+def _chat_payload(query: str, system_prompt: str = None, session_id: str = None) -> Dict[str, Any]:
+    payload = {"query": query}
+    if system_prompt:
+        payload["system_prompt"] = system_prompt
+    if session_id:
+        payload["session_id"] = session_id
+    return payload
+
 def upload_document(token: str, lecture_id: int, file: IO) -> Dict[str, Any]:
     """指定された講義にドキュメントをアップロードする"""
-    url = f"{API_PYTHON_RAG_URL}/api/v1/lectures/{lecture_id}/upload"
     headers = {"Authorization": f"Bearer {token}"}
     files = {"file": file}
-    
+
     # 認証はヘッダーで行うため、不要なクエリパラメータは削除する
-    response = requests.post(url, headers=headers, files=files, timeout=300)
+    response = request(API_PYTHON_RAG_URL, "POST", f"/api/v1/lectures/{lecture_id}/upload", headers=headers, files=files, timeout=300, retry=UPLOAD_RETRY)
     response.raise_for_status()
     return response.json()
 
-def post_chat_message(token: str, lecture_id: int, query: str, system_prompt: str = None) -> Dict[str, Any]:
-    """チャットメッセージを送信し、RAGによる回答を取得する"""
-    url = f"{API_PYTHON_RAG_URL}/api/v1/lectures/{lecture_id}/chat"
+def post_chat_message(token: str, lecture_id: int, query: str, system_prompt: str = None, session_id: str = None) -> Dict[str, Any]:
+    """チャットメッセージを送信し、RAGによる回答を取得する (session_idを渡すと会話を継続する)"""
     headers = {"Authorization": f"Bearer {token}"}
-    payload = {"query": query}
-    if system_prompt:
-        payload["system_prompt"] = system_prompt
-        
-    response = requests.post(url, headers=headers, json=payload, timeout=300) # タイムアウトを長めに設定
+    payload = _chat_payload(query, system_prompt, session_id)
+
+    response = request(API_PYTHON_RAG_URL, "POST", f"/api/v1/lectures/{lecture_id}/chat", headers=headers, json=payload, timeout=300) # タイムアウトを長めに設定
     response.raise_for_status()
     return response.json()
 
+def stream_chat_message(token: str, lecture_id: int, query: str, system_prompt: str = None, session_id: str = None) -> Iterator[Dict[str, Any]]:
+    """
+    チャットの回答を逐次受け取る。
+    {"type": "sources"} -> {"type": "delta"} の繰り返し -> {"type": "done"} (失敗時は {"type": "error"}) の順にイベントを返す
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = _chat_payload(query, system_prompt, session_id)
+
+    response = request(API_PYTHON_RAG_URL, "POST", f"/api/v1/lectures/{lecture_id}/chat/stream", headers=headers, json=payload, timeout=300, stream=True)
+    response.raise_for_status()
+    return iter_ndjson(response)
+
 def guest_upload_document(guest_id: str, file: IO) -> Dict[str, Any]:
     """ゲストとしてドキュメントをアップロードする"""
-    url = f"{API_PYTHON_RAG_URL}/api/v1/guest/{guest_id}/upload"
     files = {"file": file}
-    
-    response = requests.post(url, files=files, timeout=300)
+
+    response = request(API_PYTHON_RAG_URL, "POST", f"/api/v1/guest/{guest_id}/upload", files=files, timeout=300, retry=UPLOAD_RETRY)
     response.raise_for_status()
     return response.json()
 
-def guest_post_chat_message(guest_id: str, query: str, system_prompt: str = None) -> Dict[str, Any]:
+def guest_post_chat_message(guest_id: str, query: str, system_prompt: str = None, session_id: str = None) -> Dict[str, Any]:
     """ゲストとしてチャットメッセージを送信する"""
-    url = f"{API_PYTHON_RAG_URL}/api/v1/guest/{guest_id}/chat"
-    payload = {"query": query}
-    if system_prompt:
-        payload["system_prompt"] = system_prompt
-        
-    response = requests.post(url, json=payload, timeout=300)
+    payload = _chat_payload(query, system_prompt, session_id)
+
+    response = request(API_PYTHON_RAG_URL, "POST", f"/api/v1/guest/{guest_id}/chat", json=payload, timeout=300)
+    response.raise_for_status()
+    return response.json()
+
+def guest_stream_chat_message(guest_id: str, query: str, system_prompt: str = None, session_id: str = None) -> Iterator[Dict[str, Any]]:
+    """ゲストとしてチャットの回答を逐次受け取る (イベントの形式は stream_chat_message と同じ)"""
+    payload = _chat_payload(query, system_prompt, session_id)
+
+    response = request(API_PYTHON_RAG_URL, "POST", f"/api/v1/guest/{guest_id}/chat/stream", json=payload, timeout=300, stream=True)
     response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    return iter_ndjson(response)
\ No newline at end of file
@@ -0,0 +1,183 @@
+# frontend-streamlit/app/api_client/transport.py
+
+import email.utils
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+# 再試行する応答ステータス
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# POSTなど冪等でないリクエストは、サーバーが処理していないことが明らかな応答 (受付制御の429/503) のみ再試行する
+NON_IDEMPOTENT_RETRY_STATUSES = frozenset({429, 503})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 4
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    # 最初の送信からの経過時間の上限 (待機を含む)。超える場合は再試行せずに最後の結果を返す
+    deadline_seconds: Optional[float] = None
+
+    def should_retry(self, attempt: int, elapsed: float, delay: float) -> bool:
+        """attempt 回目 (1始まり) の失敗後、delay 秒待って再試行してよいか"""
+        if attempt >= self.max_attempts:
+            return False
+        return self.deadline_seconds is None or elapsed + delay <= self.deadline_seconds
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """attempt 回目 (1始まり) の失敗後の待機秒数。Retry-After があればそれに従う"""
+        if retry_after:
+            seconds = parse_retry_after(retry_after)
+            if seconds is not None:
+                return min(seconds, self.backoff_max)
+        # フルジッター付きの指数バックオフ
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+
+DEFAULT_RETRY = RetryPolicy()
+NO_RETRY = RetryPolicy(max_attempts=1)
+# アップロードは受付制御のレート制限 (429) を受けやすいため、Retry-After に従って待ち直す。
+# Streamlitではスクリプトのスレッドが待機中に止まるため、合計2分で打ち切ってエラーを表示させる
+# (POSTは 429/503 と接続前の失敗のみ再試行するため、処理済みのアップロードを再送することはない)
+UPLOAD_RETRY = RetryPolicy(max_attempts=8, backoff_max=60.0, deadline_seconds=120.0)
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value) if value else None
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def should_retry_status(method: str, status_code: int) -> bool:
+    statuses = RETRY_STATUSES if method.upper() in IDEMPOTENT_METHODS else NON_IDEMPOTENT_RETRY_STATUSES
+    return status_code in statuses
+
+
+def is_connect_failure(error: requests.RequestException) -> bool:
+    """
+    接続の確立 (リクエストの送信前) に失敗したか。冪等でないリクエストはこの場合のみ再試行する。
+    送信後の切断 (RemoteDisconnected など) もConnectionErrorになるが、サーバーが処理済みの可能性がある
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # HTTPAdapter は urllib3 の MaxRetryError (reason に元の例外を持つ) を包んで送出する
+    reason = getattr(error.args[0], "reason", error.args[0])
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+# --- 呼び出し時間の計測 ---
+
+# Streamlitはセッションごとのスクリプトを別スレッドで実行するため、スレッドごとに集計する
+_timings = threading.local()
+
+
+def reset_call_timings():
+    _timings.count = 0
+    _timings.seconds = 0.0
+
+
+def get_call_timings() -> Dict[str, float]:
+    """reset_call_timings() 以降に、このスレッドで行ったAPI呼び出しの回数と合計時間"""
+    return {"count": getattr(_timings, "count", 0), "seconds": getattr(_timings, "seconds", 0.0)}
+
+
+def _record_call(seconds: float):
+    _timings.count = getattr(_timings, "count", 0) + 1
+    _timings.seconds = getattr(_timings, "seconds", 0.0) + seconds
+
+
+# --- 接続プール付きセッション ---
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url: str, pool_maxsize: int = 16) -> requests.Session:
+    """ベースURLごとに共有するセッション。Keep-Aliveで接続を再利用する"""
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[base_url] = session
+        return session
+
+
+def _rewind(files: Optional[Dict[str, Any]]):
+    """再送前にファイルの読み取り位置を先頭に戻す"""
+    for value in (files or {}).values():
+        file = value[1] if isinstance(value, tuple) else value
+        if hasattr(file, "seek"):
+            file.seek(0)
+
+
+def request(
+    base_url: str,
+    method: str,
+    path: str,
+    retry: RetryPolicy = DEFAULT_RETRY,
+    **kwargs: Any,
+) -> requests.Response:
+    """
+    共有セッションでリクエストを送信し、5xx/429 と接続エラーを指数バックオフで再試行する。
+    最後の応答をそのまま返すため、エラー判定は呼び出し側で raise_for_status() を使う。
+    """
+    session = get_session(base_url)
+    url = f"{base_url}{path}"
+    files = kwargs.get("files")
+    first_started = time.monotonic()
+    for attempt in range(1, retry.max_attempts + 1):
+        if attempt > 1:
+            _rewind(files)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record_call(time.perf_counter() - started)
+            # 冪等でないリクエストは、サーバーに届いた可能性がある失敗 (読み取りタイムアウトや送信後の切断) では再試行しない
+            retryable = method.upper() in IDEMPOTENT_METHODS or is_connect_failure(e)
+            delay = retry.delay(attempt)
+            if not retryable or not retry.should_retry(attempt, time.monotonic() - first_started, delay):
+                raise
+            logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        _record_call(time.perf_counter() - started)
+
+        if not should_retry_status(method, response.status_code):
+            return response
+        delay = retry.delay(attempt, response.headers.get("Retry-After"))
+        if not retry.should_retry(attempt, time.monotonic() - first_started, delay):
+            return response
+        logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+        response.close()
+        time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def iter_ndjson(response: requests.Response) -> Iterator[Dict[str, Any]]:
+    """改行区切りJSONのストリーミング応答を1行ずつ読み出す"""
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
+    finally:
+        response.close()
@@ -4,13 +4,24 @@ import streamlit as st
 from requests.exceptions import HTTPError
 import uuid
 import logging
+import os
+import time
 
 from api_client import go_api, python_rag_api
 from api_client.python_rag_api import API_PYTHON_RAG_URL
+from api_client.cache import backend_cache
+from api_client.transport import reset_call_timings, get_call_timings
+
+# 再実行ごとの所要時間とバックエンド呼び出しの内訳をサイドバーに表示する (ログには常に出力する)
+SHOW_RERUN_TIMINGS = os.getenv("FRONTEND_SHOW_TIMINGS", "").lower() in ("1", "true")
+LECTURES_CACHE = "lectures"
 
 # --- ページ設定 & 初期化 ---
 st.set_page_config(page_title="OpenRAG", layout="wide")
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+rerun_started = time.perf_counter()
+reset_call_timings()
 
 # --- セッション状態の初期化 ---
 def init_session_state():
@@ -20,6 +31,7 @@ def init_session_state():
         "workspaces": [],
         "selected_workspace": None,
         "messages": [],
+        "chat_session_id": None, # RAGサービス側の会話セッションID
         "mode": None, # "guest" または None
     }
     for key, value in defaults.items():
@@ -28,6 +40,59 @@ def init_session_state():
 
 init_session_state()
 
+# --- バックエンド呼び出しのキャッシュと計測 ---
+def load_workspaces(token: str):
+    """ワークスペース一覧を取得する (再実行のたびにGo APIを呼ばないよう、トークンごとにキャッシュする)"""
+    return backend_cache.get(LECTURES_CACHE, token, lambda: go_api.get_lectures(token))
+
+def record_rerun_timing(page: str):
+    elapsed_ms = (time.perf_counter() - rerun_started) * 1e3
+    calls = get_call_timings()
+    logger.info(
+        f"Rerun of {page} took {elapsed_ms:.1f}ms "
+        f"(backend calls: {calls['count']}, {calls['seconds'] * 1e3:.1f}ms)"
+    )
+    st.session_state.last_rerun_timing = {
+        "page": page,
+        "elapsed_ms": elapsed_ms,
+        "backend_calls": calls["count"],
+        "backend_ms": calls["seconds"] * 1e3,
+    }
+
+def show_rerun_timing():
+    timing = st.session_state.get("last_rerun_timing")
+    if SHOW_RERUN_TIMINGS and timing:
+        st.caption(
+            f"前回の再実行: {timing['elapsed_ms']:.0f}ms "
+            f"(API呼び出し {timing['backend_calls']}回 / {timing['backend_ms']:.0f}ms) "
+            f"キャッシュ: {backend_cache.stats()}"
+        )
+
+# --- チャット回答の逐次表示 ---
+def render_streamed_answer(events) -> str:
+    """RAGサービスから逐次届く回答を表示し、参照ソースを付けた最終的な回答文を返す"""
+    result = {"sources": []}
+
+    def deltas():
+        for event in events:
+            if event["type"] == "sources":
+                st.session_state.chat_session_id = event.get("session_id")
+            elif event["type"] == "delta":
+                yield event["text"]
+            elif event["type"] == "done":
+                result["sources"] = event.get("sources", [])
+            elif event["type"] == "error":
+                raise RuntimeError(event.get("detail", "不明なエラーです。"))
+
+    response_text = st.write_stream(deltas()) or "回答を取得できませんでした。"
+    full_response = response_text
+    if result["sources"]:
+        sources_str = "\n- ".join(sorted(list(set(result["sources"]))))
+        sources_block = f"\n\n---\n**参照ソース:**\n- {sources_str}"
+        st.markdown(sources_block)
+        full_response += sources_block
+    return full_response
+
 # --- ゲストページ ---
 def guest_page():
     st.session_state.setdefault("guest_id", str(uuid.uuid4()))
@@ -37,6 +102,7 @@ def guest_page():
     with st.sidebar:
         st.title("🗂️ OpenRAG (ゲスト)")
         st.info("ゲストモードでは、アップロードした資料はセッション終了時に破棄されます。")
+        show_rerun_timing()
 
         if st.button("ゲストセッションを終了"):
             # セッション状態をクリアして再実行
@@ -83,24 +149,20 @@ def guest_page():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("回答を生成中です..."):
-                try:
-                    response_data = python_rag_api.guest_post_chat_message(guest_id=st.session_state.guest_id, query=prompt)
-                    response_text = response_data.get("response", "回答を取得できませんでした。")
-                    sources = response_data.get("sources", [])
-                    
-                    full_response = response_text
-                    if sources:
-                        sources_str = "\n- ".join(sorted(list(set(sources))))
-                        full_response += f"\n\n---\n**参照ソース:**\n- {sources_str}"
-
-                    st.markdown(full_response)
-                    st.session_state.messages.append({"role": "assistant", "content": full_response})
+            try:
+                with st.spinner("回答を生成中です..."):
+                    events = python_rag_api.guest_stream_chat_message(
+                        guest_id=st.session_state.guest_id,
+                        query=prompt,
+                        session_id=st.session_state.chat_session_id
+                    )
+                full_response = render_streamed_answer(events)
+                st.session_state.messages.append({"role": "assistant", "content": full_response})
 
-                except Exception as e:
-                    error_msg = f"回答の生成中にエラーが発生しました: {e}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            except Exception as e:
+                error_msg = f"回答の生成中にエラーが発生しました: {e}"
+                st.error(error_msg)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
 
 # --- 認証ページ ---
 def login_page():
@@ -183,6 +245,7 @@ def main_page():
         st.title("🗂️ OpenRAG")
         if st.session_state.user_info:
             st.write(f"ようこそ、 **{st.session_state.user_info['username']}** さん")
+        show_rerun_timing()
         
         if st.button("ログアウト"):
             # セッション状態をクリアして再実行
@@ -213,6 +276,7 @@ def main_page():
                                     name=new_workspace_name,
                                     system_prompt=new_system_prompt
                                 )
+                            backend_cache.invalidate(LECTURES_CACHE, st.session_state.token)
                             st.success(f"ワークスペース「{new_workspace_name}」を作成しました。")
                             st.rerun() # リストを更新するために再実行
                         except Exception as e:
@@ -222,7 +286,7 @@ def main_page():
 
         # ワークスペースの選択
         try:
-            st.session_state.workspaces = go_api.get_lectures(st.session_state.token)
+            st.session_state.workspaces = load_workspaces(st.session_state.token)
         except Exception as e:
             st.error(f"ワークスペース一覧の取得に失敗しました: {e}")
             return
@@ -238,6 +302,7 @@ def main_page():
             if not st.session_state.selected_workspace or st.session_state.selected_workspace['id'] != selected_id:
                 st.session_state.selected_workspace = next((ws for ws in st.session_state.workspaces if ws['id'] == selected_id), None)
                 st.session_state.messages = []
+                st.session_state.chat_session_id = None
                 st.rerun()
         else:
             st.warning("利用可能なワークスペースがありません。")
@@ -258,6 +323,7 @@ def main_page():
                                     lecture_id=st.session_state.selected_workspace['id'],
                                     file=uploaded_file
                                 )
+                                backend_cache.invalidate(LECTURES_CACHE, st.session_state.token)
                                 st.success(f"ファイル「{result['filename']}」の処理が完了しました。")
                             except HTTPError as e:
                                 try:
@@ -288,36 +354,32 @@ def main_page():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("回答を生成中です..."):
-                try:
-                    response_data = python_rag_api.post_chat_message(
+            try:
+                with st.spinner("回答を生成中です..."):
+                    events = python_rag_api.stream_chat_message(
                         token=st.session_state.token,
                         lecture_id=st.session_state.selected_workspace['id'],
                         query=prompt,
-                        system_prompt=st.session_state.selected_workspace.get("system_prompt")
+                        system_prompt=st.session_state.selected_workspace.get("system_prompt"),
+                        session_id=st.session_state.chat_session_id
                     )
-                    
-                    response_text = response_data.get("response", "回答を取得できませんでした。")
-                    sources = response_data.get("sources", [])
-                    
-                    full_response = response_text
-                    if sources:
-                        sources_str = "\n- ".join(sorted(list(set(sources))))
-                        full_response += f"\n\n---\n**参照ソース:**\n- {sources_str}"
-
-                    st.markdown(full_response)
-                    st.session_state.messages.append({"role": "assistant", "content": full_response})
+                full_response = render_streamed_answer(events)
+                st.session_state.messages.append({"role": "assistant", "content": full_response})
 
-                except Exception as e:
-                    error_msg = f"回答の生成中にエラーが発生しました: {e}"
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            except Exception as e:
+                error_msg = f"回答の生成中にエラーが発生しました: {e}"
+                st.error(error_msg)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
 
 
 # --- メインロジック (ページの切り替え) ---
-if st.session_state.get("mode") == "guest":
-    guest_page()
-elif st.session_state.get("token"):
-    main_page()
-else:
-    login_page()
\ No newline at end of file
+# st.rerun() による中断でも計測できるよう、finally で記録する
+try:
+    if st.session_state.get("mode") == "guest":
+        guest_page()
+    elif st.session_state.get("token"):
+        main_page()
+    else:
+        login_page()
+finally:
+    record_rerun_timing(st.session_state.get("mode") or ("main" if st.session_state.get("token") else "login"))
\ No newline at end of file
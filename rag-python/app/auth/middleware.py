@@ -1,55 +1,130 @@
 # rag-python/app/auth/middleware.py
 
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
 import jwt
-from fastapi import Request, HTTPException, status
+from fastapi import Request, status
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, Field
+from pydantic import BaseModel, Field
 from core.config import settings
+from core.metrics import metrics
 
 class AuthClaims(BaseModel):
     user_id: int = Field(..., alias="user_id")
 
+# 認証が不要な公開パス (完全一致) と公開プレフィックスを1つの正規表現にまとめて事前コンパイルする
+PUBLIC_PATHS = ("/health", "/docs", "/openapi.json")
+PUBLIC_PREFIXES = ("/api/v1/guest",)
+_PUBLIC_ROUTE_PATTERN = re.compile(
+    "|".join(
+        [f"{re.escape(path)}$" for path in PUBLIC_PATHS]
+        + [re.escape(prefix) for prefix in PUBLIC_PREFIXES]
+    )
+)
+
+
+def is_public_path(path: str) -> bool:
+    return _PUBLIC_ROUTE_PATTERN.match(path) is not None
+
+
+def is_admin(claims: AuthClaims) -> bool:
+    return claims.user_id in settings.ADMIN_USER_IDS
+
+
+class TokenCache:
+    """
+    検証済みトークンのClaimsを保持するLRUキャッシュ。
+    キーはトークンのSHA-256ダイジェストで、トークン本体はメモリに残さない。
+    各エントリは `exp` (なければ ttl_seconds) を過ぎると無効になる。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[bytes, Tuple[AuthClaims, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[AuthClaims]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def put(self, key: bytes, claims: AuthClaims, exp: Optional[float]):
+        if self._max_entries <= 0:
+            return
+        expires_at = time.time() + self._ttl_seconds
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(max_entries=settings.AUTH_TOKEN_CACHE_SIZE, ttl_seconds=settings.AUTH_TOKEN_CACHE_TTL_SECONDS)
+
+
+def _reject(reason: str, detail: str) -> JSONResponse:
+    metrics.inc("auth_rejections_total", reason=reason)
+    return JSONResponse(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={"detail": detail},
+    )
+
+
 async def auth_middleware(request: Request, call_next):
-    # 認証が不要な公開パスを定義
-    public_paths = ["/health", "/docs", "/openapi.json"]
-    if request.url.path in public_paths or request.url.path.startswith("/api/v1/guest"):
-        return await call_next(request)
-    if request.method == "OPTIONS":
+    if request.method == "OPTIONS" or is_public_path(request.url.path):
         return await call_next(request)
 
     auth_header = request.headers.get("Authorization")
     if not auth_header:
-        return JSONResponse(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            content={"detail": "Authorization header is missing"},
-        )
-
-    try:
-        scheme, token = auth_header.split()
-        if scheme.lower() != "bearer":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication scheme",
-            )
+        return _reject("missing_header", "Authorization header is missing")
 
-        payload = jwt.decode(
-            token,
-            settings.JWT_SECRET_KEY,
-            algorithms=["HS256"],
-        )
-        claims = AuthClaims.model_validate(payload)
-        request.state.claims = claims
-
-    except jwt.PyJWTError as e:
-        return JSONResponse(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            content={"detail": f"Invalid token: {e}"},
-        )
-    except Exception as e:
-        return JSONResponse(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            content={"detail": "Could not validate credentials"},
-        )
+    parts = auth_header.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        return _reject("invalid_scheme", "Could not validate credentials")
+    token = parts[1]
+
+    cache_key = token_cache.digest(token)
+    claims = token_cache.get(cache_key)
+    if claims is not None:
+        metrics.inc("auth_token_cache_hits_total")
+    else:
+        metrics.inc("auth_token_cache_misses_total")
+        try:
+            payload = jwt.decode(
+                token,
+                settings.JWT_SECRET_KEY,
+                algorithms=["HS256"],
+            )
+            claims = AuthClaims.model_validate(payload)
+        except jwt.PyJWTError as e:
+            return _reject("invalid_token", f"Invalid token: {e}")
+        except Exception:
+            return _reject("invalid_claims", "Could not validate credentials")
+        token_cache.put(cache_key, claims, payload.get("exp"))
 
+    request.state.claims = claims
     response = await call_next(request)
-    return response
\ No newline at end of file
+    return response
@@ -0,0 +1,121 @@
+# rag-python/app/benchmarks/auth_middleware_bench.py
+"""
+auth_middleware のリクエストあたりのオーバーヘッドを、キャッシュ導入前の実装と比較する。
+
+    cd rag-python/app && python -m benchmarks.auth_middleware_bench --iterations 20000
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+
+import jwt
+from fastapi import Request, HTTPException, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from core.config import settings
+from auth.middleware import AuthClaims, auth_middleware, token_cache
+
+
+async def legacy_auth_middleware(request: Request, call_next):
+    """キャッシュ導入前の実装 (比較用)"""
+    public_paths = ["/health", "/docs", "/openapi.json"]
+    if request.url.path in public_paths or request.url.path.startswith("/api/v1/guest"):
+        return await call_next(request)
+    if request.method == "OPTIONS":
+        return await call_next(request)
+
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"detail": "Authorization header is missing"},
+        )
+
+    try:
+        scheme, token = auth_header.split()
+        if scheme.lower() != "bearer":
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid authentication scheme",
+            )
+
+        payload = jwt.decode(
+            token,
+            settings.JWT_SECRET_KEY,
+            algorithms=["HS256"],
+        )
+        claims = AuthClaims.model_validate(payload)
+        request.state.claims = claims
+
+    except jwt.PyJWTError as e:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"detail": f"Invalid token: {e}"},
+        )
+    except Exception:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"detail": "Could not validate credentials"},
+        )
+
+    response = await call_next(request)
+    return response
+
+
+def _make_request(path: str, token: str) -> Request:
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "scheme": "http",
+        "server": ("testserver", 80),
+    }
+    return Request(scope)
+
+
+async def _call_next(request: Request):
+    return PlainTextResponse("ok")
+
+
+async def _run(middleware, path: str, tokens, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        request = _make_request(path, tokens[i % len(tokens)])
+        response = await middleware(request, _call_next)
+        assert response.status_code == 200
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100, help="同時に利用しているユーザー(トークン)数")
+    args = parser.parse_args()
+
+    exp = int(time.time()) + 3600
+    tokens = [
+        jwt.encode({"user_id": i, "exp": exp}, settings.JWT_SECRET_KEY, algorithm="HS256")
+        for i in range(1, args.users + 1)
+    ]
+    path = "/api/v1/lectures/1/chat"
+
+    token_cache.clear()
+    legacy = asyncio.run(_run(legacy_auth_middleware, path, tokens, args.iterations))
+    cached = asyncio.run(_run(auth_middleware, path, tokens, args.iterations))
+
+    print(f"iterations={args.iterations} users={args.users}")
+    print(f"legacy : {legacy * 1e6:8.2f} us/request")
+    print(f"cached : {cached * 1e6:8.2f} us/request")
+    print(f"saving : {(legacy - cached) * 1e6:8.2f} us/request ({(1 - cached / legacy) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
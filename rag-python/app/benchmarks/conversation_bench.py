@@ -0,0 +1,75 @@
+# rag-python/app/benchmarks/conversation_bench.py
+"""
+会話が長くなってもプロンプトサイズとターンあたりの処理時間が一定に保たれることを確認する。
+Gemini APIは呼び出さず、固定長の応答を返すスタブに置き換えて計測する。
+
+    cd rag-python/app && python -m benchmarks.conversation_bench --turns 60
+"""
+
+import argparse
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+
+from langchain.docstore.document import Document
+
+from core.config import settings
+from rag.conversation import ConversationStore, estimate_tokens
+from rag.llm_gemini import GeminiChat
+
+
+class _StubModel:
+    """呼び出された回数に応じた固定長の応答を返すスタブ"""
+
+    def __init__(self, response_chars: int):
+        self.response_chars = response_chars
+        self.last_prompt = ""
+
+    def generate_content(self, prompt: str):
+        self.last_prompt = prompt
+        text = ("講義資料によると、この概念は次のように説明されています。" * 50)[: self.response_chars]
+        return SimpleNamespace(parts=[text], text=text, prompt_feedback=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--response-chars", type=int, default=400)
+    args = parser.parse_args()
+
+    model = _StubModel(args.response_chars)
+    chat = GeminiChat.__new__(GeminiChat)
+    chat.model = model
+    store = ConversationStore(
+        max_sessions=10,
+        ttl_seconds=3600,
+        max_recent_turns=settings.CHAT_HISTORY_RECENT_TURNS,
+        summary_max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+        turn_max_tokens=settings.CHAT_TURN_MAX_TOKENS,
+        summarizer=chat.summarize_history,
+    )
+    context_docs = [Document(page_content="参考資料の本文。" * 60, metadata={"source": "lecture.pdf"}) for _ in range(3)]
+
+    session_id = None
+    print(f"{'turn':>5} {'prompt_tokens':>14} {'history_tokens':>15} {'turn_ms':>8}")
+    for turn in range(1, args.turns + 1):
+        started = time.perf_counter()
+        session = store.get_or_create(session_id, owner="bench")
+        session_id = session.session_id
+        history = session.render_history(settings.CHAT_HISTORY_TOKEN_BUDGET)
+        query = f"{turn}番目の質問: それについてもう少し詳しく教えてください。"
+        if history:
+            chat.rewrite_query(query, history)
+        response = chat.generate_response(query=query, context_docs=context_docs, history=history)
+        prompt_tokens = estimate_tokens(model.last_prompt)
+        store.add_turn(session, query, response)
+        elapsed = (time.perf_counter() - started) * 1e3
+        if turn == 1 or turn % 5 == 0:
+            print(f"{turn:>5} {prompt_tokens:>14} {estimate_tokens(history):>15} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
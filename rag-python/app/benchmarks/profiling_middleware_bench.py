@@ -0,0 +1,133 @@
+# rag-python/app/benchmarks/profiling_middleware_bench.py
+"""
+プロファイル用ミドルウェアのリクエストあたりのオーバーヘッドを、X-Profile ヘッダーの有無ごとに
+BaseHTTPMiddleware による以前の実装と比較する。ミドルウェアなしで内側のアプリを直接呼んだ時間を基準とする。
+
+    cd rag-python/app && python -m benchmarks.profiling_middleware_bench --iterations 20000
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from auth.middleware import AuthClaims, is_admin
+from core.config import settings
+from core.profiling import PROFILE_HEADER, PROFILE_ID_HEADER, ProfilerBusy, ProfilingMiddleware, profiler
+
+
+async def legacy_profiling_middleware(request: Request, call_next):
+    """BaseHTTPMiddleware で動かしていた以前の実装 (比較用)"""
+    if not request.headers.get(PROFILE_HEADER):
+        return await call_next(request)
+    claims = getattr(request.state, "claims", None)
+    if claims is None or not is_admin(claims):
+        return await call_next(request)
+    try:
+        session = profiler.start("during_request", f"{request.method} {request.url.path}")
+    except ProfilerBusy:
+        return await call_next(request)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        profiler.stop(session.id)
+        raise
+
+    body_iterator = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            profiler.stop(session.id)
+
+    response.body_iterator = profiled_body()
+    response.headers[PROFILE_ID_HEADER] = session.id
+    return response
+
+
+async def _endpoint(scope, receive, send):
+    await PlainTextResponse("ok")(scope, receive, send)
+
+
+def _make_scope(path: str, claims: AuthClaims, profile: bool):
+    headers = [(b"authorization", b"Bearer benchmark")]
+    if profile:
+        headers.append((PROFILE_HEADER.lower().encode(), b"1"))
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": headers,
+        "scheme": "http",
+        "server": ("testserver", 80),
+        # 認証ミドルウェアが request.state.claims に格納した状態を再現する
+        "state": {"claims": claims},
+    }
+
+
+def _make_receive():
+    # 本文を1回返した後は、切断されるまで (ここでは無期限に) 待つ
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    return receive
+
+
+async def _run(app, path: str, claims: AuthClaims, profile: bool, iterations: int) -> float:
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(_make_scope(path, claims, profile), _make_receive(), send)
+    elapsed = (time.perf_counter() - start) / iterations
+    assert statuses == [200] * iterations
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    claims = AuthClaims(user_id=1)
+    settings.ADMIN_USER_IDS = [claims.user_id]
+    path = "/api/v1/lectures/1/chat"
+    apps = {
+        "legacy": BaseHTTPMiddleware(_endpoint, dispatch=legacy_profiling_middleware),
+        "asgi": ProfilingMiddleware(_endpoint),
+    }
+
+    baseline = asyncio.run(_run(_endpoint, path, claims, False, args.iterations))
+    print(f"iterations={args.iterations}")
+    print(f"{'no middleware':24}: {baseline * 1e6:8.2f} us/request")
+    for profile in (False, True):
+        label = "with X-Profile" if profile else "without X-Profile"
+        for name, app in apps.items():
+            elapsed = asyncio.run(_run(app, path, claims, profile, args.iterations))
+            print(f"{name:6} {label:17}: {elapsed * 1e6:8.2f} us/request (+{(elapsed - baseline) * 1e6:.2f} us)")
+
+
+if __name__ == "__main__":
+    main()
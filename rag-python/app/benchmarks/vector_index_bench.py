@@ -0,0 +1,99 @@
+# rag-python/app/benchmarks/vector_index_bench.py
+"""
+インデックス設定ごとの recall@k と検索レイテンシを計測する。
+正規化済みの合成ベクトル (クラスタ構造あり) を用い、総当たり検索の結果を正解とする。
+
+    cd rag-python/app && python -m benchmarks.vector_index_bench --sizes 300 5000 20000
+"""
+
+import argparse
+import tempfile
+import time
+import uuid
+from typing import List
+
+import chromadb
+import numpy as np
+
+from rag.vector_index import IndexConfig, exact_top_k
+
+HNSW_SETTINGS = [
+    IndexConfig(M=16, construction_ef=100, search_ef=10),   # Chromaのデフォルト
+    IndexConfig(M=16, construction_ef=100, search_ef=64),
+    IndexConfig(M=32, construction_ef=200, search_ef=64),
+    IndexConfig(M=32, construction_ef=200, search_ef=128),
+]
+
+
+def make_vectors(n: int, dim: int, rng: np.random.Generator, clusters: int = 64) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def recall_at_k(found: List[List[int]], truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t.tolist())) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def report(label: str, n: int, recall: float, latencies: List[float]):
+    print(
+        f"{n:>7} {label:<40} recall={recall:.4f} "
+        f"p50={percentile(latencies, 0.5) * 1e3:7.3f}ms p99={percentile(latencies, 0.99) * 1e3:7.3f}ms"
+    )
+
+
+def bench_size(client, n: int, dim: int, k: int, n_queries: int, rng: np.random.Generator):
+    data = make_vectors(n, dim, rng)
+    queries = make_vectors(n_queries, dim, rng)
+    truth, _ = exact_top_k(data, queries, k)
+    ids = [str(i) for i in range(n)]
+
+    # 総当たり検索 (NumPyの行列積)
+    latencies, found = [], []
+    for q in queries:
+        start = time.perf_counter()
+        top, _ = exact_top_k(data, q[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(top[0].tolist())
+    report("exact (numpy)", n, recall_at_k(found, truth), latencies)
+
+    for config in HNSW_SETTINGS:
+        collection = client.create_collection(name=f"bench_{uuid.uuid4().hex[:12]}", metadata=config.to_metadata())
+        for start in range(0, n, 5000):
+            collection.add(ids=ids[start:start + 5000], embeddings=data[start:start + 5000].tolist())
+        latencies, found = [], []
+        for q in queries:
+            start = time.perf_counter()
+            result = collection.query(query_embeddings=[q.tolist()], n_results=k, include=["distances"])
+            latencies.append(time.perf_counter() - start)
+            found.append([int(i) for i in result["ids"][0]])
+        label = f"hnsw M={config.M} cef={config.construction_ef} ef={config.search_ef}"
+        report(label, n, recall_at_k(found, truth), latencies)
+        client.delete_collection(collection.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[300, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as path:
+        client = chromadb.PersistentClient(path=path)
+        print(f"dim={args.dim} k={args.k} queries={args.queries}")
+        for n in args.sizes:
+            bench_size(client, n, args.dim, args.k, args.queries, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# rag-python/app/benchmarks/vector_storage_bench.py
+"""
+ベクトルの保持形式 (次元の切り詰め / float16 / int8 と rescoring) ごとに、
+総当たり検索用の行列のメモリ量・Chromaのディスク使用量・検索レイテンシ・recall@k を計測する。
+正解は切り詰めない float32 ベクトルでの総当たり検索の結果とする。
+合成ベクトルは Matryoshka 表現学習のモデルと同様に、先頭の次元ほど情報が多くなるよう重み付けしている
+(実際のモデルでの比較は tools.evaluate_retrieval の dimensions / vector_dtype で行う)。
+
+    cd rag-python/app && python -m benchmarks.vector_storage_bench --n 20000 --dim 1024
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List
+
+import chromadb
+import numpy as np
+
+from benchmarks.vector_index_bench import make_vectors, percentile, recall_at_k
+from rag.vector_index import ExactSearchCache, exact_top_k, quantize_vectors, truncate_embeddings
+
+
+@dataclass(frozen=True)
+class StorageFormat:
+    dimensions: int = 0
+    dtype: str = "float32"
+    rescore_factor: int = 1
+
+    @property
+    def label(self) -> str:
+        dims = f"dim={self.dimensions}" if self.dimensions else "dim=full"
+        rescore = f" rescore x{self.rescore_factor}" if self.rescore_factor > 1 else ""
+        return f"{dims} {self.dtype}{rescore}"
+
+
+FORMATS = [
+    StorageFormat(),                                        # 現在の形式
+    StorageFormat(dtype="float16"),
+    StorageFormat(dtype="int8"),
+    StorageFormat(dtype="int8", rescore_factor=4),
+    StorageFormat(dimensions=512),
+    StorageFormat(dimensions=256),
+    StorageFormat(dimensions=256, dtype="int8", rescore_factor=4),
+]
+
+
+def make_matryoshka_vectors(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    vectors = make_vectors(n, dim, rng) / np.sqrt(1.0 + np.arange(dim, dtype=np.float32) / 64.0)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def bench_format(fmt: StorageFormat, data: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int):
+    vectors = truncate_embeddings(data, fmt.dimensions)
+    query_vectors = truncate_embeddings(queries, fmt.dimensions)
+    matrix, scales = quantize_vectors(vectors, fmt.dtype)
+    memory = matrix.nbytes + (scales.nbytes if scales is not None else 0)
+
+    with tempfile.TemporaryDirectory() as path:
+        client = chromadb.PersistentClient(path=path)
+        collection = client.create_collection(name=f"bench_{uuid.uuid4().hex[:12]}", metadata={"hnsw:space": "cosine"})
+        ids = [str(i) for i in range(len(vectors))]
+        for start in range(0, len(vectors), 5000):
+            collection.add(ids=ids[start:start + 5000], embeddings=vectors[start:start + 5000].tolist())
+        disk = directory_size(path)
+
+        cache = ExactSearchCache(max_total_bytes=memory, dtype=fmt.dtype, rescore_factor=fmt.rescore_factor)
+        # 初回の行列の読み込みを計測から除く
+        cache.query(collection.name, collection, 0, query_vectors[0], k, "cosine")
+        latencies: List[float] = []
+        found: List[List[int]] = []
+        for q in query_vectors:
+            start = time.perf_counter()
+            result = cache.query(collection.name, collection, 0, q, k, "cosine")
+            latencies.append(time.perf_counter() - start)
+            found.append([int(i) for i in result["ids"][0]])
+
+    print(
+        f"{fmt.label:<32} memory={memory / 2**20:8.2f}MiB disk={disk / 2**20:8.2f}MiB "
+        f"recall={recall_at_k(found, truth):.4f} "
+        f"p50={percentile(latencies, 0.5) * 1e3:7.3f}ms p99={percentile(latencies, 0.99) * 1e3:7.3f}ms"
+    )
+
+
+def bench_list_conversion(dim: int, batch: int, rng: np.random.Generator, repeat: int = 50):
+    """Embedding結果を Python のリストに変換するコスト (Chromaへの書き込み・問い合わせ時に1回だけ発生する)"""
+    embeddings = make_vectors(batch, dim, rng)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        embeddings.tolist()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"tolist() of a {batch}x{dim} batch: {elapsed * 1e3:.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    data = make_matryoshka_vectors(args.n, args.dim, rng)
+    queries = make_matryoshka_vectors(args.queries, args.dim, rng)
+    truth, _ = exact_top_k(data, queries, args.k)
+
+    print(f"n={args.n} dim={args.dim} k={args.k} queries={args.queries}")
+    for fmt in FORMATS:
+        if fmt.dimensions < args.dim:
+            bench_format(fmt, data, queries, truth, args.k)
+    bench_list_conversion(args.dim, 64, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# rag-python/app/core/admission.py
+
+import asyncio
+import bisect
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# レーン名 (認証ユーザー / ゲスト × チャット / アップロード)
+AUTH_CHAT = "auth_chat"
+AUTH_UPLOAD = "auth_upload"
+GUEST_CHAT = "guest_chat"
+GUEST_UPLOAD = "guest_upload"
+
+
+@dataclass(frozen=True)
+class LaneConfig:
+    """レーンごとの受付設定。priorityは小さいほど優先される"""
+    max_concurrency: int
+    max_queue: int
+    priority: int
+    rate_per_minute: float
+    burst: int
+
+
+def build_lane_configs(settings) -> Dict[str, LaneConfig]:
+    """設定値からレーン構成を組み立てる。チャットはアップロード(取り込み)より優先する"""
+    def lane(prefix: str, priority: int) -> LaneConfig:
+        return LaneConfig(
+            max_concurrency=getattr(settings, f"{prefix}_MAX_CONCURRENCY"),
+            max_queue=getattr(settings, f"{prefix}_MAX_QUEUE"),
+            priority=priority,
+            rate_per_minute=float(getattr(settings, f"{prefix}_RATE_PER_MINUTE")),
+            burst=max(1, getattr(settings, f"{prefix}_BURST")),
+        )
+
+    return {
+        AUTH_CHAT: lane("AUTH_CHAT", 0),
+        GUEST_CHAT: lane("GUEST_CHAT", 1),
+        AUTH_UPLOAD: lane("AUTH_UPLOAD", 2),
+        GUEST_UPLOAD: lane("GUEST_UPLOAD", 3),
+    }
+
+
+class AdmissionRejected(Exception):
+    """受付制御によって拒否されたことを表す例外 (HTTP 429 に変換される)"""
+
+    def __init__(self, lane: str, reason: str, retry_after: float):
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Request rejected by admission control ({lane}: {reason})")
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """トークンを1つ消費する。不足している場合は補充までの秒数を返す (消費成功時は0)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+@dataclass(eq=False)
+class _Waiter:
+    lane: str
+    future: asyncio.Future
+
+
+class AdmissionController:
+    """
+    レーンごとの同時実行数・キュー長・主体ごとのレート制限を管理する受付制御。
+    全レーン共通の実行枠が空くと、待機中のリクエストのうち優先度の高いレーンから順に割り当てる。
+    イベントループ上からのみ呼び出されることを前提とする。
+    """
+
+    def __init__(self, lanes: Dict[str, LaneConfig], max_concurrency: int, queue_timeout: float, max_rate_keys: int = 10000):
+        self._lanes = lanes
+        self._max_concurrency = max_concurrency
+        self._queue_timeout = queue_timeout
+        self._max_rate_keys = max_rate_keys
+        self._active = {name: 0 for name in lanes}
+        self._waiting = {name: 0 for name in lanes}
+        self._total_active = 0
+        self._waiters: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        # 直近の処理時間 (Retry-After の見積もりに使用)
+        self._service_time = {name: 1.0 for name in lanes}
+        # 主体 (ユーザー / ゲストのアドレス) は無制限に増えうるため、LRUで上限を設ける
+        self._buckets: "OrderedDict[Tuple[str, str], _TokenBucket]" = OrderedDict()
+
+    def _check_rate(self, lane: str, principal: str):
+        config = self._lanes[lane]
+        if config.rate_per_minute <= 0:
+            return
+        key = (lane, principal)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _TokenBucket(config.rate_per_minute, config.burst)
+            if len(self._buckets) > self._max_rate_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        retry_after = bucket.take()
+        if retry_after > 0:
+            self._reject(lane, "rate_limited", retry_after)
+
+    def _reject(self, lane: str, reason: str, retry_after: float):
+        metrics.inc("admission_rejected_total", lane=lane, reason=reason)
+        raise AdmissionRejected(lane, reason, retry_after)
+
+    def _estimate_retry_after(self, lane: str) -> float:
+        config = self._lanes[lane]
+        backlog = self._waiting[lane] + 1
+        return self._service_time[lane] * backlog / max(1, config.max_concurrency)
+
+    def _dispatch(self):
+        """空いている実行枠を、優先度順に実行可能な待機者へ割り当てる"""
+        i = 0
+        while i < len(self._waiters) and self._total_active < self._max_concurrency:
+            waiter = self._waiters[i][2]
+            if self._active[waiter.lane] < self._lanes[waiter.lane].max_concurrency:
+                del self._waiters[i]
+                self._waiting[waiter.lane] -= 1
+                self._active[waiter.lane] += 1
+                self._total_active += 1
+                waiter.future.set_result(None)
+            else:
+                i += 1
+
+    def _remove_waiter(self, entry: Tuple[int, int, _Waiter]):
+        index = bisect.bisect_left(self._waiters, entry[:2])
+        if index < len(self._waiters) and self._waiters[index][2] is entry[2]:
+            del self._waiters[index]
+            self._waiting[entry[2].lane] -= 1
+
+    def _release(self, lane: str):
+        self._active[lane] -= 1
+        self._total_active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, lane: str, principal: str):
+        """
+        レーンの実行枠を確保するまで待機する。
+        レート超過・キュー満杯・待機タイムアウトの場合は AdmissionRejected を送出する。
+        """
+        config = self._lanes[lane]
+        self._check_rate(lane, principal)
+
+        queued_at = time.perf_counter()
+        waiter = _Waiter(lane=lane, future=asyncio.get_running_loop().create_future())
+        entry = (config.priority, next(self._seq), waiter)
+        bisect.insort(self._waiters, entry)
+        self._waiting[lane] += 1
+        self._dispatch()
+
+        if not waiter.future.done():
+            if self._waiting[lane] > config.max_queue:
+                self._remove_waiter(entry)
+                self._reject(lane, "queue_full", self._estimate_retry_after(lane))
+            try:
+                await asyncio.wait_for(waiter.future, timeout=self._queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # 割り当てと同時にキャンセルされた場合は枠を返却する
+                    self._release(lane)
+                else:
+                    self._remove_waiter(entry)
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject(lane, "queue_timeout", self._estimate_retry_after(lane))
+                raise
+
+        started_at = time.perf_counter()
+        metrics.observe("admission_queue_wait_seconds", started_at - queued_at, lane=lane)
+        metrics.inc("admission_admitted_total", lane=lane)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self._service_time[lane] = 0.8 * self._service_time[lane] + 0.2 * elapsed
+            self._release(lane)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {
+                "active": self._active[name],
+                "waiting": self._waiting[name],
+                "max_concurrency": config.max_concurrency,
+                "max_queue": config.max_queue,
+            }
+            for name, config in self._lanes.items()
+        }
@@ -1,5 +1,7 @@
 # rag-python/app/core/config.py
 
+from typing import List
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -10,12 +12,98 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str
     GEMINI_MODEL_NAME: str = "gemini-2.5-flash"
     EMBEDDING_MODEL_NAME: str = "retrieva-jp/amber-large"
+    # Matryoshka対応モデルのベクトルを切り詰める次元数 (0 で切り詰めない。変更後は再インデックスが必要)
+    EMBEDDING_DIMENSIONS: int = 0
+
+    # Vector Index (新規作成するコレクションのHNSW設定)
+    VECTOR_INDEX_SPACE: str = "cosine"
+    LECTURE_HNSW_M: int = 32
+    LECTURE_HNSW_CONSTRUCTION_EF: int = 200
+    LECTURE_HNSW_SEARCH_EF: int = 64
+    # この件数以下のコレクションは総当たり (NumPyの行列積) で検索する
+    EXACT_SEARCH_MAX_VECTORS: int = 2000
+    # 総当たり検索用の行列を保持するメモリの上限 (ワーカーごと)。
+    # 1024次元の float32 では 4KiB/ベクトルのため、128MiB で約3.2万ベクトル (上限件数のコレクションで約16個) を保持する
+    EXACT_SEARCH_CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+    # 総当たり検索用に保持する行列の形式 (float32 / float16 / int8) と、float32で計算し直す候補の倍率 (1 で計算し直さない)
+    # int8 はメモリが 1/4 になる。float16 はCPUでの float32 への変換が遅いため、検索が遅くなる
+    EXACT_SEARCH_VECTOR_DTYPE: str = "float32"
+    EXACT_SEARCH_RESCORE_FACTOR: int = 4
+    # 検索結果 (チャンクIDと距離) をキャッシュする件数。0 で無効
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 10000
 
     # Directory Paths (in container)
     CHROMA_DB_PATH: str = "/app/data/chroma"
     UPLOAD_DIR: str = "/app/static/uploads"
 
+    # Conversation (サーバー側の会話履歴。トークン数は概算値)
+    CHAT_HISTORY_TOKEN_BUDGET: int = 1500
+    CHAT_HISTORY_RECENT_TURNS: int = 4
+    CHAT_TURN_MAX_TOKENS: int = 600
+    CHAT_SUMMARY_MAX_TOKENS: int = 400
+    CHAT_QUERY_REWRITE: bool = True
+    CHAT_MAX_SESSIONS: int = 10000
+    CHAT_SESSION_TTL_SECONDS: float = 3600.0
+
+    # Prompt Prefix (講義ごとに固定するプロンプト先頭部分。よく検索されるチャンクの数・最低出現回数・入れ替え間隔)
+    PROMPT_PREFIX_MAX_DOCS: int = 3
+    PROMPT_PREFIX_MIN_HITS: int = 3
+    PROMPT_PREFIX_REFRESH_SECONDS: float = 900.0
+    # Geminiのコンテキストキャッシュを作成する先頭部分の最小トークン数 (0で無効) と保持秒数
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS: int = 2048
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: float = 3600.0
+
+    # Upload Limits (上限サイズと、ディスクを経由せずメモリ上で解析するサイズの閾値)
+    MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024
+    UPLOAD_IN_MEMORY_THRESHOLD_BYTES: int = 8 * 1024 * 1024
+
+    # Chunking (コレクション種別ごとのチャンク長と、文単位で引き継ぐ重複の上限。いずれも文字数)
+    LECTURE_CHUNK_SIZE: int = 800
+    LECTURE_CHUNK_OVERLAP: int = 80
+    GUEST_CHUNK_SIZE: int = 600
+    GUEST_CHUNK_OVERLAP: int = 60
+
+    # Download (Cache-Controlヘッダーと、テキストファイルのgzip事前圧縮の有無)
+    DOWNLOAD_CACHE_CONTROL: str = "private, max-age=86400"
+    DOWNLOAD_PRECOMPRESS_TEXT: bool = True
+
     # Authentication
     JWT_SECRET_KEY: str
+    # 検証済みJWTのキャッシュ (エントリ数と、expが無いトークンの最大保持秒数)
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_TTL_SECONDS: float = 300.0
+
+    # Admission Control (全レーン合計の同時実行数と、キュー待ちのタイムアウト)
+    ADMISSION_MAX_CONCURRENCY: int = 8
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    # レーンごとの同時実行数 / キュー長 / 1分あたりのリクエスト上限 / 連続して受け付ける件数 (主体ごと)
+    # BURST は、同時実行数の分を一度に送った後にキューへ積む余裕を見込み、同時実行数 + 2〜4 件としている。
+    # 後から 400 / 413 で拒否したアップロードもトークンを消費するため、小さくしすぎないこと
+    AUTH_CHAT_MAX_CONCURRENCY: int = 6
+    AUTH_CHAT_MAX_QUEUE: int = 64
+    AUTH_CHAT_RATE_PER_MINUTE: float = 30
+    AUTH_CHAT_BURST: int = 10
+    AUTH_UPLOAD_MAX_CONCURRENCY: int = 2
+    AUTH_UPLOAD_MAX_QUEUE: int = 16
+    AUTH_UPLOAD_RATE_PER_MINUTE: float = 10
+    AUTH_UPLOAD_BURST: int = 5
+    GUEST_CHAT_MAX_CONCURRENCY: int = 2
+    GUEST_CHAT_MAX_QUEUE: int = 16
+    GUEST_CHAT_RATE_PER_MINUTE: float = 10
+    GUEST_CHAT_BURST: int = 5
+    GUEST_UPLOAD_MAX_CONCURRENCY: int = 1
+    GUEST_UPLOAD_MAX_QUEUE: int = 4
+    GUEST_UPLOAD_RATE_PER_MINUTE: float = 3
+    GUEST_UPLOAD_BURST: int = 3
+    # ゲストのレート制限はクライアントのアドレス単位で行う。リバースプロキシの背後で動かす場合は、
+    # プロキシが設定する送信元アドレスのヘッダー名 (例: X-Forwarded-For) を指定する (空なら接続元のアドレス)。
+    # 同じNATの背後にいる利用者は1つの主体として数えられる点に注意
+    TRUSTED_CLIENT_IP_HEADER: str = ""
+
+    # Profiling (管理用エンドポイントを使えるユーザーID、スタックの採取間隔、1回のプロファイルの最大秒数と保持件数)
+    ADMIN_USER_IDS: List[int] = []
+    PROFILING_SAMPLE_INTERVAL_SECONDS: float = 0.005
+    PROFILING_MAX_SECONDS: float = 300.0
+    PROFILING_MAX_STORED: int = 32
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
@@ -0,0 +1,180 @@
+# rag-python/app/core/downloads.py
+
+import gzip
+import os
+import re
+import shutil
+import tempfile
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# 事前圧縮版を用意するテキスト系の拡張子
+PRECOMPRESSIBLE_EXTENSIONS = {".txt"}
+PRECOMPRESSED_DIR_NAME = ".precompressed"
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _make_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match の比較 (弱い比較)"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _not_modified_since(header: str, stat: os.stat_result) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(stat.st_mtime) <= since
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    単一の bytes 範囲を (start, end) に変換する (endを含む)。
+    満たせない範囲は ValueError、複数範囲など解釈しない指定は None を返す。
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start_text, end_text = match.groups()
+    if not start_text and not end_text:
+        return None
+    if not start_text:
+        # "bytes=-500" は末尾500バイト
+        length = int(end_text)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+def _iter_file_range(file_path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _get_precompressed(file_path: str, stat: os.stat_result) -> str:
+    """gzip圧縮版のパスを返す。存在しないか元ファイルより古い場合は作成し直す"""
+    directory, name = os.path.split(file_path)
+    cache_dir = os.path.join(directory, PRECOMPRESSED_DIR_NAME)
+    gz_path = os.path.join(cache_dir, f"{name}.gz")
+    try:
+        if os.stat(gz_path).st_mtime_ns >= stat.st_mtime_ns:
+            return gz_path
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # 同じファイルへの同時リクエストが互いの書きかけを上書きしないよう、一時ファイルはリクエストごとに作る
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=cache_dir)
+    try:
+        with open(file_path, "rb") as src, os.fdopen(fd, "wb") as raw, \
+                gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, gz_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return gz_path
+
+
+def build_file_response(
+    request: Request,
+    file_path: str,
+    filename: str,
+    cache_control: str,
+    precompress: bool = False,
+) -> Response:
+    """
+    条件付きリクエスト (ETag / Last-Modified)、Range リクエスト、
+    テキストファイルの事前圧縮版に対応したファイルレスポンスを組み立てる。
+    """
+    stat = os.stat(file_path)
+    file_ext = os.path.splitext(filename)[1].lower()
+    compressible = precompress and file_ext in PRECOMPRESSIBLE_EXTENSIONS
+    range_header = request.headers.get("range")
+    # Range 指定がなく gzip を受け付けるクライアントには事前圧縮版を返す (表現ごとに別のETagを付与する)
+    serve_gzip = compressible and not range_header and "gzip" in request.headers.get("accept-encoding", "").lower()
+
+    etag = _make_etag(stat)
+    headers: Dict[str, str] = {
+        "ETag": f'"{etag[1:-1]}-gzip"' if serve_gzip else etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+
+    # 1. 条件付きリクエスト (If-None-Match が優先)
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since and _not_modified_since(if_modified_since, stat):
+        return Response(status_code=304, headers=headers)
+
+    if serve_gzip:
+        gz_path = _get_precompressed(file_path, stat)
+        return FileResponse(
+            path=gz_path,
+            filename=filename,
+            media_type=guess_type(filename)[0] or "text/plain",
+            headers={**headers, "Content-Encoding": "gzip"},
+        )
+
+    # 2. Range リクエスト (If-Range が一致しない場合は全体を返す)
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (etag, headers["Last-Modified"])):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            return StreamingResponse(
+                _iter_file_range(file_path, start, end),
+                status_code=206,
+                media_type=guess_type(filename)[0] or "application/octet-stream",
+                headers={
+                    **headers,
+                    "Content-Disposition": _content_disposition(filename),
+                    "Content-Range": f"bytes {start}-{end}/{stat.st_size}",
+                    "Content-Length": str(end - start + 1),
+                },
+            )
+
+    return FileResponse(path=file_path, filename=filename, headers=headers, stat_result=stat)
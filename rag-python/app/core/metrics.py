@@ -0,0 +1,90 @@
+# rag-python/app/core/metrics.py
+
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Histogram:
+    """観測値の件数・合計・最大値と、直近のサンプル (パーセンタイル計算用) を保持する"""
+
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """プロセス内のカウンターとヒストグラムを管理する簡易レジストリ (スレッドセーフ)"""
+
+    def __init__(self, max_samples: int = 2048):
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters: Dict[LabelKey, float] = {}
+        self._histograms: Dict[LabelKey, _Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> LabelKey:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    @staticmethod
+    def _format(key: LabelKey) -> str:
+        name, labels = key
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self._max_samples)
+            histogram.observe(value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                "counters": {self._format(k): v for k, v in sorted(self._counters.items())},
+                "histograms": {self._format(k): h.summary() for k, h in sorted(self._histograms.items(), key=lambda i: i[0])},
+            }
+
+
+# アプリケーション全体で共有するレジストリ (シングルトン)
+metrics = MetricsRegistry()
@@ -0,0 +1,306 @@
+# rag-python/app/core/profiling.py
+
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from auth.middleware import is_admin
+from core.config import settings
+from core.metrics import metrics
+
+# 管理者がこのヘッダーを付けたリクエストは、その処理中にプロセス全体のスタックを採取する
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# 待機中のスレッドのスタック (末尾のフレーム) は、実行時間に含めない
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+
+
+class ProfilerBusy(Exception):
+    """同時に実行できるプロファイルの数を超えた"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # collapsed形式ではセミコロンがフレームの区切りのため、名前からは除く
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse_stack(frame, thread_name: str, include_idle: bool = False) -> Optional[str]:
+    """フレームを根元から並べ、flamegraph.pl / speedscope が読める collapsed 形式の1行 (回数を除く) にする"""
+    leaf = frame.f_code
+    if not include_idle and (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES:
+        return None
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(labels))
+
+
+@dataclass
+class ProfileSession:
+    id: str
+    kind: str
+    label: str
+    started_at: float
+    deadline: Optional[float] = None
+    ended_at: Optional[float] = None
+    samples: int = 0
+    stacks: Counter = field(default_factory=Counter)
+
+    @property
+    def running(self) -> bool:
+        return self.ended_at is None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "label": self.label,
+            "running": self.running,
+            "started_at": self.started_at,
+            "duration_seconds": (self.ended_at or time.time()) - self.started_at,
+            "samples": self.samples,
+        }
+
+
+class SamplingProfiler:
+    """
+    全スレッドのスタックを一定間隔で採取する、プロセス全体のサンプリングプロファイラ。
+    実行中のセッションがある間だけ採取用のスレッドを動かすため、使っていない時の負荷はない。
+    セッションは時間指定 (window) と、リクエストの処理中の期間 (during_request) の2種類で、どちらも
+    特定のリクエストのスタックだけを区別することはしない。採取したスタックは実行中のすべてのセッションに加算し、
+    同時に処理中の他のリクエストやバックグラウンドのスレッドのスタックも含まれる
+    (スタックの根元はスレッド名のため、flamegraph上でスレッドごとに絞り込める)。
+    終了したセッションは max_stored 件まで保持する。
+    """
+
+    def __init__(self, interval_seconds: float, max_seconds: float, max_active: int = 4, max_stored: int = 32):
+        self._interval = interval_seconds
+        self._max_seconds = max_seconds
+        self._max_active = max_active
+        self._max_stored = max_stored
+        self._sessions: "OrderedDict[str, ProfileSession]" = OrderedDict()
+        self._active: Dict[str, ProfileSession] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, kind: str, label: str, seconds: Optional[float] = None) -> ProfileSession:
+        # 時間指定のない (リクエスト単位の) セッションも、max_seconds で打ち切る
+        seconds = min(seconds or self._max_seconds, self._max_seconds)
+        now = time.time()
+        session = ProfileSession(id=uuid.uuid4().hex, kind=kind, label=label, started_at=now, deadline=now + seconds)
+        with self._lock:
+            if len(self._active) >= self._max_active:
+                raise ProfilerBusy(f"{self._max_active} profiles are already running")
+            self._active[session.id] = session
+            self._sessions[session.id] = session
+            while len(self._sessions) > self._max_stored:
+                oldest = next(iter(self._sessions))
+                if oldest in self._active:
+                    break
+                del self._sessions[oldest]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        metrics.inc("profiles_started_total", kind=kind)
+        return session
+
+    def stop(self, session_id: str):
+        with self._lock:
+            session = self._active.pop(session_id, None)
+            if session is not None:
+                session.ended_at = time.time()
+
+    def get(self, session_id: str) -> Optional[ProfileSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [session.summary() for session in reversed(self._sessions.values())]
+
+    def collapsed(self, session_id: str) -> Optional[str]:
+        """collapsed 形式 (`スタック 回数` の行) で返す。実行中のセッションはその時点までの結果を返す"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            stacks = list(session.stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks))
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while True:
+            now = time.time()
+            with self._lock:
+                for session in [s for s in self._active.values() if s.deadline is not None and s.deadline <= now]:
+                    session.ended_at = now
+                    del self._active[session.id]
+                active = list(self._active.values())
+                if not active:
+                    self._thread = None
+                    return
+
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            stacks = []
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                stack = collapse_stack(frame, names.get(ident, str(ident)))
+                if stack is not None:
+                    stacks.append(stack)
+            # 待機中にフレーム (とそのローカル変数) を保持し続けないようにする
+            frames = frame = None
+
+            with self._lock:
+                for session in active:
+                    if session.running:
+                        session.samples += 1
+                        session.stacks.update(stacks)
+            time.sleep(self._interval)
+
+
+class AllocationTracker:
+    """
+    tracemalloc によるメモリ確保の追跡。
+    スナップショットごとに確保量の多い箇所と、前回のスナップショットからの増加量を返す
+    (Embeddingの計算やPDFの読み込みでメモリが増え続けていないかの確認用)。
+    追跡中は確保のたびに負荷がかかるため、必要な間だけ start/stop する。
+    """
+
+    _FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def start(self, nframes: int = 10):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(nframes)
+            self._previous = None
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+
+    def status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "traceback_limit": tracemalloc.get_traceback_limit() if tracing else 0,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+        }
+
+    @staticmethod
+    def _describe(traceback: tracemalloc.Traceback) -> List[str]:
+        return [
+            f"{frame.filename}:{frame.lineno} {linecache.getline(frame.filename, frame.lineno).strip()}"
+            for frame in traceback
+        ]
+
+    def snapshot(self, limit: int = 25, key_type: str = "lineno") -> Dict[str, Any]:
+        """key_type は tracemalloc と同じ ("lineno" / "filename" / "traceback")"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._FILTERS)
+        with self._lock:
+            previous, self._previous = self._previous, snapshot
+
+        top = [
+            {"size_bytes": stat.size, "count": stat.count, "traceback": self._describe(stat.traceback)}
+            for stat in snapshot.statistics(key_type)[:limit]
+        ]
+        growth = []
+        if previous is not None:
+            growth = [
+                {
+                    "size_bytes": stat.size,
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                    "traceback": self._describe(stat.traceback),
+                }
+                for stat in snapshot.compare_to(previous, key_type)[:limit]
+                if stat.size_diff > 0
+            ]
+        return {**self.status(), "top": top, "growth": growth}
+
+
+profiler = SamplingProfiler(
+    interval_seconds=settings.PROFILING_SAMPLE_INTERVAL_SECONDS,
+    max_seconds=settings.PROFILING_MAX_SECONDS,
+    max_stored=settings.PROFILING_MAX_STORED,
+)
+allocation_tracker = AllocationTracker()
+
+
+class ProfilingMiddleware:
+    """
+    管理者が X-Profile ヘッダーを付けたリクエストの処理中 (レスポンスの本文を送り終えるまで)、
+    プロセス全体のスタックを採取する。このリクエストのスタックだけに絞り込むものではないため、
+    他のリクエストが少ない時に使うこと。結果のIDは X-Profile-Id ヘッダーで返し、管理用エンドポイントから取得する。
+    認証ミドルウェアより内側に適用すること。
+    ヘッダーのないリクエストはそのまま内側のアプリに渡すよう、BaseHTTPMiddleware ではなく ASGI ミドルウェアとして実装する。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not _has_profile_header(scope):
+            await self.app(scope, receive, send)
+            return
+        claims = scope.get("state", {}).get("claims")
+        if claims is None or not is_admin(claims):
+            await self.app(scope, receive, send)
+            return
+        try:
+            session = profiler.start("during_request", f"{scope['method']} {scope['path']}")
+        except ProfilerBusy:
+            await self.app(scope, receive, send)
+            return
+
+        async def profiled_send(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers[PROFILE_ID_HEADER] = session.id
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                profiler.stop(session.id)
+
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            # 例外や切断で本文を送り終えなかった場合も止める (停止済みなら何もしない)
+            profiler.stop(session.id)
+
+
+def _has_profile_header(scope: Scope) -> bool:
+    name = PROFILE_HEADER.lower().encode("latin-1")
+    return any(key == name and value for key, value in scope["headers"])
@@ -1,18 +1,32 @@
 # rag-python/app/main.py
 
+import json
 import logging
 import os
-import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, Path
-from fastapi.responses import JSONResponse, FileResponse
+import time
+from fastapi import FastAPI, HTTPException, Depends, Request, Path, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from werkzeug.utils import secure_filename
 
 from schemas import ChatRequest
 from core.config import settings
+from core.metrics import metrics
+from core.downloads import build_file_response
+from core.profiling import profiler, allocation_tracker, ProfilingMiddleware, ProfilerBusy
+from core.admission import (
+    AdmissionController, AdmissionRejected, build_lane_configs,
+    AUTH_CHAT, AUTH_UPLOAD, GUEST_CHAT, GUEST_UPLOAD,
+)
 from rag.chroma_manager import ChromaManager
+from rag.vector_index import build_index_configs
 from rag.document_processor import process_documents, SUPPORTED_EXTENSIONS
-from rag.llm_gemini import GeminiChat
-from auth.middleware import auth_middleware, AuthClaims
+from rag.chunking import build_chunk_policies, resolve_chunk_policy
+from rag.upload_stream import check_content_length, receive_upload, UploadRejected
+from rag.llm_gemini import GeminiChat, DEFAULT_SYSTEM_PROMPT, render_prompt_prefix
+from rag.prompt_cache import PromptPrefixCache
+from rag.conversation import ConversationStore
+from auth.middleware import auth_middleware, is_admin, AuthClaims
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
@@ -28,10 +42,48 @@ logging.getLogger("chromadb.api.segment").setLevel(logging.WARNING)
 app = FastAPI(title="OpenRAG - RAG Service")
 
 # サービスインスタンスの初期化 (シングルトン)
-chroma_manager = ChromaManager(persist_directory=settings.CHROMA_DB_PATH, embedding_model_name=settings.EMBEDDING_MODEL_NAME)
-gemini_chat = GeminiChat(api_key=settings.GEMINI_API_KEY, model_name=settings.GEMINI_MODEL_NAME)
-
-# ミドルウェアの適用
+chroma_manager = ChromaManager(
+    persist_directory=settings.CHROMA_DB_PATH,
+    embedding_model_name=settings.EMBEDDING_MODEL_NAME,
+    index_configs=build_index_configs(settings),
+    exact_search_max_vectors=settings.EXACT_SEARCH_MAX_VECTORS,
+    exact_search_cache_bytes=settings.EXACT_SEARCH_CACHE_MAX_BYTES,
+    retrieval_cache_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+    embedding_dimensions=settings.EMBEDDING_DIMENSIONS,
+    exact_search_dtype=settings.EXACT_SEARCH_VECTOR_DTYPE,
+    exact_search_rescore_factor=settings.EXACT_SEARCH_RESCORE_FACTOR,
+)
+gemini_chat = GeminiChat(
+    api_key=settings.GEMINI_API_KEY,
+    model_name=settings.GEMINI_MODEL_NAME,
+    context_cache_min_tokens=settings.GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+    context_cache_ttl_seconds=settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+)
+# 講義ごとに共通のプロンプト先頭部分 (システムプロンプト + よく検索されるチャンク)
+prompt_prefix_cache = PromptPrefixCache(
+    render=render_prompt_prefix,
+    max_documents=settings.PROMPT_PREFIX_MAX_DOCS,
+    min_hits=settings.PROMPT_PREFIX_MIN_HITS,
+    refresh_seconds=settings.PROMPT_PREFIX_REFRESH_SECONDS,
+)
+chunk_policies = build_chunk_policies(settings)
+conversation_store = ConversationStore(
+    max_sessions=settings.CHAT_MAX_SESSIONS,
+    ttl_seconds=settings.CHAT_SESSION_TTL_SECONDS,
+    max_recent_turns=settings.CHAT_HISTORY_RECENT_TURNS,
+    summary_max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+    turn_max_tokens=settings.CHAT_TURN_MAX_TOKENS,
+    summarizer=gemini_chat.summarize_history,
+)
+# ゲスト/認証ユーザー × チャット/アップロードごとの受付制御
+admission_controller = AdmissionController(
+    lanes=build_lane_configs(settings),
+    max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
+
+# ミドルウェアの適用 (後に登録したものが外側になるため、プロファイルは認証の内側で行う)
+app.add_middleware(ProfilingMiddleware)
 app.middleware("http")(auth_middleware)
 
 # --- 依存性注入: 認証ミドルウェアからClaimsを取得 ---
@@ -46,6 +98,36 @@ def get_current_claims(request: Request) -> AuthClaims:
         raise HTTPException(status_code=401, detail="認証情報が見つかりません。")
     return request.state.claims
 
+def get_admin_claims(claims: AuthClaims = Depends(get_current_claims)) -> AuthClaims:
+    """管理用エンドポイントの依存性注入関数 (ADMIN_USER_IDS に含まれるユーザーのみ許可する)"""
+    if not is_admin(claims):
+        raise HTTPException(status_code=403, detail="管理者権限が必要です。")
+    return claims
+
+def get_guest_principal(request: Request) -> str:
+    """
+    ゲストの受付制御 (レート制限) の主体。ゲストIDはクライアントが自由に選べるため、接続元のアドレスを使う。
+    TRUSTED_CLIENT_IP_HEADER が設定されている場合は、プロキシが末尾に追加したアドレスを使う
+    (先頭側の値はクライアントが偽装できる)。
+    """
+    address = None
+    if settings.TRUSTED_CLIENT_IP_HEADER:
+        forwarded = request.headers.get(settings.TRUSTED_CLIENT_IP_HEADER, "")
+        address = forwarded.split(",")[-1].strip() or None
+    if address is None and request.client is not None:
+        address = request.client.host
+    return f"guest_ip_{address or 'unknown'}"
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    logger.warning(f"Admission rejected on {request.url.path}: {exc.lane} ({exc.reason})")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "リクエストが混み合っています。しばらくしてから再試行してください。"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 @app.on_event("startup")
 async def startup_event():
@@ -55,84 +137,309 @@ async def startup_event():
 
 # --- Internal Helper Functions ---
 
-async def _handle_document_upload(file: UploadFile, collection_name: str, uploader_context: str):
-    """共通のファイルアップロード処理"""
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="ファイル名がありません。")
+# アップロードのエンドポイントは本文を自前で解析するため、OpenAPIの定義を明示する
+UPLOAD_OPENAPI_EXTRA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary", "description": "アップロードするファイル"}},
+                }
+            }
+        },
+    }
+}
+
+
+def reject_oversized_upload(request: Request):
+    """本文を読む前 (受付制御のトークンを消費する前) に、Content-Length が上限を超えるアップロードを拒否する"""
+    try:
+        check_content_length(request, settings.MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-    safe_filename = secure_filename(file.filename)
-    # ファイル名にアップローダーのコンテキスト（guest_idなど）を含めて一意性を高める
-    unique_filename = f"{uploader_context}_{safe_filename}"
-    file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
-    file_ext = os.path.splitext(safe_filename)[1].lower()
 
-    if file_ext not in SUPPORTED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail=f"サポートされていないファイル形式です: {file_ext}")
+def _upload_path(uploader_context: str, safe_filename: str) -> str:
+    return os.path.join(settings.UPLOAD_DIR, f"{uploader_context}_{safe_filename}")
+
+
+async def _handle_document_upload(request: Request, collection_name: str, uploader_context: str):
+    """共通のファイルアップロード処理 (受付制御の実行枠を確保してから本文を受信する)"""
+    def prepare(filename: str):
+        safe_filename = secure_filename(filename)
+        if not safe_filename:
+            raise UploadRejected(400, "ファイル名がありません。")
+        file_ext = os.path.splitext(safe_filename)[1].lower()
+        if file_ext not in SUPPORTED_EXTENSIONS:
+            raise UploadRejected(400, f"サポートされていないファイル形式です: {file_ext}")
+        return file_ext
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # サイズ上限・マジックバイト・ハッシュ計算を受信しながら行う
+        upload = await receive_upload(
+            request,
+            "file",
+            prepare,
+            spool_dir=settings.UPLOAD_DIR,
+            max_bytes=settings.MAX_UPLOAD_BYTES,
+            memory_threshold=settings.UPLOAD_IN_MEMORY_THRESHOLD_BYTES,
+        )
+    except UploadRejected as e:
+        logger.warning(f"Rejected upload for '{collection_name}': {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    safe_filename = secure_filename(upload.filename)
+    # ファイル名にアップローダーのコンテキスト（guest_idなど）を含めて一意性を高める
+    unique_filename = f"{uploader_context}_{safe_filename}"
+    file_path = _upload_path(uploader_context, safe_filename)
 
-        # `process_documents` に `unique_filename` を渡すように変更
-        documents = process_documents(file_path, unique_filename)
+    try:
+        # 同一内容のファイルでも、応答で返すファイル名でダウンロードできるよう保存はする
+        await run_in_threadpool(upload.commit, file_path)
+
+        # 同一内容のファイルが既に取り込まれている場合は、再度のEmbeddingを行わない
+        if await run_in_threadpool(chroma_manager.has_content_hash, collection_name, upload.sha256):
+            logger.info(f"Skipping duplicate upload {safe_filename} ({upload.sha256}) for '{collection_name}'")
+            return {"filename": safe_filename, "chunks_added": 0, "collection_name": collection_name, "duplicate": True}
+
+        # 解析とEmbeddingはCPUを占有するため、イベントループを塞がないようスレッドプールで実行する
+        # 閾値以下のファイルはメモリ上の内容をそのまま解析し、ディスクからの再読み込みを省く
+        policy = resolve_chunk_policy(collection_name, chunk_policies)
+        documents, report = await run_in_threadpool(process_documents, file_path, unique_filename, upload.content, policy)
         if not documents:
             raise HTTPException(status_code=400, detail="ファイルからテキストを抽出できませんでした。")
-
-        chroma_manager.add_documents(documents, collection_name=collection_name)
-        return {"filename": safe_filename, "chunks_added": len(documents), "collection_name": collection_name}
+        for doc in documents:
+            doc.metadata["content_hash"] = upload.sha256
+
+        embed_started = time.perf_counter()
+        await run_in_threadpool(chroma_manager.add_documents, documents, collection_name=collection_name)
+        report.embedding_seconds = round(time.perf_counter() - embed_started, 3)
+
+        metrics.observe("chunks_per_file", report.chunks)
+        metrics.observe("chunk_duplicate_char_ratio", report.duplicate_char_ratio)
+        metrics.observe("embedding_seconds_per_file", report.embedding_seconds)
+        logger.info(f"Chunked {safe_filename} for '{collection_name}': {report.to_dict()}")
+        return {
+            "filename": safe_filename,
+            "chunks_added": len(documents),
+            "collection_name": collection_name,
+            "duplicate": False,
+            "chunking": report.to_dict(),
+        }
+    except HTTPException:
+        upload.discard()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
     except Exception as e:
-        # エラーが発生した場合でも、作成されたファイルを削除しないように変更
         logger.error(f"Error processing file {safe_filename}: {e}", exc_info=True)
         # アップロードされたファイルを削除する
+        upload.discard()
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
-    finally:
-        await file.close()
 
 
-def _handle_chat_request(request: ChatRequest, collection_name: str):
-    """共通のチャット処理"""
-    # 1. ベクトル検索
-    search_results = chroma_manager.search(request.query, collection_name=collection_name, k=3)
+def _prepare_chat(request: ChatRequest, collection_name: str, owner: str):
+    """会話セッションの取得と検索 (回答生成の前段)"""
+    # 0. 会話セッションの取得 (他の利用者・他のコレクションのセッションは引き継がない)
+    session = conversation_store.get_or_create(request.session_id, owner=f"{owner}:{collection_name}")
+    history = session.render_history(settings.CHAT_HISTORY_TOKEN_BUDGET)
+
+    # 1. ベクトル検索 (続きの質問は、履歴を踏まえた単独の質問に書き換えてから検索する)
+    retrieval_query = request.query
+    if history and settings.CHAT_QUERY_REWRITE:
+        retrieval_query = gemini_chat.rewrite_query(request.query, history)
+    search_results = chroma_manager.search(retrieval_query, collection_name=collection_name, k=3)
     sources = sorted(list(set(doc.metadata.get("source", "不明") for doc in search_results)))
 
-    # 2. LLMによる回答生成
+    # 2. 講義ごとに共通のプロンプト先頭部分 (よく検索されるチャンクは先頭部分に移り、質問ごとの部分では省かれる)
+    prompt_prefix_cache.record_retrieval(collection_name, search_results)
+    prefix = prompt_prefix_cache.get_prefix(collection_name, request.system_prompt or DEFAULT_SYSTEM_PROMPT)
+    return session, history, search_results, sources, prefix
+
+def _handle_chat_request(request: ChatRequest, collection_name: str, owner: str):
+    """共通のチャット処理"""
+    started = time.perf_counter()
+    session, history, search_results, sources, prefix = _prepare_chat(request, collection_name, owner)
+
+    # 3. LLMによる回答生成
     response_text = gemini_chat.generate_response(
-        query=request.query, context_docs=search_results, system_prompt_override=request.system_prompt
+        query=request.query,
+        context_docs=search_results,
+        system_prompt_override=request.system_prompt,
+        history=history,
+        prefix=prefix,
     )
-    return {"response": response_text, "sources": sources}
+    conversation_store.add_turn(session, request.query, response_text)
+    metrics.observe("chat_turn_seconds", time.perf_counter() - started)
+    return {"response": response_text, "sources": sources, "session_id": session.session_id}
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """送信の完了・失敗・クライアントの切断のいずれでも、受付制御の枠を返却するストリーミング応答"""
+
+    def __init__(self, content, admission, **kwargs):
+        super().__init__(content, **kwargs)
+        self._admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._admission.__aexit__(None, None, None)
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+async def _stream_chat_response(request: ChatRequest, collection_name: str, owner: str, lane: str, principal: str):
+    """
+    回答を生成されたそばから改行区切りJSONで返す共通のチャット処理。
+    受付制御の枠は応答の送信が終わるまで保持するため、コンテキストマネージャを手動で開閉する
+    (枠を確保できない場合は、応答を開始する前に429を返す)。
+    """
+    admission = admission_controller.admit(lane, principal)
+    await admission.__aenter__()
+
+    async def events():
+        started = time.perf_counter()
+        try:
+            session, history, search_results, sources, prefix = await run_in_threadpool(
+                _prepare_chat, request, collection_name, owner
+            )
+            yield _ndjson({"type": "sources", "sources": sources, "session_id": session.session_id})
+
+            parts = []
+            stream = gemini_chat.generate_response_stream(
+                query=request.query,
+                context_docs=search_results,
+                system_prompt_override=request.system_prompt,
+                history=history,
+                prefix=prefix,
+            )
+            async for text in iterate_in_threadpool(stream):
+                parts.append(text)
+                yield _ndjson({"type": "delta", "text": text})
+
+            response_text = "".join(parts).strip()
+            conversation_store.add_turn(session, request.query, response_text)
+            metrics.observe("chat_turn_seconds", time.perf_counter() - started)
+            yield _ndjson({"type": "done", "response": response_text, "sources": sources, "session_id": session.session_id})
+        except Exception as e:
+            logger.error(f"Streaming chat failed for {collection_name}: {e}", exc_info=True)
+            yield _ndjson({"type": "error", "detail": f"チャット処理中にエラーが発生しました: {str(e)}"})
+
+    return _AdmittedStreamingResponse(events(), admission, media_type="application/x-ndjson")
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/api/v1/metrics", tags=["Monitoring"])
+async def get_metrics():
+    """プロセス内メトリクスと、受付制御キュー・検索結果キャッシュの状態を返す"""
+    return {
+        **metrics.snapshot(),
+        "admission": admission_controller.stats(),
+        "retrieval_cache": chroma_manager.retrieval_cache.stats(),
+    }
+
+@app.post("/api/v1/admin/profiles", tags=["Admin"])
+async def start_profile(
+    seconds: float = Query(10.0, gt=0, le=settings.PROFILING_MAX_SECONDS),
+    claims: AuthClaims = Depends(get_admin_claims),
+):
+    """指定秒数の間、全スレッドのスタックを採取する (結果は GET /api/v1/admin/profiles/{id} で取得する)"""
+    try:
+        session = profiler.start("window", f"user {claims.user_id}", seconds=seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.summary()
+
+@app.get("/api/v1/admin/profiles", tags=["Admin"])
+async def list_profiles(claims: AuthClaims = Depends(get_admin_claims)):
+    """実行中と保持しているプロファイルの一覧 (X-Profile ヘッダーを付けたリクエストの処理中に採取したものを含む)"""
+    return profiler.list()
+
+@app.get("/api/v1/admin/profiles/{profile_id}", tags=["Admin"])
+async def get_profile(profile_id: str, claims: AuthClaims = Depends(get_admin_claims)):
+    """プロファイルを collapsed 形式で返す (flamegraph.pl や speedscope でそのまま読み込める)"""
+    collapsed = profiler.collapsed(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません。")
+    return PlainTextResponse(collapsed)
+
+@app.post("/api/v1/admin/allocations/start", tags=["Admin"])
+async def start_allocation_tracking(
+    nframes: int = Query(10, ge=1, le=100),
+    claims: AuthClaims = Depends(get_admin_claims),
+):
+    """tracemalloc によるメモリ確保の追跡を開始する (追跡中は全体の処理が遅くなる)"""
+    allocation_tracker.start(nframes)
+    return allocation_tracker.status()
+
+@app.post("/api/v1/admin/allocations/stop", tags=["Admin"])
+async def stop_allocation_tracking(claims: AuthClaims = Depends(get_admin_claims)):
+    allocation_tracker.stop()
+    return allocation_tracker.status()
+
+@app.get("/api/v1/admin/allocations", tags=["Admin"])
+async def get_allocation_snapshot(
+    limit: int = Query(25, ge=1, le=500),
+    key_type: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    claims: AuthClaims = Depends(get_admin_claims),
+):
+    """確保量の多い箇所と、前回のスナップショットからの増加量を返す"""
+    try:
+        return await run_in_threadpool(allocation_tracker.snapshot, limit, key_type)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.get("/api/v1/download/{filename}", tags=["Download"])
-async def download_file(filename: str):
+async def download_file(request: Request, filename: str):
     """
     アップロードされたファイルをダウンロードする
+    ETag/Last-Modified による304応答と、Rangeリクエストによる部分取得に対応する
     """
-    file_path = os.path.join(settings.UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+    upload_dir = os.path.realpath(settings.UPLOAD_DIR)
+    file_path = os.path.realpath(os.path.join(upload_dir, filename))
+    if os.path.dirname(file_path) != upload_dir or not os.path.isfile(file_path):
         raise HTTPException(status_code=404, detail="ファイルが見つかりません。")
-    return FileResponse(path=file_path, filename=filename)
+    return await run_in_threadpool(
+        build_file_response,
+        request,
+        file_path,
+        filename,
+        cache_control=settings.DOWNLOAD_CACHE_CONTROL,
+        precompress=settings.DOWNLOAD_PRECOMPRESS_TEXT,
+    )
 
-@app.post("/api/v1/lectures/{lecture_id}/upload", tags=["RAG"])
+@app.post(
+    "/api/v1/lectures/{lecture_id}/upload",
+    tags=["RAG"],
+    dependencies=[Depends(reject_oversized_upload)],
+    openapi_extra=UPLOAD_OPENAPI_EXTRA,
+)
 async def upload_document(
+    request: Request,
     lecture_id: int = Path(..., title="講義ID", ge=1),
-    file: UploadFile = File(..., description="アップロードするファイル"),
     claims: AuthClaims = Depends(get_current_claims)
 ):
     # ここでclaims.user_idを使って、アップロード権限があるかなどをチェック可能（ロジックはapi-go側にあると仮定）
     logger.info(f"User {claims.user_id} uploading file for lecture {lecture_id}")
 
-    try:
-        collection_name = f"lecture_{lecture_id}"
-        uploader_context = f"user_{claims.user_id}_lecture_{lecture_id}"
-        return await _handle_document_upload(file, collection_name, uploader_context)
-    except Exception as e:
-        logger.error(f"File upload failed for lecture {lecture_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
+    collection_name = f"lecture_{lecture_id}"
+    uploader_context = f"user_{claims.user_id}_lecture_{lecture_id}"
+    async with admission_controller.admit(AUTH_UPLOAD, f"user_{claims.user_id}"):
+        try:
+            return await _handle_document_upload(request, collection_name, uploader_context)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"File upload failed for lecture {lecture_id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
 
 @app.post("/api/v1/lectures/{lecture_id}/chat", tags=["RAG"])
 async def chat_with_document(
@@ -143,40 +450,78 @@ async def chat_with_document(
     logger.info(f"User {claims.user_id} chatting with lecture {lecture_id}")
     collection_name = f"lecture_{lecture_id}"
 
-    try:
-        return _handle_chat_request(request, collection_name)
-    except Exception as e:
-        logger.error(f"Chat failed for lecture {lecture_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"チャット処理中にエラーが発生しました: {str(e)}")
+    async with admission_controller.admit(AUTH_CHAT, f"user_{claims.user_id}"):
+        try:
+            return await run_in_threadpool(_handle_chat_request, request, collection_name, f"user_{claims.user_id}")
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Chat failed for lecture {lecture_id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"チャット処理中にエラーが発生しました: {str(e)}")
+
+@app.post("/api/v1/lectures/{lecture_id}/chat/stream", tags=["RAG"])
+async def stream_chat_with_document(
+    request: ChatRequest,
+    lecture_id: int = Path(..., title="講義ID", ge=1),
+    claims: AuthClaims = Depends(get_current_claims)
+):
+    logger.info(f"User {claims.user_id} streaming chat with lecture {lecture_id}")
+    collection_name = f"lecture_{lecture_id}"
+    principal = f"user_{claims.user_id}"
+    return await _stream_chat_response(request, collection_name, principal, AUTH_CHAT, principal)
 
 # --- Guest Endpoints (No Authentication) ---
 
-@app.post("/api/v1/guest/{guest_id}/upload", tags=["Guest"])
+@app.post(
+    "/api/v1/guest/{guest_id}/upload",
+    tags=["Guest"],
+    dependencies=[Depends(reject_oversized_upload)],
+    openapi_extra=UPLOAD_OPENAPI_EXTRA,
+)
 async def guest_upload_document(
+    request: Request,
     guest_id: str = Path(..., title="ゲストID"),
-    file: UploadFile = File(..., description="アップロードするファイル"),
+    principal: str = Depends(get_guest_principal),
 ):
     logger.info(f"Guest {guest_id} uploading file.")
 
-    try:
-        collection_name = f"guest_{guest_id}"
-        uploader_context = f"guest_{guest_id}"
-        return await _handle_document_upload(file, collection_name, uploader_context)
-    except Exception as e:
-        logger.error(f"Guest file upload failed for guest {guest_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
+    collection_name = f"guest_{guest_id}"
+    uploader_context = f"guest_{guest_id}"
+    async with admission_controller.admit(GUEST_UPLOAD, principal):
+        try:
+            return await _handle_document_upload(request, collection_name, uploader_context)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Guest file upload failed for guest {guest_id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
 
 
 @app.post("/api/v1/guest/{guest_id}/chat", tags=["Guest"])
 async def guest_chat_with_document(
     request: ChatRequest,
     guest_id: str = Path(..., title="ゲストID"),
+    principal: str = Depends(get_guest_principal),
 ):
     logger.info(f"Guest {guest_id} chatting.")
     collection_name = f"guest_{guest_id}"
 
-    try:
-        return _handle_chat_request(request, collection_name)
-    except Exception as e:
-        logger.error(f"Guest chat failed for guest {guest_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"チャット処理中にエラーが発生しました: {str(e)}")
\ No newline at end of file
+    async with admission_controller.admit(GUEST_CHAT, principal):
+        try:
+            return await run_in_threadpool(_handle_chat_request, request, collection_name, collection_name)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Guest chat failed for guest {guest_id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"チャット処理中にエラーが発生しました: {str(e)}")
+
+
+@app.post("/api/v1/guest/{guest_id}/chat/stream", tags=["Guest"])
+async def guest_stream_chat_with_document(
+    request: ChatRequest,
+    guest_id: str = Path(..., title="ゲストID"),
+    principal: str = Depends(get_guest_principal),
+):
+    logger.info(f"Guest {guest_id} streaming chat.")
+    collection_name = f"guest_{guest_id}"
+    return await _stream_chat_response(request, collection_name, collection_name, GUEST_CHAT, principal)
@@ -1,52 +1,137 @@
 # rag-python/app/rag/chroma_manager.py
 
 import chromadb
+from chromadb.db.base import UniqueConstraintError
 import logging
-from typing import List
+import threading
+from typing import Any, Dict, List, Optional
 from langchain.docstore.document import Document
 from sentence_transformers import SentenceTransformer
+import numpy as np
 import uuid
 
+from rag.collection_aliases import CollectionAliases, embedding_key
+from rag.embeddings import encode_passages, encode_query, load_embedding_model
+from rag.retrieval_cache import RetrievalCache, RetrievalResult
+from rag.vector_index import ExactSearchCache, IndexConfig, resolve_index_config
+
 logger = logging.getLogger(__name__)
 
 class ChromaManager:
     """ChromaDBとのインタラクションを管理するクラス (マルチテナント対応版)"""
 
-    def __init__(self, persist_directory: str, embedding_model_name: str):
+    def __init__(
+        self,
+        persist_directory: str,
+        embedding_model_name: str,
+        index_configs: Optional[Dict[str, IndexConfig]] = None,
+        exact_search_max_vectors: int = 0,
+        exact_search_cache_bytes: int = 128 * 1024 * 1024,
+        embedding_model: Optional[SentenceTransformer] = None,
+        retrieval_cache_entries: int = 0,
+        embedding_dimensions: int = 0,
+        exact_search_dtype: str = "float32",
+        exact_search_rescore_factor: int = 1,
+        defer_model_loading: bool = False,
+    ):
         logger.info(f"Initializing ChromaDB client at {persist_directory}")
         logger.info(f"Loading embedding model: {embedding_model_name}")
         self.persist_directory = persist_directory
-
-        self.embedding_model = SentenceTransformer(
-            model_name_or_path=embedding_model_name,
-            device='cpu',
-            trust_remote_code=True
+        self.embedding_model_name = embedding_model_name
+        # Matryoshka対応モデルのベクトルを切り詰める次元数 (0 で切り詰めない)
+        self.embedding_dimensions = embedding_dimensions
+        # 対応表とコレクションのメタデータでは、次元数を含めた名前でEmbeddingの種類を区別する
+        self.embedding_key = embedding_key(embedding_model_name, embedding_dimensions)
+        # 論理コレクション名から、現在のEmbeddingモデル用の物理コレクションを解決する
+        self.aliases = CollectionAliases(persist_directory)
+        # コレクション名のプレフィックスごとのHNSW設定 (新規作成時のみ適用される)
+        self.index_configs = index_configs or {}
+        # この件数以下のコレクションはHNSWを使わず総当たりで検索する
+        self.exact_search_max_vectors = exact_search_max_vectors
+        self.exact_search = ExactSearchCache(
+            max_total_bytes=exact_search_cache_bytes,
+            dtype=exact_search_dtype,
+            rescore_factor=exact_search_rescore_factor,
         )
+        # 同じ質問の検索結果 (チャンクIDと距離) を、コレクションが更新されるまで再利用する
+        self.retrieval_cache = RetrievalCache(max_entries=retrieval_cache_entries)
+        self._collections: Dict[str, Any] = {}
+        # コレクションへの書き込みごとに増える、プロセス内のバージョン番号
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        # 評価ツールなどで複数のインスタンスを作る場合は、読み込み済みのモデルを共有できる
+        # スナップショットの取り込みなどEmbeddingを計算しない用途では、最初に必要になるまで読み込まない
+        self._embedding_model = embedding_model
+        if self._embedding_model is None and not defer_model_loading:
+            self._embedding_model = load_embedding_model(embedding_model_name)
         self.client = chromadb.PersistentClient(path=self.persist_directory)
 
-    def _get_collection(self, collection_name: str):
-        """指定された名前のコレクションを取得または作成する"""
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        if self._embedding_model is None:
+            with self._lock:
+                if self._embedding_model is None:
+                    self._embedding_model = load_embedding_model(self.embedding_model_name)
+        return self._embedding_model
+
+    def _get_collection(self, collection_name: str, index_metadata: Optional[Dict[str, Any]] = None):
+        """
+        指定された名前のコレクションを取得または作成する
+        既存コレクションのHNSW設定は変更できないため、インデックス設定は新規作成時にのみ渡す
+        返されるコレクションの `name` は物理コレクション名 (再インデックス後はシャドーコレクション)
+        """
+        physical_name = self.aliases.resolve(self.embedding_key, collection_name)
+        collection = self._collections.get(physical_name)
+        if collection is not None:
+            return collection
         try:
-            return self.client.get_or_create_collection(name=collection_name)
+            try:
+                collection = self.client.get_collection(name=physical_name)
+            except ValueError:
+                if index_metadata is None:
+                    index_metadata = resolve_index_config(collection_name, self.index_configs).to_metadata()
+                metadata = {**index_metadata, "embedding_model": self.embedding_key}
+                try:
+                    collection = self.client.create_collection(name=physical_name, metadata=metadata)
+                    logger.info(f"Created collection '{physical_name}' with {index_metadata}")
+                except UniqueConstraintError:
+                    collection = self.client.get_collection(name=physical_name)
         except Exception as e:
-            logger.error(f"Failed to get or create collection '{collection_name}': {e}", exc_info=True)
+            logger.error(f"Failed to get or create collection '{physical_name}': {e}", exc_info=True)
             raise RuntimeError(f"Could not access collection '{collection_name}'")
 
-    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
-        embeddings = self.embedding_model.encode(
-            texts,
-            prompt_name="Retrieval-passage",
-            normalize_embeddings=True
-        )
-        return embeddings.tolist()
+        stored_model = (collection.metadata or {}).get("embedding_model")
+        if stored_model and stored_model != self.embedding_key:
+            logger.warning(
+                f"Collection '{physical_name}' was embedded with '{stored_model}' but the current model is "
+                f"'{self.embedding_key}'. Run the reindex command to rebuild it."
+            )
+        self._collections[physical_name] = collection
+        return collection
 
-    def _embed_query(self, text: str) -> List[float]:
-        embedding = self.embedding_model.encode(
-            text,
-            prompt_name="Retrieval-query",
-            normalize_embeddings=True
-        )
-        return embedding.tolist()
+    def get_collection(self, collection_name: str, index_metadata: Optional[Dict[str, Any]] = None):
+        """
+        論理コレクション名に対応する物理コレクションを返す (無ければ作成する)。
+        index_metadata (コレクションのメタデータのうち "hnsw:" で始まる項目) を渡すと、
+        新規作成時にコレクション名から決まるインデックス設定の代わりに使う (スナップショットの取り込み用)
+        """
+        return self._get_collection(collection_name, index_metadata)
+
+    def _bump_version(self, collection_name: str):
+        with self._lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+        self.exact_search.invalidate(collection_name)
+        self.retrieval_cache.invalidate(collection_name)
+
+    def get_version(self, collection_name: str) -> int:
+        return self._versions.get(collection_name, 0)
+
+    def _embed_documents(self, texts: List[str]) -> np.ndarray:
+        return encode_passages(self.embedding_model, texts, dimensions=self.embedding_dimensions)
+
+    def _embed_query(self, text: str) -> np.ndarray:
+        return encode_query(self.embedding_model, text, dimensions=self.embedding_dimensions)
 
     def add_documents(self, documents: List[Document], collection_name: str):
         collection = self._get_collection(collection_name)
@@ -61,21 +146,103 @@ class ChromaManager:
 
         embeddings = self._embed_documents(texts)
 
-        collection.add(embeddings=embeddings, metadatas=metadatas, documents=texts, ids=ids)
+        # Chroma 0.5 はリストしか受け付けないため、変換は書き込み直前の1回だけにする
+        collection.add(embeddings=embeddings.tolist(), metadatas=metadatas, documents=texts, ids=ids)
+        self._bump_version(collection.name)
         logger.info(f"Added {len(documents)} documents to collection '{collection_name}'.")
 
-    def search(self, query: str, collection_name: str, k: int = 3) -> List[Document]:
+    def add_embeddings(
+        self,
+        collection_name: str,
+        ids: List[str],
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        batch_size: int = 5000,
+    ) -> int:
+        """
+        計算済みのEmbeddingをそのまま書き込む (スナップショットの取り込み用)。
+        upsert のため、途中で失敗しても同じデータで再実行できる。書き込んだ件数を返す
+        """
+        collection = self._get_collection(collection_name)
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.upsert(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end].tolist(),
+                documents=documents[start:end],
+                # Chromaは空のメタデータを受け付けないため None にする
+                metadatas=[metadata or None for metadata in metadatas[start:end]],
+            )
+        self._bump_version(collection.name)
+        logger.info(f"Imported {len(ids)} embeddings into collection '{collection_name}'.")
+        return len(ids)
+
+    def has_content_hash(self, collection_name: str, content_hash: str) -> bool:
+        """同じ内容のファイルから作成されたチャンクが既にコレクションに存在するかを返す"""
+        collection = self._get_collection(collection_name)
+        existing = collection.get(where={"content_hash": content_hash}, limit=1, include=[])
+        return bool(existing and existing.get("ids"))
+
+    def _get_cached(self, collection, result: RetrievalResult) -> Optional[Dict[str, List[List[Any]]]]:
+        """キャッシュしたチャンクIDから、`collection.query` と同じ形式の結果を組み立てる"""
+        data = collection.get(ids=list(result.ids), include=['documents', 'metadatas'])
+        found = {
+            chunk_id: (document, metadata)
+            for chunk_id, document, metadata in zip(data['ids'], data['documents'], data['metadatas'])
+        }
+        if any(chunk_id not in found for chunk_id in result.ids):
+            return None
+        return {
+            'ids': [list(result.ids)],
+            'documents': [[found[chunk_id][0] for chunk_id in result.ids]],
+            'metadatas': [[found[chunk_id][1] for chunk_id in result.ids]],
+            'distances': [list(result.distances)],
+        }
+
+    def search(
+        self,
+        query: str,
+        collection_name: str,
+        k: int = 3,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
         collection = self._get_collection(collection_name)
         if not query:
             return []
 
-        query_embedding = self._embed_query(query)
+        count = collection.count()
+        if count == 0:
+            return []
+        # 他プロセスからの書き込みも検知できるよう、件数もバージョンに含める
+        version = (self.get_version(collection.name), count)
+
+        results = None
+        cache_key = None
+        if self.retrieval_cache.enabled:
+            cache_key = self.retrieval_cache.make_key(collection.name, version, query, k, where)
+            cached = self.retrieval_cache.get(cache_key)
+            if cached is not None:
+                results = self._get_cached(collection, cached)
 
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k,
-            include=['documents', 'metadatas', 'distances']
-        )
+        if results is None:
+            query_embedding = self._embed_query(query)
+            if count <= self.exact_search_max_vectors and not where:
+                # 小規模コレクションは行列積による総当たり検索の方が速く、結果も厳密
+                space = (collection.metadata or {}).get("hnsw:space", "l2")
+                results = self.exact_search.query(collection.name, collection, version, query_embedding, k, space)
+            else:
+                results = collection.query(
+                    query_embeddings=[query_embedding.tolist()],
+                    n_results=k,
+                    where=where,
+                    include=['documents', 'metadatas', 'distances']
+                )
+            if cache_key is not None and results and results.get('ids'):
+                self.retrieval_cache.put(cache_key, RetrievalResult(
+                    ids=tuple(results['ids'][0]),
+                    distances=tuple(results['distances'][0]),
+                ))
 
         retrieved_docs: List[Document] = []
         if not results or not results.get('ids') or not results['ids'][0]:
@@ -0,0 +1,232 @@
+# rag-python/app/rag/chunking.py
+
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+# 区切りの強さ (大きいほど強い区切り)
+BREAK_SENTENCE = 0
+BREAK_BLOCK = 1      # 段落・箇条書きの項目
+BREAK_SECTION = 2    # 見出し
+BREAK_PAGE = 3       # ページ・スライド
+
+# 見出し: Markdown見出し、「第N章/節」、多段番号 (1.2 など)、【見出し】
+_HEADING_PATTERN = re.compile(
+    r"^(#{1,6}\s+\S.*"
+    r"|第[0-9０-９一二三四五六七八九十百]+[章節部回項講].{0,40}"
+    r"|[0-9０-９]+(?:[\.．][0-9０-９]+)+\.?\s+\S.{0,40}"
+    r"|【[^】]{1,40}】)$"
+)
+# 箇条書き: 記号・丸数字・(1)・1) など
+_LIST_ITEM_PATTERN = re.compile(
+    r"^([・●○■□◆◇▪•\-\*‐–]|[①-⑳]|[\(（][0-9０-９a-zA-Z]{1,2}[\)）]|[0-9０-９]{1,2}[\.．\)）])\s*\S"
+)
+# 文末: 日本語の句点・感嘆符・疑問符 (閉じ括弧を含む) と、英文のピリオド+空白
+_SENTENCE_END_PATTERN = re.compile(r"(?<=[。！？!?])(?![」』）\)!?！？。])\s*|(?<=[a-zA-Z0-9]\.)\s+")
+_CJK_PATTERN = re.compile(r"[　-ヿ㐀-鿿＀-￯]")
+
+
+@dataclass(frozen=True)
+class ChunkPolicy:
+    """チャンクの最大文字数と、直前のチャンクから引き継ぐ文の最大文字数"""
+    chunk_size: int = 800
+    chunk_overlap: int = 80
+    # この割合以上埋まっていれば、見出しやページの境界でチャンクを区切る
+    min_fill_ratio: float = 0.5
+
+
+def build_chunk_policies(settings) -> Dict[str, ChunkPolicy]:
+    """コレクション名のプレフィックスごとのチャンク分割ポリシーを組み立てる"""
+    return {
+        "lecture_": ChunkPolicy(chunk_size=settings.LECTURE_CHUNK_SIZE, chunk_overlap=settings.LECTURE_CHUNK_OVERLAP),
+        "guest_": ChunkPolicy(chunk_size=settings.GUEST_CHUNK_SIZE, chunk_overlap=settings.GUEST_CHUNK_OVERLAP),
+    }
+
+
+def resolve_chunk_policy(collection_name: str, policies: Dict[str, ChunkPolicy]) -> ChunkPolicy:
+    for prefix, policy in policies.items():
+        if collection_name.startswith(prefix):
+            return policy
+    return ChunkPolicy()
+
+
+@dataclass
+class ChunkingReport:
+    """1ファイル分のチャンク分割結果の統計"""
+    chunks: int = 0
+    source_chars: int = 0
+    chunk_chars: int = 0
+    duplicate_chars: int = 0
+    embedding_seconds: float = 0.0
+
+    @property
+    def duplicate_char_ratio(self) -> float:
+        return self.duplicate_chars / self.chunk_chars if self.chunk_chars else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "duplicate_char_ratio": round(self.duplicate_char_ratio, 4)}
+
+
+@dataclass
+class _Segment:
+    text: str
+    break_before: int
+    metadata: Dict[str, Any]
+    section: Optional[str] = None
+
+
+@dataclass
+class _Chunk:
+    segments: List[_Segment] = field(default_factory=list)
+    length: int = 0
+    overlap_chars: int = 0
+
+
+def _join_lines(lines: List[str]) -> str:
+    """PDF抽出で途中改行された行を結合する (日本語同士は空白なし、それ以外は空白で連結)"""
+    text = ""
+    for line in lines:
+        if text and not (_CJK_PATTERN.match(text[-1]) and _CJK_PATTERN.match(line[0])):
+            text += " "
+        text += line
+    return text
+
+
+def _split_sentences(text: str) -> List[str]:
+    return [s for s in _SENTENCE_END_PATTERN.split(text) if s and s.strip()]
+
+
+def _iter_blocks(text: str):
+    """ページのテキストを (種類, テキスト) のブロック列に分解する"""
+    paragraph: List[str] = []
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            if paragraph:
+                yield "paragraph", _join_lines(paragraph)
+                paragraph = []
+            continue
+        kind = "heading" if _HEADING_PATTERN.match(line) else "list" if _LIST_ITEM_PATTERN.match(line) else None
+        if kind:
+            if paragraph:
+                yield "paragraph", _join_lines(paragraph)
+                paragraph = []
+            yield kind, line
+        else:
+            paragraph.append(line)
+    if paragraph:
+        yield "paragraph", _join_lines(paragraph)
+
+
+class StructureAwareSplitter:
+    """
+    ページ・見出し・箇条書き・文の境界を尊重してチャンクを作成する分割器。
+    文の途中では区切らず、重複は同じ節の中で直前の文を引き継ぐ場合にのみ発生する。
+    """
+
+    def __init__(self, policy: ChunkPolicy):
+        self.policy = policy
+
+    def _segments(self, documents: List[Document]) -> List[_Segment]:
+        segments: List[_Segment] = []
+        for page in documents:
+            section = None
+            # 各ページ(スライド)の最初のセグメントはページ境界として扱う
+            pending = BREAK_PAGE
+            for kind, block in _iter_blocks(page.page_content):
+                if kind == "heading":
+                    section = block
+                    pieces = [(block, max(pending, BREAK_SECTION))]
+                elif kind == "list":
+                    pieces = [(block, max(pending, BREAK_BLOCK))]
+                else:
+                    sentences = _split_sentences(block)
+                    pieces = [(text, max(pending, BREAK_BLOCK) if i == 0 else BREAK_SENTENCE) for i, text in enumerate(sentences)]
+                for text, strength in pieces:
+                    segments.append(_Segment(text, strength, page.metadata, section))
+                    pending = BREAK_SENTENCE
+        return self._split_oversized(segments)
+
+    def _split_oversized(self, segments: List[_Segment]) -> List[_Segment]:
+        """チャンク長を超える1文は、やむを得ず文字数で分割する"""
+        size = self.policy.chunk_size
+        result: List[_Segment] = []
+        for segment in segments:
+            if len(segment.text) <= size:
+                result.append(segment)
+                continue
+            for start in range(0, len(segment.text), size):
+                strength = segment.break_before if start == 0 else BREAK_SENTENCE
+                result.append(_Segment(segment.text[start:start + size], strength, segment.metadata, segment.section))
+        return result
+
+    @staticmethod
+    def _separator(previous: _Segment, segment: _Segment) -> str:
+        if segment.break_before >= BREAK_BLOCK:
+            return "\n"
+        if _CJK_PATTERN.match(previous.text[-1]) and _CJK_PATTERN.match(segment.text[0]):
+            return ""
+        return " "
+
+    def _overlap_from(self, chunk: _Chunk) -> List[_Segment]:
+        """直前のチャンク末尾から、同じ節に属する文を chunk_overlap 文字まで引き継ぐ"""
+        carried: List[_Segment] = []
+        length = 0
+        for segment in reversed(chunk.segments):
+            if length + len(segment.text) > self.policy.chunk_overlap:
+                break
+            carried.insert(0, segment)
+            length += len(segment.text)
+            if segment.break_before >= BREAK_SECTION:
+                break
+        if len(carried) == len(chunk.segments):
+            return []
+        return carried
+
+    def split(self, documents: List[Document]) -> Tuple[List[Document], ChunkingReport]:
+        policy = self.policy
+        report = ChunkingReport(source_chars=sum(len(doc.page_content) for doc in documents))
+        chunks: List[_Chunk] = []
+        current = _Chunk()
+
+        for segment in self._segments(documents):
+            added = len(segment.text) + (1 if current.segments else 0)
+            fill = current.length / policy.chunk_size
+            should_close = current.segments and (
+                current.length + added > policy.chunk_size
+                or (segment.break_before >= BREAK_SECTION and fill >= policy.min_fill_ratio)
+            )
+            if should_close:
+                chunks.append(current)
+                carried = self._overlap_from(current) if segment.break_before < BREAK_SECTION else []
+                current = _Chunk(segments=list(carried))
+                current.length = sum(len(s.text) for s in carried) + max(0, len(carried) - 1)
+                current.overlap_chars = sum(len(s.text) for s in carried)
+                # 引き継いだ文を含めると収まらない場合は、引き継ぎを諦める
+                if current.length + len(segment.text) + 1 > policy.chunk_size:
+                    current = _Chunk()
+            current.segments.append(segment)
+            current.length += len(segment.text) + (1 if len(current.segments) > 1 else 0)
+        if current.segments:
+            chunks.append(current)
+
+        result: List[Document] = []
+        for chunk in chunks:
+            first = chunk.segments[0]
+            text = first.text + "".join(
+                self._separator(prev, s) + s.text for prev, s in zip(chunk.segments, chunk.segments[1:])
+            )
+            metadata = dict(first.metadata)
+            section = next((s.section for s in chunk.segments if s.section), None)
+            if section:
+                metadata["section"] = section
+            last_page = chunk.segments[-1].metadata.get("page")
+            if last_page is not None and last_page != metadata.get("page"):
+                metadata["page_end"] = last_page
+            result.append(Document(page_content=text, metadata=metadata))
+            report.chunk_chars += len(text)
+            report.duplicate_chars += chunk.overlap_chars
+        report.chunks = len(result)
+        return result, report
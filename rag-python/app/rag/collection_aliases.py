@@ -0,0 +1,82 @@
+# rag-python/app/rag/collection_aliases.py
+
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+ALIASES_FILE_NAME = "collection_aliases.json"
+
+
+def embedding_key(model_name: str, dimensions: int = 0) -> str:
+    """
+    コレクションの対応表やメタデータで使う、Embeddingの種類を表す名前。
+    次元を切り詰める場合は、同じモデルでも別のベクトルになるため次元数を含める
+    """
+    return f"{model_name}@{dimensions}" if dimensions else model_name
+
+
+class CollectionAliases:
+    """
+    論理コレクション名 (lecture_1 など) から、Embeddingモデルごとの物理コレクション名への対応表。
+    再インデックスで作成したシャドーコレクションへの切り替えは、このファイルの置き換えで一括して行う。
+    対応表に無い場合は論理名をそのまま物理名として使う。
+
+    {"models": {"<embedding model name>": {"lecture_1": "lecture_1__3f2a9c01", ...}}}
+    """
+
+    def __init__(self, persist_directory: str):
+        self.path = os.path.join(persist_directory, ALIASES_FILE_NAME)
+        self._mtime_ns = None
+        self._models: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime_ns, self._models = None, {}
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            self._models = json.load(f).get("models", {})
+        self._mtime_ns = mtime_ns
+        logger.info(f"Loaded collection aliases from {self.path}")
+
+    def resolve(self, model_name: str, collection_name: str) -> str:
+        with self._lock:
+            self._reload_if_changed()
+            return self._models.get(model_name, {}).get(collection_name, collection_name)
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def switch(self, model_name: str, mapping: Dict[str, str]):
+        """指定モデルの対応表を更新し、一時ファイルからのrenameで原子的に置き換える"""
+        with self._file_lock():
+            models: Dict[str, Dict[str, str]] = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    models = json.load(f).get("models", {})
+            models.setdefault(model_name, {}).update(mapping)
+
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"models": models}, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        logger.info(f"Switched {len(mapping)} collections of model '{model_name}'")
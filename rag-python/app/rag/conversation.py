@@ -0,0 +1,173 @@
+# rag-python/app/rag/conversation.py
+
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r"[　-ヿ㐀-鿿＀-￯]")
+
+# (これまでの要約, 要約に畳み込む会話ターン, 要約の最大トークン数) -> 新しい要約
+Summarizer = Callable[[str, List["Turn"], int], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算 (日本語は1文字≒1トークン、それ以外は4文字≒1トークン)"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 概算値に基づいて二分探索で切り詰める
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        candidate = text[-mid:] if keep_end else text[:mid]
+        if estimate_tokens(candidate) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[-low:] if keep_end and low else text[:low]
+
+
+@dataclass
+class Turn:
+    query: str
+    response: str
+
+    def render(self) -> str:
+        return f"ユーザー: {self.query}\nアシスタント: {self.response}"
+
+
+@dataclass
+class ConversationSession:
+    """1つの会話の状態。古いターンは要約に畳み込み、直近のターンのみ原文で保持する"""
+    session_id: str
+    owner: str
+    summary: str = ""
+    turns: Deque[Turn] = field(default_factory=deque)
+    updated_at: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def render_history(self, token_budget: int) -> str:
+        """要約と直近のターンを、合計がトークン予算に収まる範囲で新しい順に採用して連結する"""
+        with self.lock:
+            summary = self.summary
+            turns = list(self.turns)
+        parts: List[str] = []
+        remaining = token_budget
+        if summary:
+            summary_text = f"(要約) {summary}"
+            summary_tokens = estimate_tokens(summary_text)
+            if summary_tokens <= remaining // 2:
+                remaining -= summary_tokens
+            else:
+                summary_text = truncate_to_tokens(summary_text, remaining // 2)
+                remaining -= estimate_tokens(summary_text)
+        for turn in reversed(turns):
+            rendered = turn.render()
+            tokens = estimate_tokens(rendered)
+            if tokens > remaining:
+                break
+            parts.insert(0, rendered)
+            remaining -= tokens
+        if summary:
+            parts.insert(0, summary_text)
+        return "\n".join(parts)
+
+
+class ConversationStore:
+    """
+    サーバー側の会話セッションを保持するストア。
+    セッション数とアイドル時間で上限を設け、超えたものから破棄する。
+    ターン数が max_recent_turns を超えると、古いターンを要約にバックグラウンドで畳み込む。
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        ttl_seconds: float,
+        max_recent_turns: int,
+        summary_max_tokens: int,
+        turn_max_tokens: int,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        self._max_sessions = max_sessions
+        self._ttl_seconds = ttl_seconds
+        self._max_recent_turns = max_recent_turns
+        self._summary_max_tokens = summary_max_tokens
+        self._turn_max_tokens = turn_max_tokens
+        self._summarizer = summarizer
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 要約はLLM呼び出しを伴うため、応答を返した後に専用スレッドで行う
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-compactor")
+
+    def _evict_expired(self, now: float):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.updated_at <= self._ttl_seconds and len(self._sessions) <= self._max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def get_or_create(self, session_id: Optional[str], owner: str) -> ConversationSession:
+        """セッションを取得する。存在しない・所有者が異なる場合は新しいセッションを作成する"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None or session.owner != owner:
+                session = ConversationSession(session_id=uuid.uuid4().hex, owner=owner)
+                self._sessions[session.session_id] = session
+            session.updated_at = now
+            self._sessions.move_to_end(session.session_id)
+            self._evict_expired(now)
+            return session
+
+    def add_turn(self, session: ConversationSession, query: str, response: str):
+        # 長い回答が履歴の予算を占有しないよう、1ターンあたりの長さを制限して保持する
+        turn = Turn(
+            query=truncate_to_tokens(query, self._turn_max_tokens // 2),
+            response=truncate_to_tokens(response, self._turn_max_tokens // 2),
+        )
+        with session.lock:
+            session.turns.append(turn)
+            overflow = len(session.turns) > self._max_recent_turns
+        if overflow:
+            self._executor.submit(self._compact, session)
+
+    def _compact(self, session: ConversationSession):
+        # 要約が完成するまでは元のターンを残し、履歴が一時的に欠けないようにする
+        with session.lock:
+            count = len(session.turns) - self._max_recent_turns
+            if count <= 0:
+                return
+            evicted = list(session.turns)[:count]
+            previous_summary = session.summary
+
+        summary = None
+        if self._summarizer is not None:
+            try:
+                summary = self._summarizer(previous_summary, evicted, self._summary_max_tokens)
+            except Exception as e:
+                logger.warning(f"Failed to summarize conversation {session.session_id}: {e}")
+        if not summary:
+            # 要約に失敗した場合は、新しい内容を優先して単純に切り詰める
+            summary = "\n".join([previous_summary] + [turn.render() for turn in evicted]).strip()
+        summary = truncate_to_tokens(summary, self._summary_max_tokens, keep_end=True)
+
+        with session.lock:
+            for _ in range(count):
+                session.turns.popleft()
+            session.summary = summary
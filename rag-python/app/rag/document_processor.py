@@ -1,11 +1,16 @@
 # rag-python/app/rag/document_processor.py
 
+import io
 import os
 import logging
-from typing import List
+from typing import List, Optional, Tuple
 from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
+from langchain_community.document_loaders.blob_loaders import Blob
+from langchain_community.document_loaders.parsers.pdf import PyPDFParser
+from langchain_community.document_loaders.parsers.txt import TextParser
+
+from rag.chunking import ChunkPolicy, ChunkingReport, StructureAwareSplitter
 
 logger = logging.getLogger(__name__)
 
@@ -15,33 +20,48 @@ SUPPORTED_EXTENSIONS = {
     ".txt": TextLoader,
 }
 
-TEXT_SPLITTER_CONFIG = {
-    "chunk_size": 1000,
-    "chunk_overlap": 200,
-}
-
 def load_document(file_path: str) -> List[Document]:
     file_ext = os.path.splitext(file_path)[1].lower()
     loader_class = SUPPORTED_EXTENSIONS.get(file_ext)
     if not loader_class:
         raise ValueError(f"Unsupported file type: {file_ext}")
-    
+
     loader = loader_class(file_path)
     return loader.load()
 
-def split_documents(documents: List[Document]) -> List[Document]:
-    text_splitter = RecursiveCharacterTextSplitter(**TEXT_SPLITTER_CONFIG)
-    return text_splitter.split_documents(documents)
+def load_document_from_bytes(content: bytes, file_path: str) -> List[Document]:
+    """メモリ上のファイル内容を、ディスクから読み直さずに各ローダーと同じ形式で読み込む"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == ".pdf":
+        return list(PyPDFParser().parse(Blob.from_data(content, path=file_path)))
+    if file_ext == ".txt":
+        return list(TextParser().parse(Blob.from_data(content, path=file_path)))
+    if file_ext == ".docx":
+        import docx2txt
+
+        return [Document(page_content=docx2txt.process(io.BytesIO(content)), metadata={"source": file_path})]
+    raise ValueError(f"Unsupported file type: {file_ext}")
 
-def process_documents(file_path: str, unique_filename: str) -> List[Document]:
-    loaded_docs = load_document(file_path)
+def split_documents(documents: List[Document], policy: ChunkPolicy) -> Tuple[List[Document], ChunkingReport]:
+    return StructureAwareSplitter(policy).split(documents)
+
+def process_documents(
+    file_path: str,
+    unique_filename: str,
+    content: Optional[bytes] = None,
+    policy: Optional[ChunkPolicy] = None,
+) -> Tuple[List[Document], ChunkingReport]:
+    if content is not None:
+        loaded_docs = load_document_from_bytes(content, file_path)
+    else:
+        loaded_docs = load_document(file_path)
     if not loaded_docs:
-        return []
+        return [], ChunkingReport()
 
-    split_docs = split_documents(loaded_docs)
+    split_docs, report = split_documents(loaded_docs, policy or ChunkPolicy())
     for doc in split_docs:
         if not isinstance(doc.metadata, dict):
             doc.metadata = {}
         doc.metadata["source"] = unique_filename
-    
-    return split_docs
\ No newline at end of file
+
+    return split_docs, report
@@ -0,0 +1,50 @@
+# rag-python/app/rag/embeddings.py
+
+import logging
+from typing import List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from rag.vector_index import truncate_embeddings
+
+logger = logging.getLogger(__name__)
+
+# retrieva-jp/amber 系モデルが定義している検索用プロンプト名
+PASSAGE_PROMPT_NAME = "Retrieval-passage"
+QUERY_PROMPT_NAME = "Retrieval-query"
+
+
+def load_embedding_model(model_name: str) -> SentenceTransformer:
+    return SentenceTransformer(
+        model_name_or_path=model_name,
+        device='cpu',
+        trust_remote_code=True
+    )
+
+
+def _prompt_name(model: SentenceTransformer, name: str) -> Optional[str]:
+    """モデルがプロンプトを定義していない場合は指定しない (モデル切り替え時に失敗しないように)"""
+    return name if name in (getattr(model, "prompts", None) or {}) else None
+
+
+def encode_passages(model: SentenceTransformer, texts: List[str], batch_size: int = 32, dimensions: int = 0) -> np.ndarray:
+    """文書チャンクを正規化済みの float32 行列 (件数 × 次元) に変換する"""
+    embeddings = model.encode(
+        texts,
+        prompt_name=_prompt_name(model, PASSAGE_PROMPT_NAME),
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+    ).astype(np.float32, copy=False)
+    return truncate_embeddings(embeddings, dimensions)
+
+
+def encode_query(model: SentenceTransformer, text: str, dimensions: int = 0) -> np.ndarray:
+    embedding = model.encode(
+        text,
+        prompt_name=_prompt_name(model, QUERY_PROMPT_NAME),
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+    ).astype(np.float32, copy=False)
+    return truncate_embeddings(embedding, dimensions)
@@ -2,58 +2,215 @@
 
 import google.generativeai as genai
 import logging
-from typing import List, Optional
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from langchain.docstore.document import Document
 
+from core.metrics import metrics
+from rag.conversation import Turn, estimate_tokens
+from rag.prompt_cache import PromptPrefix, document_key
+
+try:
+    from google.generativeai import caching
+except ImportError:  # コンテキストキャッシュに対応していないバージョン
+    caching = None
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_SYSTEM_PROMPT = "あなたは大学の講義に関する質問に答えるアシスタントです。提供された参考資料に基づいて、正確かつ簡潔に回答してください。資料に情報がない場合は、その旨を伝えてください。"
+
+
+def render_prompt_prefix(system_prompt: str, documents: List[Document]) -> str:
+    """
+    プロンプトの先頭部分 (システムプロンプトと、講義でよく参照される資料)。
+    質問ごとに変わる部分より前に置くことで、LLM側のプレフィックスキャッシュが効くようにする。
+    """
+    if not documents:
+        return f"{system_prompt}\n"
+    doc_texts = []
+    for i, doc in enumerate(documents):
+        source = doc.metadata.get('source', '不明')
+        doc_texts.append(f"--- 主要資料 {i+1} (出典: {source}) ---\n{doc.page_content}")
+    return f"{system_prompt}\n\n【講義の主要資料】\n" + "\n\n".join(doc_texts) + "\n"
+
 class GeminiChat:
-    def __init__(self, api_key: str, model_name: str):
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str,
+        context_cache_min_tokens: int = 0,
+        context_cache_ttl_seconds: float = 3600.0,
+    ):
         if not api_key:
             raise ValueError("Gemini API Key not found.")
         genai.configure(api_key=api_key)
+        self.model_name = model_name
         self.model = genai.GenerativeModel(model_name)
+        # プロンプト先頭部分のキーごとの、コンテキストキャッシュを使うモデル (作成に失敗した場合は None) と有効期限
+        self.context_cache_min_tokens = context_cache_min_tokens if caching is not None else 0
+        self.context_cache_ttl_seconds = context_cache_ttl_seconds
+        # prefix.key -> (キャッシュを使うモデル, サーバー上の CachedContent, 失効時刻)。作成に失敗した場合は両方 None
+        self._context_caches: Dict[str, Tuple[Optional[Any], Optional[Any], float]] = {}
+        self._context_cache_creating: set = set()
+        self._context_cache_lock = threading.Lock()
         logger.info(f"GeminiChat initialized with model: {model_name}")
 
-    def _create_prompt_string(self, query: str, context_docs: Optional[List[Document]], system_prompt: str) -> str:
+    def _create_prompt_suffix(
+        self,
+        query: str,
+        context_docs: Optional[List[Document]],
+        history: Optional[str] = None,
+        prefix_document_keys: frozenset = frozenset(),
+    ) -> str:
+        """質問ごとに変わるプロンプトの後半部分 (先頭部分に含まれる資料は繰り返さない)"""
         context_text = ""
         if context_docs:
             doc_texts = []
-            for i, doc in enumerate(context_docs):
+            for doc in context_docs:
+                if prefix_document_keys and document_key(doc) in prefix_document_keys:
+                    continue
                 source = doc.metadata.get('source', '不明')
-                doc_texts.append(f"--- 資料 {i+1} (出典: {source}) ---\n{doc.page_content}")
+                doc_texts.append(f"--- 資料 {len(doc_texts)+1} (出典: {source}) ---\n{doc.page_content}")
             context_text = "\n\n".join(doc_texts)
+        if not context_text:
+            context_text = "上記の主要資料を参照してください。" if prefix_document_keys and context_docs else "参考資料はありません。"
 
-        prompt = f"""{system_prompt}
+        history_text = f"\n【これまでの会話】\n{history}\n" if history else ""
 
+        suffix = f"""{history_text}
 【参考資料】
-{context_text if context_text else "参考資料はありません。"}
+{context_text}
 
 【質問】
 {query}
 
 【回答】
 """
-        return prompt
+        return suffix
 
-    def generate_response(
+    def _build_prompt(
         self,
         query: str,
         context_docs: Optional[List[Document]],
-        system_prompt_override: Optional[str] = None
-    ) -> str:
+        system_prompt_override: Optional[str],
+        history: Optional[str],
+        prefix: Optional[PromptPrefix] = None,
+    ) -> Tuple[str, str]:
+        """プロンプトを (講義ごとに共通の先頭部分, 質問ごとの後半部分) に分けて組み立てる"""
         if not query.strip():
             raise ValueError("質問内容を入力してください。")
 
-        # デフォルトのシステムプロンプト
-        default_system_prompt = "あなたは大学の講義に関する質問に答えるアシスタントです。提供された参考資料に基づいて、正確かつ簡潔に回答してください。資料に情報がない場合は、その旨を伝えてください。"
-        
-        final_system_prompt = system_prompt_override or default_system_prompt
+        if prefix is not None:
+            prefix_text, prefix_document_keys = prefix.text, prefix.document_keys
+        else:
+            prefix_text, prefix_document_keys = render_prompt_prefix(system_prompt_override or DEFAULT_SYSTEM_PROMPT, []), frozenset()
+
+        suffix = self._create_prompt_suffix(query, context_docs, history, prefix_document_keys)
+        metrics.observe("chat_prompt_tokens", estimate_tokens(prefix_text) + estimate_tokens(suffix))
+        metrics.observe("chat_prompt_prefix_tokens", estimate_tokens(prefix_text))
+        return prefix_text, suffix
 
-        prompt = self._create_prompt_string(query, context_docs, final_system_prompt)
-        
+    def _create_context_cache(self, prefix: PromptPrefix):
+        """プロンプト先頭部分をシステム指示とするコンテキストキャッシュを作成する (バックグラウンドで実行)"""
+        cache = None
         try:
-            response = self.model.generate_content(prompt)
+            cache = caching.CachedContent.create(
+                model=self.model_name,
+                display_name=f"openrag-{prefix.key[:16]}",
+                system_instruction=prefix.text,
+                ttl=timedelta(seconds=self.context_cache_ttl_seconds),
+            )
+            model = genai.GenerativeModel.from_cached_content(cached_content=cache)
+            # 期限切れ直前のキャッシュを使わないよう、少し早めに失効させる
+            expires_at = time.monotonic() + self.context_cache_ttl_seconds * 0.9
+            metrics.inc("gemini_context_cache_created_total")
+            logger.info(f"Created Gemini context cache for prompt prefix {prefix.key[:16]} ({prefix.tokens} tokens)")
+        except Exception as e:
+            # 失敗した場合は、保持期間が過ぎるまで作成を試みない
+            self._delete_cached_content(cache)
+            cache, model, expires_at = None, None, time.monotonic() + self.context_cache_ttl_seconds
+            metrics.inc("gemini_context_cache_errors_total")
+            logger.warning(f"Failed to create Gemini context cache, sending full prompts instead: {e}")
+        with self._context_cache_lock:
+            self._context_cache_creating.discard(prefix.key)
+            now = time.monotonic()
+            stale = [k for k, (_, _, expiry) in self._context_caches.items() if expiry <= now or k == prefix.key]
+            discarded = [self._context_caches.pop(k)[1] for k in stale]
+            self._context_caches[prefix.key] = (model, cache, expires_at)
+        for old_cache in discarded:
+            self._delete_cached_content(old_cache)
+
+    def _cached_model(self, prefix: PromptPrefix):
+        """先頭部分のコンテキストキャッシュを使うモデルを返す。まだ無い場合は作成を開始して None を返す"""
+        if self.context_cache_min_tokens <= 0 or prefix.tokens < self.context_cache_min_tokens:
+            return None
+        with self._context_cache_lock:
+            entry = self._context_caches.get(prefix.key)
+            if entry is not None and entry[2] > time.monotonic():
+                return entry[0]
+            if prefix.key in self._context_cache_creating:
+                return None
+            self._context_cache_creating.add(prefix.key)
+        threading.Thread(target=self._create_context_cache, args=(prefix,), daemon=True).start()
+        return None
+
+    def _drop_context_cache(self, prefix: PromptPrefix):
+        with self._context_cache_lock:
+            entry = self._context_caches.pop(prefix.key, None)
+        if entry is not None:
+            self._delete_cached_content(entry[1])
+
+    @staticmethod
+    def _delete_cached_content(cache):
+        """使わなくなった CachedContent をサーバーから削除する (保持期間分の課金を止めるため)。失敗は無視する"""
+        if cache is None:
+            return
+
+        def delete():
+            try:
+                cache.delete()
+            except Exception as e:
+                logger.debug(f"Failed to delete Gemini context cache: {e}")
+
+        threading.Thread(target=delete, daemon=True).start()
+
+    def _generate(self, prefix_text: str, suffix: str, prefix: Optional[PromptPrefix], stream: bool = False) -> Tuple[Any, bool]:
+        """(レスポンス, コンテキストキャッシュを使ったか) を返す"""
+        model = self._cached_model(prefix) if prefix is not None else None
+        if model is not None:
+            try:
+                response = model.generate_content(suffix, stream=True) if stream else model.generate_content(suffix)
+                metrics.inc("gemini_context_cache_requests_total")
+                return response, True
+            except Exception as e:
+                # キャッシュがサーバー側で失効していた場合などは、全文を送り直す
+                logger.warning(f"Generation with context cache failed, retrying without it: {e}")
+                self._drop_context_cache(prefix)
+        prompt = prefix_text + suffix
+        response = self.model.generate_content(prompt, stream=True) if stream else self.model.generate_content(prompt)
+        return response, False
+
+    @staticmethod
+    def _iter_text(response) -> Iterator[str]:
+        for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+
+    def generate_response(
+        self,
+        query: str,
+        context_docs: Optional[List[Document]],
+        system_prompt_override: Optional[str] = None,
+        history: Optional[str] = None,
+        prefix: Optional[PromptPrefix] = None,
+    ) -> str:
+        """prefix を渡した場合、システムプロンプトは prefix に含まれるものが使われる"""
+        prefix_text, suffix = self._build_prompt(query, context_docs, system_prompt_override, history, prefix)
+
+        try:
+            response, _ = self._generate(prefix_text, suffix, prefix)
             # レスポンスがブロックされた場合の簡易的なハンドリング
             if not response.parts and response.prompt_feedback.block_reason:
                 reason = response.prompt_feedback.block_reason.name
@@ -62,4 +219,78 @@ class GeminiChat:
             return response.text.strip()
         except Exception as e:
             logger.error(f"Error during Gemini API call: {e}", exc_info=True)
-            raise e
\ No newline at end of file
+            raise e
+
+    def generate_response_stream(
+        self,
+        query: str,
+        context_docs: Optional[List[Document]],
+        system_prompt_override: Optional[str] = None,
+        history: Optional[str] = None,
+        prefix: Optional[PromptPrefix] = None,
+    ) -> Iterator[str]:
+        """回答を生成されたそばから断片ごとに返す"""
+        prefix_text, suffix = self._build_prompt(query, context_docs, system_prompt_override, history, prefix)
+
+        try:
+            response, cached = self._generate(prefix_text, suffix, prefix, stream=True)
+            yielded = False
+            try:
+                for text in self._iter_text(response):
+                    yielded = True
+                    yield text
+            except Exception as e:
+                # キャッシュの失効は、ストリームの読み出し中に初めて分かることもある。
+                # まだ何も返していなければ、キャッシュを使わずに全文で生成し直す
+                if not cached or yielded:
+                    raise
+                logger.warning(f"Streaming with context cache failed before the first chunk, retrying without it: {e}")
+                self._drop_context_cache(prefix)
+                response, _ = self._generate(prefix_text, suffix, None, stream=True)
+                yield from self._iter_text(response)
+            if response.prompt_feedback and response.prompt_feedback.block_reason:
+                reason = response.prompt_feedback.block_reason.name
+                raise RuntimeError(f"回答生成がブロックされました。理由: {reason}")
+        except Exception as e:
+            logger.error(f"Error during Gemini streaming API call: {e}", exc_info=True)
+            raise e
+
+    def rewrite_query(self, query: str, history: str) -> str:
+        """会話の流れに依存した質問を、それ単体で検索に使える質問に書き換える"""
+        prompt = f"""以下の会話の続きとして、ユーザーが新しい質問をしました。
+会話の文脈を補って、この質問だけで意味が通じる検索用の質問文に書き換えてください。
+書き換え後の質問文のみを1行で出力してください。
+
+【これまでの会話】
+{history}
+
+【新しい質問】
+{query}
+
+【書き換え後の質問】
+"""
+        try:
+            response = self.model.generate_content(prompt)
+            rewritten = response.text.strip().splitlines()[0].strip() if response.parts else ""
+        except Exception as e:
+            logger.warning(f"Query rewriting failed, using the original query: {e}")
+            return query
+        return rewritten or query
+
+    def summarize_history(self, previous_summary: str, turns: List[Turn], max_tokens: int) -> str:
+        """これまでの要約に古い会話ターンを畳み込んだ、新しい要約を作成する"""
+        conversation = "\n".join(turn.render() for turn in turns)
+        prompt = f"""以下は、ユーザーとアシスタントの会話の要約と、その続きの会話です。
+後続の質問に答えるために必要な事実・話題・ユーザーの関心を残し、全体を{max_tokens}文字以内の日本語の要約にまとめてください。
+要約のみを出力してください。
+
+【これまでの要約】
+{previous_summary or "なし"}
+
+【続きの会話】
+{conversation}
+
+【新しい要約】
+"""
+        response = self.model.generate_content(prompt)
+        return response.text.strip() if response.parts else ""
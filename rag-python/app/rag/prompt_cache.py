@@ -0,0 +1,146 @@
+# rag-python/app/rag/prompt_cache.py
+
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Tuple
+
+from langchain.docstore.document import Document
+
+from core.metrics import metrics
+from rag.conversation import estimate_tokens
+
+
+def document_key(doc: Document) -> str:
+    """検索結果のチャンクを識別するキー (検索結果にはIDが含まれないため、出典と本文から作る)"""
+    source = doc.metadata.get("source", "")
+    return hashlib.sha1(f"{source}\0{doc.page_content}".encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """
+    講義ごとに共通の、プロンプト先頭部分 (システムプロンプト + よく参照される資料)。
+    同じ内容の間は key と text が変わらないため、LLM側のコンテキストキャッシュにそのまま使える。
+    """
+    key: str
+    text: str
+    document_keys: FrozenSet[str]
+    tokens: int
+
+
+@dataclass
+class _CollectionUsage:
+    hits: Counter = field(default_factory=Counter)
+    documents: Dict[str, Document] = field(default_factory=dict)
+    hot: List[Document] = field(default_factory=list)
+    hot_keys: FrozenSet[str] = frozenset()
+    hot_computed_at: float = 0.0
+
+
+class PromptPrefixCache:
+    """
+    コレクションごとに検索結果の出現回数を数え、よく参照されるチャンクをプロンプトの先頭部分に固定する。
+    先頭部分は refresh_seconds ごとにしか入れ替えないため、その間はプロンプトの先頭が一定に保たれる
+    (入れ替えのたびに出現回数を半減し、最近よく参照されるチャンクが選ばれるようにする)。
+    ただし先頭部分に空きがある間は、条件を満たしたチャンクをその都度追加する。
+    描画済みの先頭部分は (システムプロンプト, チャンク) の組をキーとするLRUに保持する。
+    """
+
+    def __init__(
+        self,
+        render: Callable[[str, List[Document]], str],
+        max_documents: int,
+        min_hits: int,
+        refresh_seconds: float,
+        max_collections: int = 1000,
+        max_prefixes: int = 256,
+    ):
+        self._render = render
+        self._max_documents = max_documents
+        self._min_hits = min_hits
+        self._refresh_seconds = refresh_seconds
+        self._max_collections = max_collections
+        self._max_prefixes = max_prefixes
+        # 出現回数を保持するチャンク数の上限 (少ないものから捨てる)
+        self._max_tracked = max(32, max_documents * 8)
+        self._usage: "OrderedDict[str, _CollectionUsage]" = OrderedDict()
+        self._prefixes: "OrderedDict[str, PromptPrefix]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_usage(self, collection_name: str) -> _CollectionUsage:
+        usage = self._usage.get(collection_name)
+        if usage is None:
+            usage = self._usage[collection_name] = _CollectionUsage(hot_computed_at=time.monotonic())
+            while len(self._usage) > self._max_collections:
+                self._usage.popitem(last=False)
+        self._usage.move_to_end(collection_name)
+        return usage
+
+    def record_retrieval(self, collection_name: str, documents: List[Document]):
+        if self._max_documents <= 0 or not documents:
+            return
+        with self._lock:
+            usage = self._get_usage(collection_name)
+            for doc in documents:
+                key = document_key(doc)
+                usage.hits[key] += 1
+                usage.documents.setdefault(key, doc)
+            if len(usage.hits) > self._max_tracked:
+                for key, _ in usage.hits.most_common()[self._max_tracked:]:
+                    del usage.hits[key]
+                    if key not in usage.hot_keys:
+                        usage.documents.pop(key, None)
+
+    def _ranked(self, usage: _CollectionUsage, exclude: FrozenSet[str] = frozenset()) -> List[str]:
+        return sorted(
+            (key for key, hits in usage.hits.items() if hits >= self._min_hits and key not in exclude),
+            key=lambda key: (-usage.hits[key], key),
+        )
+
+    def _hot_documents(self, usage: _CollectionUsage) -> List[Document]:
+        now = time.monotonic()
+        if now - usage.hot_computed_at < self._refresh_seconds:
+            # 先頭部分に空きがある間は、既存のチャンクの並びを変えずに末尾へ追加する
+            free = self._max_documents - len(usage.hot)
+            if free > 0:
+                added = self._ranked(usage, exclude=usage.hot_keys)[:free]
+                if added:
+                    usage.hot = usage.hot + [usage.documents[key] for key in added]
+                    usage.hot_keys = usage.hot_keys | frozenset(added)
+            return usage.hot
+
+        ranked = self._ranked(usage)[: self._max_documents]
+        usage.hot = [usage.documents[key] for key in ranked]
+        usage.hot_keys = frozenset(ranked)
+        usage.hot_computed_at = now
+        for key in list(usage.hits):
+            usage.hits[key] //= 2
+            if usage.hits[key] == 0:
+                del usage.hits[key]
+        for key in list(usage.documents):
+            if key not in usage.hits and key not in usage.hot_keys:
+                del usage.documents[key]
+        return usage.hot
+
+    def get_prefix(self, collection_name: str, system_prompt: str) -> PromptPrefix:
+        with self._lock:
+            documents = self._hot_documents(self._get_usage(collection_name)) if self._max_documents > 0 else []
+            keys: Tuple[str, ...] = tuple(document_key(doc) for doc in documents)
+            prefix_key = hashlib.sha256("\0".join((system_prompt,) + keys).encode("utf-8")).hexdigest()
+            prefix = self._prefixes.get(prefix_key)
+            if prefix is not None:
+                self._prefixes.move_to_end(prefix_key)
+                metrics.inc("prompt_prefix_cache_hits_total")
+                return prefix
+
+        metrics.inc("prompt_prefix_cache_misses_total")
+        text = self._render(system_prompt, documents)
+        prefix = PromptPrefix(key=prefix_key, text=text, document_keys=frozenset(keys), tokens=estimate_tokens(text))
+        with self._lock:
+            self._prefixes[prefix_key] = prefix
+            while len(self._prefixes) > self._max_prefixes:
+                self._prefixes.popitem(last=False)
+        return prefix
@@ -0,0 +1,90 @@
+# rag-python/app/rag/retrieval_cache.py
+
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from core.metrics import metrics
+
+
+def normalize_query(query: str) -> str:
+    """全角・半角や空白の違いだけの質問が同じキーになるよう正規化する"""
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+def filters_key(where: Optional[Dict[str, Any]]) -> Optional[str]:
+    """メタデータの絞り込み条件を、キーの順序に依存しない文字列にする"""
+    if not where:
+        return None
+    return json.dumps(where, sort_keys=True, ensure_ascii=False, default=str)
+
+
+@dataclass(frozen=True)
+class RetrievalResult:
+    """検索結果のチャンクIDと距離 (本文とメタデータは保持せず、ヒット時にIDで取得する)"""
+    ids: Tuple[str, ...]
+    distances: Tuple[float, ...]
+
+
+class RetrievalCache:
+    """
+    検索結果のキャッシュ。
+    キーは (物理コレクション名, コレクションのバージョン, 正規化した質問, k, 絞り込み条件) で、
+    バージョンは書き込みのたびに変わるため、古い結果が返ることはない。
+    エントリ数で上限を設け、超えた場合は最も長く参照されていないエントリから捨てる。
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, RetrievalResult]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_entries > 0
+
+    @staticmethod
+    def make_key(name: str, version: Hashable, query: str, k: int, where: Optional[Dict[str, Any]] = None) -> Tuple:
+        return (name, version, normalize_query(query), k, filters_key(where))
+
+    def get(self, key: Tuple) -> Optional[RetrievalResult]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+        metrics.inc("retrieval_cache_hits_total" if result is not None else "retrieval_cache_misses_total")
+        return result
+
+    def put(self, key: Tuple, result: RetrievalResult):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name: str):
+        """コレクションへの書き込み後に呼び、古いバージョンのエントリを即座に解放する"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == name]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,286 @@
+# rag-python/app/rag/upload_stream.py
+
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import multipart
+from fastapi import Request
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# 形式の判定に使うファイル先頭のバイト数 (PDFのヘッダーを探す範囲に合わせる)
+SNIFF_BYTES = 1024
+# multipartの境界やパートのヘッダーの分として、ファイルサイズの上限に加えて許容するリクエスト本文の大きさ
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# 拡張子ごとのマジックバイト (DOCXはZIPコンテナ)
+MAGIC_BYTES = {
+    ".pdf": b"%PDF-",
+    ".docx": b"PK\x03\x04",
+}
+# 先頭以外にあってもよい形式。PDFのリーダー (とPDFの解析に使うライブラリ) は、
+# ヘッダーの前に余分なバイト列があっても先頭1024バイト以内にあれば受け付ける
+MAGIC_SEARCH_BYTES = {".pdf": 1024}
+
+
+class UploadRejected(ValueError):
+    """アップロード内容が受け付けられないことを表す例外"""
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(detail)
+
+
+def sniff_content(head: bytes, file_ext: str) -> bool:
+    """ファイル先頭のバイト列が拡張子と一致する形式かを判定する"""
+    if file_ext in MAGIC_BYTES:
+        if file_ext in MAGIC_SEARCH_BYTES:
+            return MAGIC_BYTES[file_ext] in head[:MAGIC_SEARCH_BYTES[file_ext]]
+        return head.startswith(MAGIC_BYTES[file_ext])
+    if file_ext == ".txt":
+        if b"\x00" in head:
+            return False
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # 読み取り境界で分断されたマルチバイト文字は許容する
+            return e.start >= len(head) - 3 and e.reason == "unexpected end of data"
+        return True
+    return False
+
+
+@dataclass
+class StreamedUpload:
+    """
+    ストリーミング受信したアップロード。
+    サイズが閾値以下なら本体を `content` としてメモリ上に保持し、
+    それを超える場合は一時ファイル (`spool_path`) に書き出してある。
+    """
+    filename: str
+    size: int
+    sha256: str
+    content: Optional[bytes]
+    spool_path: Optional[str]
+
+    def commit(self, file_path: str):
+        """
+        受信した内容を最終的な保存先へ配置する (1回の書き込みまたはrenameのみ)。
+        同名のファイルへの同時アップロードが混ざらないよう、常に一時ファイルからのrenameで置き換える
+        """
+        if not self.spool_path:
+            spool, self.spool_path = _open_spool(os.path.dirname(file_path))
+            with spool:
+                spool.write(self.content)
+        os.replace(self.spool_path, file_path)
+        self.spool_path = None
+
+    def discard(self):
+        if self.spool_path and os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+        self.spool_path = None
+
+
+def _open_spool(directory: str):
+    """アップロードごとに一意な一時ファイルを作成し、(ファイル, パス) を返す"""
+    fd, path = tempfile.mkstemp(suffix=".part", dir=directory)
+    return os.fdopen(fd, "wb"), path
+
+
+def check_content_length(request: Request, max_bytes: int):
+    """本文を読む前に、Content-Length が上限を超えるリクエストを拒否する"""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise UploadRejected(413, f"ファイルサイズが上限 ({max_bytes} bytes) を超えています。")
+
+
+class _UploadSink:
+    """ファイル本体を受け取り、マジックバイトの検査・SHA-256の計算・閾値を超えた分の一時ファイルへの書き出しを行う"""
+
+    def __init__(self, filename: str, file_ext: str, spool_dir: str, memory_threshold: int):
+        self.filename = filename
+        self.file_ext = file_ext
+        self.spool_dir = spool_dir
+        self.spool_path: Optional[str] = None
+        self.memory_threshold = memory_threshold
+        self.digest = hashlib.sha256()
+        self.head = bytearray()
+        self.sniffed = False
+        self.buffer = bytearray()
+        self.spool = None
+        self.size = 0
+
+    def _sniff(self):
+        self.sniffed = True
+        if not sniff_content(bytes(self.head[:SNIFF_BYTES]), self.file_ext):
+            raise UploadRejected(400, f"ファイルの内容が形式 ({self.file_ext}) と一致しません。")
+
+    async def write(self, data: bytes):
+        if not self.sniffed:
+            self.head.extend(data[:SNIFF_BYTES - len(self.head)])
+            if len(self.head) >= SNIFF_BYTES:
+                self._sniff()
+        self.size += len(data)
+        self.digest.update(data)
+
+        if self.spool is None and self.size > self.memory_threshold:
+            # 閾値を超えた時点で、それまでの内容ごと一時ファイルへ切り替える
+            self.spool, self.spool_path = await run_in_threadpool(_open_spool, self.spool_dir)
+            await run_in_threadpool(self.spool.write, bytes(self.buffer))
+            self.buffer = bytearray()
+        if self.spool is not None:
+            await run_in_threadpool(self.spool.write, data)
+        else:
+            self.buffer.extend(data)
+
+    def finish(self) -> StreamedUpload:
+        if self.size == 0:
+            raise UploadRejected(400, "ファイルが空です。")
+        if not self.sniffed:
+            self._sniff()
+        sha256 = self.digest.hexdigest()
+        if self.spool is not None:
+            self.spool.close()
+            return StreamedUpload(filename=self.filename, size=self.size, sha256=sha256, content=None, spool_path=self.spool_path)
+        return StreamedUpload(filename=self.filename, size=self.size, sha256=sha256, content=bytes(self.buffer), spool_path=None)
+
+    def abort(self):
+        if self.spool is not None:
+            self.spool.close()
+            os.remove(self.spool_path)
+            self.spool = None
+
+
+class _FileFieldParser:
+    """
+    multipartのパーサーのコールバックを受け、指定したフィールドの最初のファイルに関するイベントだけを積む。
+    コールバックは同期的に呼ばれるため、ファイルの書き込みはイベントを取り出した側で行う。
+    """
+
+    def __init__(self, field_name: str):
+        self.field_name = field_name
+        self.events: List[Tuple[str, bytes]] = []
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._disposition = b""
+        self._in_target = False
+        self._found = False
+
+    def on_part_begin(self):
+        self._disposition = b""
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field.extend(data[start:end])
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value.extend(data[start:end])
+
+    def on_header_end(self):
+        if bytes(self._header_field).lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        self._in_target = not self._found and name == self.field_name and filename is not None
+        if self._in_target:
+            self._found = True
+            self.events.append(("start", filename))
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_target:
+            self.events.append(("data", data[start:end]))
+
+    def on_part_end(self):
+        if self._in_target:
+            self._in_target = False
+            self.events.append(("end", b""))
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+
+async def receive_upload(
+    request: Request,
+    field_name: str,
+    prepare: Callable[[str], str],
+    spool_dir: str,
+    max_bytes: int,
+    memory_threshold: int,
+) -> StreamedUpload:
+    """
+    multipart/form-data の本文を request.stream() から直接読み、指定したフィールドのファイルについて
+    マジックバイトの検査・SHA-256の計算・閾値を超えた分の一時ファイルへの書き出しを受信と同時に行う
+    (Starletteのフォーム解析のように、本文全体を一時ファイルへ書き出してからハンドラーに渡すことはしない)。
+    prepare はファイル名を受け取って拡張子を返し、受け付けない場合は UploadRejected を送出する。
+    閾値を超えた分は spool_dir に作成する一時ファイル (アップロードごとに一意) に書き出す。
+    不正なファイルやサイズ超過は本文を読み切る前に拒否する。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadRejected(400, "multipart/form-data 形式で送信してください。")
+
+    fields = _FileFieldParser(field_name)
+    parser = multipart.MultipartParser(boundary, fields.callbacks())
+    # Content-Length のない (chunked の) 本文もあるため、受信した本文の大きさで上限を検査する
+    limit = max_bytes + MULTIPART_OVERHEAD_BYTES
+    received = 0
+    sink: Optional[_UploadSink] = None
+    upload: Optional[StreamedUpload] = None
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise UploadRejected(413, f"ファイルサイズが上限 ({max_bytes} bytes) を超えています。")
+            parser.write(chunk)
+            for kind, data in fields.events:
+                if kind == "start":
+                    filename = data.decode("utf-8", errors="replace")
+                    file_ext = prepare(filename)
+                    sink = _UploadSink(filename, file_ext, spool_dir, memory_threshold)
+                elif kind == "data":
+                    await sink.write(data)
+                else:
+                    upload, sink = sink.finish(), None
+            fields.events.clear()
+            if upload is not None:
+                # 対象のファイルを受信し終えた後の本文 (他のフィールド) は読まない
+                break
+        else:
+            parser.finalize()
+    except MultipartParseError as e:
+        if sink is not None:
+            sink.abort()
+        raise UploadRejected(400, f"multipartの本文を解析できません: {e}")
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+
+    if upload is None:
+        if sink is not None:
+            sink.abort()
+            raise UploadRejected(400, "ファイルの受信が途中で終了しました。")
+        raise UploadRejected(400, "ファイルがありません。")
+    return upload
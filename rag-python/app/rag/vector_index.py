@@ -0,0 +1,235 @@
+# rag-python/app/rag/vector_index.py
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IndexConfig:
+    """コレクション作成時に指定するHNSWインデックスのパラメータ"""
+    space: str = "cosine"
+    M: int = 16
+    construction_ef: int = 100
+    search_ef: int = 10
+
+    def to_metadata(self) -> Dict[str, Any]:
+        return {
+            "hnsw:space": self.space,
+            "hnsw:M": self.M,
+            "hnsw:construction_ef": self.construction_ef,
+            "hnsw:search_ef": self.search_ef,
+        }
+
+
+def build_index_configs(settings) -> Dict[str, IndexConfig]:
+    """コレクション名のプレフィックスごとのインデックス設定を組み立てる"""
+    return {
+        # 講義コレクションは大きくなるため、グラフの次数と探索幅を広げて再現率を確保する
+        "lecture_": IndexConfig(
+            space=settings.VECTOR_INDEX_SPACE,
+            M=settings.LECTURE_HNSW_M,
+            construction_ef=settings.LECTURE_HNSW_CONSTRUCTION_EF,
+            search_ef=settings.LECTURE_HNSW_SEARCH_EF,
+        ),
+        # ゲストコレクションは小規模なため、通常は総当たり検索で処理される
+        "guest_": IndexConfig(space=settings.VECTOR_INDEX_SPACE),
+    }
+
+
+def resolve_index_config(collection_name: str, configs: Dict[str, IndexConfig]) -> IndexConfig:
+    for prefix, config in configs.items():
+        if collection_name.startswith(prefix):
+            return config
+    return IndexConfig()
+
+
+def truncate_embeddings(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+    """
+    Matryoshka表現学習に対応したモデルのベクトルを先頭の dimensions 次元に切り詰め、正規化し直す。
+    dimensions が 0 またはモデルの次元以上の場合はそのまま返す
+    """
+    if not dimensions or dimensions >= embeddings.shape[-1]:
+        return embeddings
+    truncated = embeddings[..., :dimensions]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return np.ascontiguousarray(truncated / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def similarity_to_distance(similarities: np.ndarray, space: str) -> np.ndarray:
+    """
+    正規化済みベクトルの内積を、Chromaが返すのと同じ尺度の距離に変換する
+    (l2 は二乗距離、cosine/ip は 1 - 類似度)
+    """
+    if space == "l2":
+        return np.maximum(0.0, 2.0 - 2.0 * similarities)
+    return 1.0 - similarities
+
+
+# 総当たり検索用の行列の保持形式 (int8 は行ごとのスケールを併せて保持する)
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize_vectors(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """float32 行列を保持形式に変換し、(行列, 行ごとのスケール) を返す"""
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix, dtype=np.float32), None
+    if dtype == "float16":
+        return np.ascontiguousarray(matrix, dtype=np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1).astype(np.float32) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return np.ascontiguousarray(quantized), scales
+    raise ValueError(f"Unsupported vector dtype '{dtype}' (expected one of {VECTOR_DTYPES})")
+
+
+def quantized_similarities(matrix: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+    """
+    保持形式の行列とクエリ (float32) の内積。
+    float16/int8 は BLAS で直接計算できないため、一時的なメモリが行列全体の float32 分にならないよう
+    block_rows 行ずつ float32 に戻して計算する
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    similarities = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_rows):
+        similarities[start:start + block_rows] = matrix[start:start + block_rows].astype(np.float32) @ query
+    if scales is not None:
+        similarities *= scales
+    return similarities
+
+
+@dataclass
+class _ExactIndex:
+    version: Any
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    matrix: np.ndarray
+    scales: Optional[np.ndarray] = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+class ExactSearchCache:
+    """
+    小規模コレクション用の総当たり検索。
+    コレクションの全ベクトルを連続した行列として保持し、行列積1回で上位k件を求める。
+    dtype に float16/int8 を指定するとメモリを 1/2 ~ 1/4 に抑えられる。その場合は上位 k × rescore_factor 件を
+    Chromaが保持する float32 のベクトルで計算し直し (rescoring)、近似による順位の誤りを補正する。
+    保持する行列の合計バイト数で上限を設け、超えた場合は古いコレクションから破棄する
+    (float16/int8 では同じ上限でより多くのコレクションを保持できる)。
+    """
+
+    def __init__(self, max_total_bytes: int, dtype: str = "float32", rescore_factor: int = 1):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype '{dtype}' (expected one of {VECTOR_DTYPES})")
+        self._max_total_bytes = max_total_bytes
+        self._dtype = dtype
+        self._rescore_factor = rescore_factor
+        self._indexes: "OrderedDict[str, _ExactIndex]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, version: Any) -> Optional[_ExactIndex]:
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None or index.version != version:
+                return None
+            self._indexes.move_to_end(name)
+            return index
+
+    def _put(self, name: str, index: _ExactIndex):
+        with self._lock:
+            previous = self._indexes.pop(name, None)
+            if previous is not None:
+                self._total_bytes -= previous.nbytes
+            self._indexes[name] = index
+            self._total_bytes += index.nbytes
+            while self._total_bytes > self._max_total_bytes and len(self._indexes) > 1:
+                _, evicted = self._indexes.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+
+    def invalidate(self, name: str):
+        with self._lock:
+            previous = self._indexes.pop(name, None)
+            if previous is not None:
+                self._total_bytes -= previous.nbytes
+
+    def _load(self, name: str, collection, version: Any) -> _ExactIndex:
+        index = self._get(name, version)
+        if index is not None:
+            return index
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        matrix, scales = quantize_vectors(
+            np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1), self._dtype
+        )
+        index = _ExactIndex(
+            version=version,
+            ids=data["ids"],
+            documents=data["documents"],
+            metadatas=data["metadatas"],
+            matrix=matrix,
+            scales=scales,
+        )
+        self._put(name, index)
+        logger.info(f"Loaded {len(index.ids)} vectors of '{name}' for exact search ({self._dtype}, {matrix.nbytes} bytes).")
+        return index
+
+    @staticmethod
+    def _rescore(collection, index: _ExactIndex, candidates: np.ndarray, similarities: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """候補の類似度を、Chromaから取得した float32 のベクトルで計算し直す"""
+        data = collection.get(ids=[index.ids[i] for i in candidates], include=["embeddings"])
+        rows = {chunk_id: row for row, chunk_id in enumerate(data["ids"])}
+        exact = np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1) @ query
+        # 他プロセスで削除された候補は、近似の類似度のまま扱う
+        return np.array(
+            [exact[rows[index.ids[i]]] if index.ids[i] in rows else similarities[i] for i in candidates],
+            dtype=np.float32,
+        )
+
+    def query(self, name: str, collection, version: Any, query_embedding: np.ndarray, k: int, space: str) -> Dict[str, List[List[Any]]]:
+        """`collection.query` と同じ形式で結果を返す"""
+        index = self._load(name, collection, version)
+        if not index.ids or k <= 0:
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarities = quantized_similarities(index.matrix, index.scales, query)
+        k = min(k, len(index.ids))
+        if index.matrix.dtype != np.float32 and self._rescore_factor > 1:
+            candidates = min(len(index.ids), k * self._rescore_factor)
+            top = np.argpartition(-similarities, candidates - 1)[:candidates]
+            scores = self._rescore(collection, index, top, similarities, query)
+            order = np.argsort(-scores)[:k]
+            top, scores = top[order], scores[order]
+        else:
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            scores = similarities[top]
+        distances = similarity_to_distance(scores, space)
+        return {
+            "ids": [[index.ids[i] for i in top]],
+            "documents": [[index.documents[i] for i in top]],
+            "metadatas": [[dict(index.metadatas[i] or {}) for i in top]],
+            "distances": [distances.tolist()],
+        }
+
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """複数クエリの厳密な上位k件 (インデックス, 類似度) を返す。ベンチマークの正解データにも用いる"""
+    similarities = queries @ matrix.T
+    k = min(k, matrix.shape[0])
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return top, np.take_along_axis(similarities, top, axis=1)
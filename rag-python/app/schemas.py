@@ -3,4 +3,6 @@ from pydantic import BaseModel
 
 class ChatRequest(BaseModel):
     query: str
-    system_prompt: str | None = None
\ No newline at end of file
+    system_prompt: str | None = None
+    # 会話を継続する場合は、前回の応答で返されたsession_idを指定する
+    session_id: str | None = None
\ No newline at end of file
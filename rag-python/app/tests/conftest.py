@@ -0,0 +1,10 @@
+# rag-python/app/tests/conftest.py
+
+import os
+import sys
+
+# core.config の必須項目 (テストでは外部サービスに接続しない)
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("JWT_SECRET_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,71 @@
+# rag-python/app/tests/test_reindex.py
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import chromadb
+import numpy as np
+import pytest
+
+from core.config import settings
+from rag.collection_aliases import CollectionAliases
+from tools import reindex
+
+
+def fake_embed_batch(texts, batch_size):
+    return np.array([[b / 255.0 for b in hashlib.sha256(text.encode("utf-8")).digest()[:4]] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def chroma_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_DB_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL_NAME", "model-a")
+    monkeypatch.setattr(settings, "EMBEDDING_DIMENSIONS", 0)
+    # モデルを読み込まず、ワーカープロセスも起動しない
+    monkeypatch.setattr(reindex, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(reindex, "_init_worker", lambda *args: None)
+    monkeypatch.setattr(reindex, "_embed_batch", fake_embed_batch)
+    return tmp_path
+
+
+def add_chunks(collection, texts):
+    collection.add(
+        ids=[hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts],
+        embeddings=fake_embed_batch(texts, len(texts)).tolist(),
+        documents=texts,
+    )
+
+
+def run_reindex(chroma_dir, model, *extra):
+    reindex.main(["--model", model, "--workers", "1", "--checkpoint", str(chroma_dir / "checkpoint.json"), *extra])
+
+
+def test_second_upgrade_reads_the_current_shadow(chroma_dir, monkeypatch):
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+    add_chunks(client.create_collection("lecture_1"), ["first", "second", "third"])
+
+    run_reindex(chroma_dir, "model-b")
+    aliases = CollectionAliases(str(chroma_dir))
+    shadow_b = aliases.resolve("model-b", "lecture_1")
+    assert shadow_b == reindex.shadow_name("lecture_1", "model-b")
+    assert client.get_collection(shadow_b).count() == 3
+
+    # model-b に切り替えた後のアップロードは、シャドーコレクションにだけ追加される
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL_NAME", "model-b")
+    add_chunks(client.get_collection(shadow_b), ["fourth", "fifth"])
+
+    run_reindex(chroma_dir, "model-c")
+    shadow_c = aliases.resolve("model-c", "lecture_1")
+    assert shadow_c == reindex.shadow_name("lecture_1", "model-c")
+    documents = client.get_collection(shadow_c).get(include=["documents"])["documents"]
+    assert sorted(documents) == ["fifth", "first", "fourth", "second", "third"]
+    # 中間のシャドーコレクションを別の論理コレクションとして扱わない
+    assert set(json.loads((chroma_dir / "collection_aliases.json").read_text())["models"]["model-c"]) == {"lecture_1"}
+    assert not (chroma_dir / "checkpoint.json").exists()
+
+
+def test_switch_without_matching_collections(chroma_dir):
+    # チェックポイントが一度も書き込まれなくても失敗しない
+    run_reindex(chroma_dir, "model-b", "--collections", "lecture_404")
+    assert not (chroma_dir / "checkpoint.json").exists()
@@ -0,0 +1,421 @@
+# rag-python/app/tools/evaluate_retrieval.py
+"""
+検索設定 (Embeddingモデル、チャンク分割、k、インデックス設定) ごとの検索品質とレイテンシを比較する。
+
+評価データは1行1問のJSONLで、正解はチャンクではなく資料中の文字列で指定する
+(チャンク分割の設定を変えても同じデータで評価できるようにするため)。
+
+    {"question": "...", "relevant": [{"source": "week1.pdf", "text": "資料中の該当箇所"}]}
+
+取得したチャンクが同じ資料から取られ、正解文字列 (の中央部分) を含んでいれば正解とみなす。
+各設定について一時ディレクトリにコレクションを作成し、recall@k、MRR、nDCG@k、
+検索レイテンシ (p50/p99)、Embedding時間、インデックスサイズを JSON と Markdown で出力する。
+
+    cd rag-python/app
+    # アップロード済み資料から評価データを作成 (--question-mode gemini で質問文をLLMに作らせる)
+    python -m tools.evaluate_retrieval synthesize --documents static/uploads/*.pdf --output eval.jsonl
+    # 設定を並べて評価
+    python -m tools.evaluate_retrieval run --dataset eval.jsonl --documents static/uploads/*.pdf \\
+        --configs configs.json --min-recall 0.8 --output report
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.config import settings
+from rag.chunking import ChunkPolicy
+from rag.document_processor import load_document, process_documents
+from rag.vector_index import IndexConfig
+
+logger = logging.getLogger("evaluate_retrieval")
+
+# 正解判定に使う正解文字列の最大長 (チャンク境界をまたいでも判定できるよう、中央部分だけを使う)
+MATCH_WINDOW_CHARS = 60
+
+
+@dataclass
+class RetrievalConfig:
+    """比較する検索設定。configs.json にはこのフィールドを持つオブジェクトのリストを書く"""
+    name: str
+    model: str = settings.EMBEDDING_MODEL_NAME
+    k: int = 3
+    chunk_size: int = settings.LECTURE_CHUNK_SIZE
+    chunk_overlap: int = settings.LECTURE_CHUNK_OVERLAP
+    space: str = settings.VECTOR_INDEX_SPACE
+    M: int = settings.LECTURE_HNSW_M
+    construction_ef: int = settings.LECTURE_HNSW_CONSTRUCTION_EF
+    search_ef: int = settings.LECTURE_HNSW_SEARCH_EF
+    # True の場合は件数にかかわらず総当たり検索を使う
+    exact: bool = False
+    # ベクトルを切り詰める次元数 (0 で切り詰めない) と、総当たり検索用の行列の形式
+    dimensions: int = settings.EMBEDDING_DIMENSIONS
+    vector_dtype: str = "float32"
+    rescore_factor: int = settings.EXACT_SEARCH_RESCORE_FACTOR
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RetrievalConfig":
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown config fields: {sorted(unknown)}")
+        return cls(**data)
+
+
+DEFAULT_CONFIGS = [
+    RetrievalConfig(name="default"),
+    RetrievalConfig(name="k=5", k=5),
+    RetrievalConfig(name="small-chunks", chunk_size=400, chunk_overlap=40, k=5),
+    RetrievalConfig(name="exact", exact=True),
+    RetrievalConfig(name="exact-int8", exact=True, vector_dtype="int8"),
+]
+
+
+@dataclass
+class EvaluationResult:
+    config: RetrievalConfig
+    questions: int = 0
+    chunks: int = 0
+    recall_at_k: float = 0.0
+    mrr: float = 0.0
+    ndcg_at_k: float = 0.0
+    search_p50_ms: float = 0.0
+    search_p99_ms: float = 0.0
+    embedding_seconds: float = 0.0
+    indexing_seconds: float = 0.0
+    index_bytes: int = 0
+    meets_quality_bar: Optional[bool] = None
+    recommended: bool = False
+    per_question: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self, include_questions: bool = False) -> Dict[str, Any]:
+        data = asdict(self)
+        if not include_questions:
+            data.pop("per_question")
+        return data
+
+
+# --- 正解判定と指標 ---
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", "", text)
+
+
+def _match_key(text: str) -> str:
+    normalized = _normalize(text)
+    if len(normalized) <= MATCH_WINDOW_CHARS:
+        return normalized
+    start = (len(normalized) - MATCH_WINDOW_CHARS) // 2
+    return normalized[start:start + MATCH_WINDOW_CHARS]
+
+
+def _source_name(path: str) -> str:
+    return os.path.basename(path or "")
+
+
+def matched_targets(chunk_text: str, chunk_source: str, relevant: List[Dict[str, str]]) -> List[int]:
+    """チャンクが含んでいる正解のインデックスを返す"""
+    normalized = _normalize(chunk_text)
+    hits = []
+    for i, target in enumerate(relevant):
+        if target.get("source") and _source_name(target["source"]) != _source_name(chunk_source):
+            continue
+        if _match_key(target["text"]) in normalized:
+            hits.append(i)
+    return hits
+
+
+def score_ranking(ranked_hits: List[List[int]], n_relevant: int, k: int) -> Dict[str, float]:
+    """ranked_hits[i] は i 位のチャンクが含む正解のインデックス"""
+    found = set()
+    reciprocal_rank = 0.0
+    dcg = 0.0
+    for rank, hits in enumerate(ranked_hits[:k], start=1):
+        new_hits = set(hits) - found
+        if new_hits:
+            if not found:
+                reciprocal_rank = 1.0 / rank
+            dcg += 1.0 / np.log2(rank + 1)
+            found |= new_hits
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(n_relevant, k) + 1))
+    return {
+        "recall": len(found) / n_relevant if n_relevant else 0.0,
+        "reciprocal_rank": reciprocal_rank,
+        "ndcg": dcg / ideal if ideal else 0.0,
+    }
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+# --- 評価の実行 ---
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("question") or not item.get("relevant"):
+                raise ValueError(f"{path}:{line_no}: 'question' and 'relevant' are required")
+            items.append(item)
+    return items
+
+
+class TimedEmbeddingModel:
+    """Embeddingモデルの encode にかかった時間を積算するラッパー (ChromaManager に embedding_model として渡す)"""
+
+    def __init__(self, model):
+        self._model = model
+        self.seconds = 0.0
+
+    def encode(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._model.encode(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def __getattr__(self, name: str):
+        return getattr(self._model, name)
+
+
+def evaluate_config(config: RetrievalConfig, documents: List[str], dataset: List[Dict[str, Any]], models: Dict[str, Any]) -> EvaluationResult:
+    from rag.chroma_manager import ChromaManager
+    from rag.embeddings import load_embedding_model
+
+    if config.model not in models:
+        models[config.model] = load_embedding_model(config.model)
+
+    policy = ChunkPolicy(chunk_size=config.chunk_size, chunk_overlap=config.chunk_overlap)
+    index_config = IndexConfig(space=config.space, M=config.M, construction_ef=config.construction_ef, search_ef=config.search_ef)
+    collection_name = "evaluation"
+    persist_directory = tempfile.mkdtemp(prefix="rag_eval_")
+    # インデックス作成時間のうち、Embeddingにかかった時間を分けて計測する
+    model = TimedEmbeddingModel(models[config.model])
+    try:
+        manager = ChromaManager(
+            persist_directory=persist_directory,
+            embedding_model_name=config.model,
+            index_configs={"": index_config},
+            exact_search_max_vectors=2**31 if config.exact else 0,
+            embedding_model=model,
+            embedding_dimensions=config.dimensions,
+            exact_search_dtype=config.vector_dtype,
+            exact_search_rescore_factor=config.rescore_factor,
+        )
+        chunks = []
+        for path in documents:
+            file_chunks, _ = process_documents(path, os.path.basename(path), policy=policy)
+            chunks.extend(file_chunks)
+
+        started = time.perf_counter()
+        for start in range(0, len(chunks), 256):
+            manager.add_documents(chunks[start:start + 256], collection_name)
+        result = EvaluationResult(
+            config=config,
+            chunks=len(chunks),
+            embedding_seconds=model.seconds,
+            indexing_seconds=time.perf_counter() - started,
+        )
+
+        # 初回のみ発生するコスト (インデックス読み込みや総当たり用の行列作成) を計測から除く
+        manager.search(dataset[0]["question"], collection_name, k=config.k)
+
+        latencies: List[float] = []
+        totals = {"recall": 0.0, "reciprocal_rank": 0.0, "ndcg": 0.0}
+        for item in dataset:
+            started = time.perf_counter()
+            retrieved = manager.search(item["question"], collection_name, k=config.k)
+            latencies.append(time.perf_counter() - started)
+            ranked_hits = [matched_targets(doc.page_content, doc.metadata.get("source", ""), item["relevant"]) for doc in retrieved]
+            scores = score_ranking(ranked_hits, len(item["relevant"]), config.k)
+            for key in totals:
+                totals[key] += scores[key]
+            result.per_question.append({"question": item["question"], **scores})
+
+        n = len(dataset)
+        result.questions = n
+        result.recall_at_k = totals["recall"] / n
+        result.mrr = totals["reciprocal_rank"] / n
+        result.ndcg_at_k = totals["ndcg"] / n
+        result.search_p50_ms = percentile(latencies, 0.5) * 1e3
+        result.search_p99_ms = percentile(latencies, 0.99) * 1e3
+        result.index_bytes = directory_size(persist_directory)
+        return result
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+def select_recommended(results: List[EvaluationResult], min_recall: Optional[float], min_mrr: Optional[float]):
+    """品質基準を満たす設定のうち、検索レイテンシ (p50) が最も小さいものを推奨とする"""
+    if min_recall is None and min_mrr is None:
+        return
+    for result in results:
+        result.meets_quality_bar = (min_recall is None or result.recall_at_k >= min_recall) and (
+            min_mrr is None or result.mrr >= min_mrr
+        )
+    passing = [r for r in results if r.meets_quality_bar]
+    if passing:
+        min(passing, key=lambda r: r.search_p50_ms).recommended = True
+
+
+def render_markdown(results: List[EvaluationResult], dataset_path: str) -> str:
+    k_values = {r.config.k for r in results}
+    k_label = f"@{k_values.pop()}" if len(k_values) == 1 else "@k"
+    lines = [
+        "# Retrieval evaluation",
+        "",
+        f"- dataset: `{dataset_path}` ({results[0].questions if results else 0} questions)",
+        "",
+        f"| config | model | k | chunk | index | recall{k_label} | MRR | nDCG{k_label} | p50 ms | p99 ms | embed s | index MiB | |",
+        "|---|---|---:|---:|---|---:|---:|---:|---:|---:|---:|---:|---|",
+    ]
+    for r in results:
+        c = r.config
+        index = "exact" if c.exact else f"hnsw M={c.M} ef={c.search_ef}"
+        flag = "**recommended**" if r.recommended else ("below bar" if r.meets_quality_bar is False else "")
+        lines.append(
+            f"| {c.name} | {c.model} | {c.k} | {c.chunk_size}/{c.chunk_overlap} ({r.chunks}) | {index} | "
+            f"{r.recall_at_k:.3f} | {r.mrr:.3f} | {r.ndcg_at_k:.3f} | {r.search_p50_ms:.2f} | {r.search_p99_ms:.2f} | "
+            f"{r.embedding_seconds:.1f} | {r.index_bytes / 2**20:.1f} | {flag} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+# --- 評価データの作成 ---
+
+_SENTENCE_PATTERN = re.compile(r"[^。．！？!?\n]{30,200}[。．！？!?]")
+
+_QUESTION_PROMPT = """以下は講義資料の一節です。この一節を読めば答えられる質問を、学生が実際に尋ねそうな自然な日本語で1つだけ作成してください。
+資料中の表現をそのまま繰り返さず、質問文のみを出力してください。
+
+【資料】
+{passage}
+"""
+
+
+def synthesize(documents: List[str], per_document: int, question_mode: str, seed: int) -> List[Dict[str, Any]]:
+    """
+    資料からランダムに文を選び、その文を正解とする評価データを作る。
+    sentence モードは文そのものを質問とする (語彙の一致が大きく楽観的な値になるため、レイテンシ比較や回帰検知向け)。
+    gemini モードは文を含む前後の文脈から質問文を生成する。
+    """
+    rng = random.Random(seed)
+    chat = None
+    if question_mode == "gemini":
+        from rag.llm_gemini import GeminiChat
+        chat = GeminiChat(api_key=settings.GEMINI_API_KEY, model_name=settings.GEMINI_MODEL_NAME)
+
+    items = []
+    for path in documents:
+        text = "\n".join(doc.page_content for doc in load_document(path))
+        sentences = [m.group(0).strip() for m in _SENTENCE_PATTERN.finditer(text)]
+        for sentence in rng.sample(sentences, min(per_document, len(sentences))):
+            if chat is None:
+                question = sentence
+            else:
+                position = text.find(sentence)
+                passage = text[max(0, position - 200):position + len(sentence) + 200]
+                try:
+                    question = chat.model.generate_content(_QUESTION_PROMPT.format(passage=passage)).text.strip()
+                except Exception as e:
+                    logger.warning(f"Question generation failed, skipping: {e}")
+                    continue
+            items.append({"question": question, "relevant": [{"source": os.path.basename(path), "text": sentence}]})
+        logger.info(f"Synthesized {len(items)} questions so far ({os.path.basename(path)})")
+    return items
+
+
+# --- CLI ---
+
+def _load_configs(path: Optional[str]) -> List[RetrievalConfig]:
+    if not path:
+        return DEFAULT_CONFIGS
+    with open(path, encoding="utf-8") as f:
+        return [RetrievalConfig.from_dict(item) for item in json.load(f)]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    synth = subparsers.add_parser("synthesize", help="資料から評価データを作成する")
+    synth.add_argument("--documents", nargs="+", required=True)
+    synth.add_argument("--output", required=True)
+    synth.add_argument("--per-document", type=int, default=20)
+    synth.add_argument("--question-mode", choices=["sentence", "gemini"], default="sentence")
+    synth.add_argument("--seed", type=int, default=0)
+
+    run = subparsers.add_parser("run", help="設定ごとに評価してレポートを出力する")
+    run.add_argument("--dataset", required=True)
+    run.add_argument("--documents", nargs="+", required=True, help="インデックスを作成する資料")
+    run.add_argument("--configs", help="RetrievalConfig のリストを書いたJSON (省略時は組み込みの設定)")
+    run.add_argument("--min-recall", type=float, help="この recall@k を満たす設定のうち最速のものを推奨とする")
+    run.add_argument("--min-mrr", type=float)
+    run.add_argument("--output", default="retrieval_report", help="出力ファイル名 (拡張子なし。.json と .md を出力)")
+    run.add_argument("--per-question", action="store_true", help="JSONに質問ごとのスコアを含める")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "synthesize":
+        items = synthesize(args.documents, args.per_document, args.question_mode, args.seed)
+        with open(args.output, "w", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        logger.info(f"Wrote {len(items)} questions to {args.output}")
+        return
+
+    dataset = load_dataset(args.dataset)
+    if not dataset:
+        parser.error(f"{args.dataset} has no questions")
+    models: Dict[str, Any] = {}
+    results = []
+    for config in _load_configs(args.configs):
+        logger.info(f"Evaluating '{config.name}'")
+        result = evaluate_config(config, args.documents, dataset, models)
+        logger.info(
+            f"'{config.name}': recall@{config.k}={result.recall_at_k:.3f} mrr={result.mrr:.3f} "
+            f"p50={result.search_p50_ms:.2f}ms"
+        )
+        results.append(result)
+    select_recommended(results, args.min_recall, args.min_mrr)
+
+    report = {
+        "dataset": args.dataset,
+        "documents": [os.path.basename(p) for p in args.documents],
+        "min_recall": args.min_recall,
+        "min_mrr": args.min_mrr,
+        "results": [r.to_dict(include_questions=args.per_question) for r in results],
+    }
+    with open(f"{args.output}.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(f"{args.output}.md", "w", encoding="utf-8") as f:
+        f.write(render_markdown(results, args.dataset))
+    print(render_markdown(results, args.dataset))
+
+
+if __name__ == "__main__":
+    main()
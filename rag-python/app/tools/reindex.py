@@ -0,0 +1,321 @@
+# rag-python/app/tools/reindex.py
+"""
+Embeddingモデル (または切り詰める次元数) の変更時に、全コレクションを新しいモデルで再構築するオフラインのコマンド。
+
+現在のモデルが参照しているコレクションのチャンク (または UPLOAD_DIR のファイルを再解析したチャンク) を
+プロセスプールで大きなバッチ単位に再Embeddingし、モデルごとのシャドーコレクションに書き込む。
+全コレクションの書き込みが終わった時点で対応表 (collection_aliases.json) を一括で切り替えるため、
+新しいモデル名で起動した ChromaManager だけがシャドーコレクションを参照する (旧モデルのコレクションは残る)。
+チェックポイントから中断した位置で再開できる。
+
+    cd rag-python/app && python -m tools.reindex --model NEW_MODEL_NAME --workers 4
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import chromadb
+from chromadb.db.base import UniqueConstraintError
+
+from core.config import settings
+from rag.chunking import build_chunk_policies, resolve_chunk_policy
+from rag.collection_aliases import CollectionAliases, embedding_key
+from rag.document_processor import SUPPORTED_EXTENSIONS, process_documents
+from rag.vector_index import build_index_configs, resolve_index_config
+
+logger = logging.getLogger("reindex")
+
+# アップロードファイル名から論理コレクション名を復元する (main._handle_document_upload の命名規則)
+_UPLOAD_NAME_PATTERNS = [
+    (re.compile(r"^user_\d+_lecture_(\d+)_"), "lecture_{}"),
+    (re.compile(r"^guest_([0-9a-fA-F-]{36})_"), "guest_{}"),
+]
+
+
+# --- ワーカープロセス ---
+
+_worker_model = None
+_worker_dimensions = 0
+
+
+def _init_worker(model_name: str, threads: int, dimensions: int = 0):
+    """各ワーカーでモデルを1度だけ読み込む"""
+    global _worker_model, _worker_dimensions
+    import torch
+    from rag.embeddings import load_embedding_model
+
+    torch.set_num_threads(threads)
+    _worker_model = load_embedding_model(model_name)
+    _worker_dimensions = dimensions
+
+
+def _embed_batch(texts: List[str], batch_size: int):
+    from rag.embeddings import encode_passages
+
+    return encode_passages(_worker_model, texts, batch_size=batch_size, dimensions=_worker_dimensions)
+
+
+# --- 入力 (チャンクの読み出し) ---
+
+@dataclass
+class Batch:
+    offset: int
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Optional[dict]]
+
+
+def shadow_name(collection_name: str, model_name: str) -> str:
+    tag = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:8]
+    return f"{collection_name[:52]}__{tag}"
+
+
+def iter_chroma_batches(collection, start: int, batch_size: int) -> Iterator[Batch]:
+    offset = start
+    while True:
+        data = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        if not data["ids"]:
+            return
+        # メタデータの無いチャンクは None のまま渡す (Chromaは空のdictを受け付けない)
+        yield Batch(offset, data["ids"], data["documents"], [m or None for m in data["metadatas"]])
+        offset += len(data["ids"])
+
+
+def collect_upload_files(upload_dir: str) -> Dict[str, List[str]]:
+    """UPLOAD_DIR のファイルを論理コレクション名ごとにまとめる"""
+    grouped: Dict[str, List[str]] = defaultdict(list)
+    for filename in sorted(os.listdir(upload_dir)):
+        path = os.path.join(upload_dir, filename)
+        if not os.path.isfile(path) or os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+            continue
+        for pattern, template in _UPLOAD_NAME_PATTERNS:
+            match = pattern.match(filename)
+            if match:
+                grouped[template.format(match.group(1))].append(path)
+                break
+        else:
+            logger.warning(f"Skipping {filename}: cannot determine its collection")
+    return grouped
+
+
+def iter_upload_batches(collection_name: str, paths: List[str], start: int, batch_size: int) -> Iterator[Batch]:
+    """ファイルを再解析してチャンクを作り直す。IDは内容から決まるため再実行しても重複しない"""
+    policy = resolve_chunk_policy(collection_name, build_chunk_policies(settings))
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[dict] = []
+    for path in paths:
+        with open(path, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        chunks, _ = process_documents(path, os.path.basename(path), policy=policy)
+        for i, chunk in enumerate(chunks):
+            chunk.metadata["content_hash"] = content_hash
+            ids.append(hashlib.sha1(f"{content_hash}:{i}".encode()).hexdigest())
+            documents.append(chunk.page_content)
+            metadatas.append(chunk.metadata)
+    for offset in range(start, len(ids), batch_size):
+        yield Batch(offset, ids[offset:offset + batch_size], documents[offset:offset + batch_size], metadatas[offset:offset + batch_size])
+
+
+# --- チェックポイント ---
+
+class Checkpoint:
+    def __init__(self, path: str, model_name: str, source: str):
+        self.path = path
+        self.state = {"model": model_name, "source": source, "collections": {}}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("model") == model_name and saved.get("source") == source:
+                self.state = saved
+                logger.info(f"Resuming from checkpoint {path}")
+            else:
+                logger.warning(f"Ignoring checkpoint {path} written for a different model/source")
+
+    def entry(self, collection_name: str) -> dict:
+        return self.state["collections"].setdefault(collection_name, {"offset": 0, "done": False})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# --- 進捗表示 ---
+
+class Progress:
+    def __init__(self, total: int, done: int):
+        self.total = total
+        self.done = done
+        self.started = time.monotonic()
+        self.processed = 0
+
+    def advance(self, count: int, collection_name: str):
+        self.done += count
+        self.processed += count
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        if self.total and rate > 0:
+            eta = f"ETA {max(0, self.total - self.done) / rate / 60:.1f} min"
+        else:
+            eta = "ETA unknown"
+        logger.info(f"[{collection_name}] {self.done}/{self.total or '?'} chunks ({rate:.1f} chunks/s, {eta})")
+
+
+# --- 本体 ---
+
+def get_or_create_shadow(client, collection_name: str, model_name: str):
+    name = shadow_name(collection_name, model_name)
+    config = resolve_index_config(collection_name, build_index_configs(settings))
+    metadata = {**config.to_metadata(), "embedding_model": model_name, "reindexed_from": collection_name}
+    try:
+        return client.create_collection(name=name, metadata=metadata)
+    except UniqueConstraintError:
+        return client.get_collection(name=name)
+
+
+def reindex_collection(
+    client,
+    executor: ProcessPoolExecutor,
+    collection_name: str,
+    batches: Iterator[Batch],
+    model_name: str,
+    checkpoint: Checkpoint,
+    progress: Progress,
+    encode_batch_size: int,
+    max_in_flight: int,
+) -> str:
+    shadow = get_or_create_shadow(client, collection_name, model_name)
+    entry = checkpoint.entry(collection_name)
+    entry["shadow"] = shadow.name
+
+    # 複数バッチを並行してEmbeddingしつつ、書き込みとチェックポイントは先頭から順に行う
+    in_flight: deque = deque()
+
+    def drain_one():
+        batch, future = in_flight.popleft()
+        embeddings = future.result()
+        shadow.upsert(ids=batch.ids, embeddings=embeddings.tolist(), documents=batch.documents, metadatas=batch.metadatas)
+        entry["offset"] = batch.offset + len(batch.ids)
+        checkpoint.save()
+        progress.advance(len(batch.ids), collection_name)
+
+    for batch in batches:
+        in_flight.append((batch, executor.submit(_embed_batch, batch.documents, encode_batch_size)))
+        if len(in_flight) >= max_in_flight:
+            drain_one()
+    while in_flight:
+        drain_one()
+
+    entry["done"] = True
+    checkpoint.save()
+    return shadow.name
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="新しいEmbeddingモデル名 (EMBEDDING_MODEL_NAME に設定する値)")
+    parser.add_argument("--dimensions", type=int, default=settings.EMBEDDING_DIMENSIONS,
+                        help="ベクトルを切り詰める次元数 (EMBEDDING_DIMENSIONS に設定する値。0 で切り詰めない)")
+    parser.add_argument("--source", choices=["chroma", "uploads"], default="chroma",
+                        help="chroma: 既存コレクションのチャンクを読み出す / uploads: UPLOAD_DIR のファイルを再解析する")
+    parser.add_argument("--collections", nargs="*", help="対象の論理コレクション名 (省略時はすべて)")
+    parser.add_argument("--batch-size", type=int, default=512, help="1タスクあたりのチャンク数")
+    parser.add_argument("--encode-batch-size", type=int, default=64, help="モデルに一度に渡すチャンク数")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--checkpoint", default=os.path.join(settings.CHROMA_DB_PATH, "reindex_checkpoint.json"))
+    parser.add_argument("--no-switch", action="store_true", help="シャドーコレクションの作成のみ行い、切り替えない")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    client = chromadb.PersistentClient(path=settings.CHROMA_DB_PATH)
+    aliases = CollectionAliases(settings.CHROMA_DB_PATH)
+    # 対応表・シャドーコレクション・チェックポイントは、次元数を含めた名前で区別する
+    model_key = embedding_key(args.model, args.dimensions)
+    checkpoint = Checkpoint(args.checkpoint, model_key, args.source)
+
+    # 入力の列挙 (コレクション名 -> (チャンク総数, バッチ生成関数))
+    sources: Dict[str, Tuple[int, callable]] = {}
+    if args.source == "chroma":
+        # 読み出し元は、現在のモデル (EMBEDDING_MODEL_NAME) で参照している物理コレクションとする。
+        # 以前の再インデックスで切り替えた後に追加されたチャンクは、シャドーコレクションにしか無いため
+        current_key = embedding_key(settings.EMBEDDING_MODEL_NAME, settings.EMBEDDING_DIMENSIONS)
+        collections = {c.name: c for c in client.list_collections()}
+        logical_names = sorted({(c.metadata or {}).get("reindexed_from") or c.name for c in collections.values()})
+        for collection_name in logical_names:
+            if args.collections and collection_name not in args.collections:
+                continue
+            physical_name = aliases.resolve(current_key, collection_name)
+            collection = collections.get(physical_name)
+            if collection is None:
+                logger.warning(f"Skipping {collection_name}: '{physical_name}' for '{current_key}' does not exist")
+                continue
+            if physical_name == shadow_name(collection_name, model_key):
+                logger.info(f"Skipping {collection_name}: already uses '{model_key}'")
+                continue
+            sources[collection_name] = (
+                collection.count(),
+                lambda start, c=collection: iter_chroma_batches(c, start, args.batch_size),
+            )
+    else:
+        for collection_name, paths in collect_upload_files(settings.UPLOAD_DIR).items():
+            if args.collections and collection_name not in args.collections:
+                continue
+            # ファイルを解析するまでチャンク数は分からないため、総数とETAは lecture/guest のChroma入力時のみ正確
+            sources[collection_name] = (
+                0,
+                lambda start, n=collection_name, p=paths: iter_upload_batches(n, p, start, args.batch_size),
+            )
+
+    total = sum(count for count, _ in sources.values())
+    done = sum(checkpoint.entry(name)["offset"] for name in sources)
+    progress = Progress(total=total, done=done)
+    logger.info(f"Reindexing {len(sources)} collections ({total} chunks) with '{model_key}' using {args.workers} workers")
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    mapping: Dict[str, str] = {}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.model, threads, args.dimensions)) as executor:
+        for collection_name, (_, make_batches) in sources.items():
+            entry = checkpoint.entry(collection_name)
+            if entry["done"]:
+                mapping[collection_name] = entry["shadow"]
+                continue
+            mapping[collection_name] = reindex_collection(
+                client,
+                executor,
+                collection_name,
+                make_batches(entry["offset"]),
+                model_key,
+                checkpoint,
+                progress,
+                encode_batch_size=args.encode_batch_size,
+                max_in_flight=args.workers * 2,
+            )
+
+    elapsed = time.monotonic() - progress.started
+    logger.info(f"Re-embedded {progress.processed} chunks in {elapsed:.1f}s ({progress.processed / max(elapsed, 1e-9):.1f} chunks/s)")
+
+    if args.no_switch:
+        logger.info("Shadow collections are ready. Run again without --no-switch to switch over.")
+        return
+    aliases.switch(model_key, mapping)
+    # 対象のコレクションが無かった場合は、チェックポイントは書き込まれていない
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(args.checkpoint)
+    logger.info(f"Switched {len(mapping)} collections. Set EMBEDDING_MODEL_NAME={args.model} "
+                f"EMBEDDING_DIMENSIONS={args.dimensions} and restart the service.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# rag-python/app/tools/snapshot.py
+"""
+コレクションのスナップショットを書き出し・取り込むオフラインのコマンド (新しいノードの立ち上げやバックアップ用)。
+
+コレクションごとに列形式のファイル (<論理コレクション名>.npz) と、件数・次元数・インデックス設定・SHA-256 などを
+記録したマニフェスト (<論理コレクション名>.json) を書き出す。Embeddingは連続した float32 行列、
+ID・本文・メタデータ (JSON) は UTF-8 のバイト列とオフセットの配列として保持する。
+取り込み時はEmbeddingを計算し直さず、整合性を検査したうえで大きなバッチで書き込む。
+コレクションは書き出し元と同じインデックス設定で作成し、既存のコレクションと設定が異なる場合は取り込まない。
+複数のコレクションはスレッドで並行して処理する (Chromaへの書き込みは1プロセスから行う必要がある)。
+取り込みはサービスを起動する前に行うこと。
+
+    cd rag-python/app && python -m tools.snapshot export --output /backup/snapshots --workers 4
+    cd rag-python/app && python -m tools.snapshot import --input /backup/snapshots --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import chromadb
+import numpy as np
+
+from core.config import settings
+from rag.collection_aliases import CollectionAliases, embedding_key
+from rag.vector_index import build_index_configs
+
+logger = logging.getLogger("snapshot")
+
+SNAPSHOT_FORMAT = "openrag-collection-snapshot"
+# 2: マニフェストにインデックス設定 (コレクションのメタデータの "hnsw:" の項目) を記録する
+SNAPSHOT_VERSION = 2
+
+
+class SnapshotError(Exception):
+    """スナップショットが壊れている、または取り込み先と互換性がない"""
+
+
+# --- 列の符号化 ---
+
+def encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """文字列の列を (UTF-8 バイト列, 各要素の開始位置と終了位置を表す n+1 個のオフセット) にする"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    buffer = data.tobytes()
+    return [buffer[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_paths(directory: str, collection_name: str) -> Tuple[str, str]:
+    return os.path.join(directory, f"{collection_name}.npz"), os.path.join(directory, f"{collection_name}.json")
+
+
+def index_metadata(collection) -> Dict[str, Any]:
+    """距離の種類やHNSWの設定 (作成後は変更できず、検索結果に影響する) をメタデータから取り出す"""
+    return {key: value for key, value in (collection.metadata or {}).items() if key.startswith("hnsw:")}
+
+
+# --- 書き出し ---
+
+def list_logical_collections(client) -> List[str]:
+    """再インデックスで作成したシャドーコレクションは、元の論理コレクション名にまとめる"""
+    names = {(collection.metadata or {}).get("reindexed_from") or collection.name for collection in client.list_collections()}
+    return sorted(names)
+
+
+def read_collection(collection, batch_size: int) -> Tuple[List[str], List[str], List[Optional[dict]], np.ndarray]:
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Optional[dict]] = []
+    blocks: List[np.ndarray] = []
+    offset = 0
+    while True:
+        data = collection.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not data["ids"]:
+            break
+        ids.extend(data["ids"])
+        documents.extend(document or "" for document in data["documents"])
+        metadatas.extend(data["metadatas"])
+        blocks.append(np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1))
+        offset += len(data["ids"])
+    embeddings = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    return ids, documents, metadatas, embeddings
+
+
+def export_collection(client, aliases: CollectionAliases, model_key: str, collection_name: str, output_dir: str, batch_size: int, compress: bool) -> Dict[str, Any]:
+    physical_name = aliases.resolve(model_key, collection_name)
+    collection = client.get_collection(name=physical_name)
+    stored_model = (collection.metadata or {}).get("embedding_model")
+    if stored_model and stored_model != model_key:
+        raise SnapshotError(f"'{physical_name}' was embedded with '{stored_model}', not '{model_key}'")
+
+    ids, documents, metadatas, embeddings = read_collection(collection, batch_size)
+    id_data, id_offsets = encode_strings(ids)
+    document_data, document_offsets = encode_strings(documents)
+    metadata_data, metadata_offsets = encode_strings(
+        [json.dumps(metadata, ensure_ascii=False) if metadata else "" for metadata in metadatas]
+    )
+
+    data_path, manifest_path = snapshot_paths(output_dir, collection_name)
+    # 書き込み途中のファイルが残らないよう、一時ファイルに書いてから置き換える (マニフェストは最後に書く)
+    tmp_path = f"{data_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        (np.savez_compressed if compress else np.savez)(
+            f,
+            embeddings=np.ascontiguousarray(embeddings),
+            id_data=id_data,
+            id_offsets=id_offsets,
+            document_data=document_data,
+            document_offsets=document_offsets,
+            metadata_data=metadata_data,
+            metadata_offsets=metadata_offsets,
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, data_path)
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "collection": collection_name,
+        "source_collection": physical_name,
+        "embedding_model": model_key,
+        "count": len(ids),
+        "dimensions": int(embeddings.shape[1]) if len(ids) else 0,
+        "index": index_metadata(collection),
+        "created_at": time.time(),
+        "file": os.path.basename(data_path),
+        "sha256": file_sha256(data_path),
+    }
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+# --- 取り込み ---
+
+def load_snapshot(manifest_path: str, model_key: str) -> Tuple[Dict[str, Any], List[str], List[str], List[Optional[dict]], np.ndarray]:
+    """マニフェストとの整合性を検査し、(マニフェスト, ID, 本文, メタデータ, Embedding) を返す"""
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"{manifest_path}: unsupported snapshot format")
+    if manifest["embedding_model"] != model_key:
+        raise SnapshotError(
+            f"{manifest_path}: embedded with '{manifest['embedding_model']}' but this node uses '{model_key}'"
+        )
+
+    data_path = os.path.join(os.path.dirname(manifest_path), manifest["file"])
+    if file_sha256(data_path) != manifest["sha256"]:
+        raise SnapshotError(f"{data_path}: checksum mismatch")
+
+    with np.load(data_path, allow_pickle=False) as data:
+        embeddings = data["embeddings"]
+        ids = decode_strings(data["id_data"], data["id_offsets"])
+        documents = decode_strings(data["document_data"], data["document_offsets"])
+        metadatas = [json.loads(value) if value else None for value in decode_strings(data["metadata_data"], data["metadata_offsets"])]
+
+    count = manifest["count"]
+    if not (len(ids) == len(documents) == len(metadatas) == embeddings.shape[0] == count):
+        raise SnapshotError(f"{data_path}: expected {count} rows")
+    if count and embeddings.shape[1] != manifest["dimensions"]:
+        raise SnapshotError(f"{data_path}: expected {manifest['dimensions']} dimensions, got {embeddings.shape[1]}")
+    if len(set(ids)) != count:
+        raise SnapshotError(f"{data_path}: duplicate ids")
+    if not np.isfinite(embeddings).all():
+        raise SnapshotError(f"{data_path}: embeddings contain NaN or Inf")
+    return manifest, ids, documents, metadatas, embeddings
+
+
+def import_collection(manager, manifest_path: str, batch_size: int, verify_only: bool) -> Dict[str, Any]:
+    manifest, ids, documents, metadatas, embeddings = load_snapshot(manifest_path, manager.embedding_key)
+    if verify_only or not ids:
+        return manifest
+
+    collection_name = manifest["collection"]
+    # 取り込み先のノードの設定ではなく、書き出し元と同じインデックス設定でコレクションを作成する
+    collection = manager.get_collection(collection_name, index_metadata=manifest["index"])
+    existing = index_metadata(collection)
+    if existing != manifest["index"]:
+        raise SnapshotError(
+            f"'{collection.name}' already exists with index settings {existing}, but the snapshot uses {manifest['index']}"
+        )
+    manager.add_embeddings(collection_name, ids, embeddings, documents, metadatas, batch_size=batch_size)
+    # 書き込まれた件数を確認する (既存のコレクションに取り込んだ場合は、既存のチャンクの分だけ多くなる)
+    count = collection.count()
+    if count < len(ids):
+        raise SnapshotError(f"'{collection_name}' has {count} chunks after importing {len(ids)}")
+    return manifest
+
+
+# --- 本体 ---
+
+def run_parallel(tasks: Dict[str, Any], workers: int, action: str) -> bool:
+    """コレクションごとの処理を並行して実行し、すべて成功したかを返す (action はログ用の動詞)"""
+    started = time.monotonic()
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot") as executor:
+        futures = {executor.submit(task): name for name, task in tasks.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                manifest = future.result()
+                logger.info(f"{action} '{name}': {manifest['count']} chunks, {manifest['dimensions']} dimensions")
+            except Exception as e:
+                failed.append(name)
+                logger.error(f"{action} failed for '{name}': {e}")
+    logger.info(f"{action} {len(tasks) - len(failed)}/{len(tasks)} collections in {time.monotonic() - started:.1f}s")
+    return not failed
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="コレクションをスナップショットに書き出す")
+    export_parser.add_argument("--output", required=True, help="書き出し先のディレクトリ")
+    export_parser.add_argument("--compress", action="store_true", help="zip圧縮する (ファイルは小さくなるが遅くなる)")
+
+    import_parser = subparsers.add_parser("import", help="スナップショットをコレクションに取り込む")
+    import_parser.add_argument("--input", required=True, help="スナップショットのディレクトリ")
+    import_parser.add_argument("--verify-only", action="store_true", help="整合性の検査のみ行い、取り込まない")
+
+    for sub in (export_parser, import_parser):
+        sub.add_argument("--collections", nargs="*", help="対象の論理コレクション名 (省略時はすべて)")
+        sub.add_argument("--batch-size", type=int, default=5000, help="Chromaから読み出す・書き込む1回あたりのチャンク数")
+        sub.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    model_key = embedding_key(settings.EMBEDDING_MODEL_NAME, settings.EMBEDDING_DIMENSIONS)
+
+    if args.command == "export":
+        os.makedirs(args.output, exist_ok=True)
+        client = chromadb.PersistentClient(path=settings.CHROMA_DB_PATH)
+        aliases = CollectionAliases(settings.CHROMA_DB_PATH)
+        names = [name for name in list_logical_collections(client) if not args.collections or name in args.collections]
+        tasks = {
+            name: lambda name=name: export_collection(client, aliases, model_key, name, args.output, args.batch_size, args.compress)
+            for name in names
+        }
+        ok = run_parallel(tasks, args.workers, "Exported")
+    else:
+        from rag.chroma_manager import ChromaManager
+
+        manager = ChromaManager(
+            persist_directory=settings.CHROMA_DB_PATH,
+            embedding_model_name=settings.EMBEDDING_MODEL_NAME,
+            index_configs=build_index_configs(settings),
+            embedding_dimensions=settings.EMBEDDING_DIMENSIONS,
+            defer_model_loading=True,
+        )
+        manifests = sorted(
+            os.path.join(args.input, filename)
+            for filename in os.listdir(args.input)
+            if filename.endswith(".json")
+        )
+        tasks = {
+            os.path.splitext(os.path.basename(path))[0]: lambda path=path: import_collection(manager, path, args.batch_size, args.verify_only)
+            for path in manifests
+            if not args.collections or os.path.splitext(os.path.basename(path))[0] in args.collections
+        }
+        ok = run_parallel(tasks, args.workers, "Verified" if args.verify_only else "Imported")
+
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
+import asyncio
 import os
-import requests
+import sys
 import uuid
 
+import aiohttp
+import requests
+
+# フロントエンドと共通のAPIクライアント (接続プール・再試行・非同期アップロード) を使う
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend-streamlit", "app"))
+from api_client.async_client import AsyncAPIClient  # noqa: E402
+from api_client.transport import request  # noqa: E402
+
 # --- 設定 ---
 # 認証情報 (ここにメールアドレスとパスワードを入力)
 # ゲストとしてアップロードする場合は、両方を "Guest" に設定
@@ -11,6 +20,12 @@ PASSWORD = "sample@gmail.com"  # 例: "password123"
 # アップロードするファイルがあるディレクトリ
 UPLOAD_DIR = "upload_files_test"
 
+# 同時にアップロードするファイル数。RAGサービスのアップロードのレーンの同時実行数
+# (AUTH_UPLOAD_MAX_CONCURRENCY / GUEST_UPLOAD_MAX_CONCURRENCY) を超えないようにする。
+# レート制限 (429) を受けた場合は、Retry-After に従って受け付けられるまで再試行する
+MAX_CONCURRENT_UPLOADS = 2
+GUEST_MAX_CONCURRENT_UPLOADS = 1
+
 # APIのベースURL
 API_GO_URL = "http://localhost:8000"
 API_PYTHON_RAG_URL = "http://localhost:8001"
@@ -27,10 +42,9 @@ if not os.path.exists(UPLOAD_DIR):
 
 def login(email, password):
     """Go APIにログインして認証トークンを取得する"""
-    url = f"{API_GO_URL}/api/v1/users/login"
     payload = {"email": email, "password": password}
     try:
-        response = requests.post(url, json=payload)
+        response = request(API_GO_URL, "POST", "/api/v1/users/login", json=payload, timeout=30)
         response.raise_for_status()
         return response.json().get("token")
     except requests.exceptions.RequestException as e:
@@ -39,10 +53,9 @@ def login(email, password):
 
 def get_first_lecture_id(token):
     """Go APIから最初のワークスペースIDを取得する"""
-    url = f"{API_GO_URL}/api/v1/lectures"
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.get(url, headers=headers)
+        response = request(API_GO_URL, "GET", "/api/v1/lectures", headers=headers, timeout=30)
         response.raise_for_status()
         lectures = response.json()
         if lectures:
@@ -56,42 +69,48 @@ def get_first_lecture_id(token):
 
 def upload_files_for_user(token, lecture_id, directory):
     """認証ユーザーとしてファイルをアップロードする"""
-    url = f"{API_PYTHON_RAG_URL}/api/v1/lectures/{lecture_id}/upload"
-    headers = {"Authorization": f"Bearer {token}"}
-    upload_files(url, directory, headers)
+    path = f"/api/v1/lectures/{lecture_id}/upload"
+    asyncio.run(upload_files(path, directory, token, max_concurrency=MAX_CONCURRENT_UPLOADS))
 
 def upload_files_for_guest(directory):
     """ゲストとしてファイルをアップロードする"""
     guest_id = str(uuid.uuid4())
-    url = f"{API_PYTHON_RAG_URL}/api/v1/guest/{guest_id}/upload"
+    path = f"/api/v1/guest/{guest_id}/upload"
     print(f"ゲストID: {guest_id} でアップロードします。")
-    upload_files(url, directory)
+    asyncio.run(upload_files(path, directory, max_concurrency=GUEST_MAX_CONCURRENT_UPLOADS))
 
-def upload_files(url, directory, headers=None):
-    """指定されたURLにファイルを一括でアップロードする"""
-    files_to_upload = []
-    for filename in os.listdir(directory):
-        path = os.path.join(directory, filename)
-        if os.path.isfile(path):
-            files_to_upload.append(('file', (filename, open(path, 'rb'), 'application/octet-stream')))
-
-    if not files_to_upload:
+async def upload_files(path, directory, token=None, max_concurrency=MAX_CONCURRENT_UPLOADS):
+    """
+    指定されたパスにファイルを並行してアップロードする
+    rag-pythonは単一の`file`を想定しているため、1ファイルずつ送信する (ファイルは送信時に開く)
+    """
+    file_paths = [
+        os.path.join(directory, filename)
+        for filename in sorted(os.listdir(directory))
+        if os.path.isfile(os.path.join(directory, filename))
+    ]
+    if not file_paths:
         print("アップロードするファイルがありません。")
         return
 
-    try:
-        # rag-pythonは単一の`file`を想定しているため、1ファイルずつ送信する
-        for file_tuple in files_to_upload:
-            print(f"{file_tuple[1][0]} をアップロード中...")
-            # `files`パラメータは辞書型である必要がある
-            response = requests.post(url, files={'file': file_tuple[1]}, headers=headers, timeout=300)
-            response.raise_for_status()
-            print(f"  -> 完了: {response.json()}")
+    async def upload_one(client, file_path):
+        filename = os.path.basename(file_path)
+        print(f"{filename} をアップロード中...")
+        try:
+            result = await client.upload_file(file_path, path)
+            print(f"  -> 完了: {filename}: {result}")
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"  -> {filename} のアップロード中にエラーが発生しました: {e}")
+            return False
+
+    async with AsyncAPIClient(API_PYTHON_RAG_URL, token=token, max_concurrency=max_concurrency) as client:
+        results = await asyncio.gather(*(upload_one(client, file_path) for file_path in file_paths))
+
+    if all(results):
         print("すべてのファイルのアップロードが完了しました。")
-    except requests.exceptions.RequestException as e:
-        print(f"アップロード中にエラーが発生しました: {e}")
-        if e.response:
-            print(f"エラー詳細: {e.response.text}")
+    else:
+        print(f"{results.count(False)} 件のファイルのアップロードに失敗しました。")
 
 # --- メイン処理 ---
 if __name__ == "__main__":